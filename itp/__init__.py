@@ -0,0 +1,4 @@
+from .itp import (  # noqa
+    __version__, URL_ENTITY, USER_ENTITY, TAG_ENTITY, EMOJI_ENTITY, ENTITY_NAMES, CODEPOINTS, UTF16,
+    ParseResult, ParseContext, ParseCache, Instrumentation, Parser, Template, Renderer, HTMLRenderer,
+    MarkdownRenderer, JSONRenderer, escape)
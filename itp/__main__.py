@@ -0,0 +1,8 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Run the `itp` command with `python -m itp`"""
+import sys
+
+from .cli import main
+
+sys.exit(main())
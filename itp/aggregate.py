@@ -0,0 +1,208 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Count hashtags and mentions over streams of captions in bounded memory
+
+An EntityCounter counts the hashtags and usernames of every caption it is
+given, without keeping the captions or their results. Each count is kept by
+a HeavyHitters counter, which is exact until it holds `capacity` distinct
+keys and then becomes a Space-Saving summary of the most frequent ones.
+Counters of separate workers can be merged.
+"""
+from __future__ import unicode_literals
+import heapq
+from collections import Counter
+from operator import itemgetter
+
+from .itp import Parser, ParseContext, USER_ENTITY, TAG_ENTITY
+
+
+def normalize(value):
+    """Return the key a hashtag or username is counted under"""
+    return value.lower()
+
+
+class HeavyHitters(object):
+    """Count keys exactly up to `capacity` distinct keys, then approximately
+
+    Once more keys are seen the least frequent ones are dropped, and the
+    counter works as a Space-Saving summary (Metwally et al., 2005): a new
+    key replaces the key with the lowest count and takes over that count,
+    which is recorded as its error. Counts are then upper bounds, at most
+    `error(key)` too high, and every key seen more than
+    `total / capacity` times is kept.
+    """
+
+    def __init__(self, capacity=100000):
+        if capacity < 1:
+            raise ValueError('capacity must be at least 1')
+        self.capacity = capacity
+        self.total = 0
+        self._counts = Counter()
+        self._errors = {}
+        # A min-heap with one `(count, key)` entry per key once the counts
+        # are approximate, counts in it may be lower than the actual ones
+        self._heap = None
+
+    @property
+    def exact(self):
+        """True while every count is exact"""
+        return self._heap is None
+
+    def __len__(self):
+        return len(self._counts)
+
+    def __contains__(self, key):
+        return key in self._counts
+
+    def count(self, key):
+        """Return the (estimated) count of a key, 0 if it is not kept"""
+        return self._counts.get(key, 0)
+
+    def error(self, key):
+        """Return how much the count of a key may be too high"""
+        return self._errors.get(key, 0)
+
+    def add(self, key, count=1):
+        """Count a key `count` times"""
+        self.total += count
+        counts = self._counts
+        if key in counts:
+            counts[key] += count
+        elif self._heap is None:
+            counts[key] = count
+            if len(counts) > self.capacity:
+                self._approximate()
+        else:
+            floor = self._pop_min()
+            counts[key] = floor + count
+            self._errors[key] = floor
+            heapq.heappush(self._heap, (floor + count, key))
+
+    def update(self, keys):
+        """Count every key in an iterable once"""
+        if self._heap is None:
+            keys = list(keys)
+            self._counts.update(keys)
+            self.total += len(keys)
+            if len(self._counts) > self.capacity:
+                self._approximate()
+        else:
+            add = self.add
+            for key in keys:
+                add(key)
+
+    def most_common(self, n=None):
+        """Return a list of the n most common `(key, count)` pairs"""
+        if n is None:
+            return sorted(self._counts.items(), key=itemgetter(1), reverse=True)
+        return heapq.nlargest(n, self._counts.items(), key=itemgetter(1))
+
+    def merge(self, other):
+        """Add the counts of another HeavyHitters, e.g. of another worker
+
+        A key missing from an approximate counter may have been counted up
+        to its lowest count, which is added to the count and error of the
+        merged key (Agarwal et al., 2012).
+        """
+        floor, other_floor = self._floor(), other._floor()
+        counts, other_counts = self._counts, other._counts
+        errors, other_errors = self._errors, other._errors
+        merged = Counter()
+        merged_errors = {}
+        for key in set(counts).union(other_counts):
+            merged[key] = counts.get(key, floor) + other_counts.get(key, other_floor)
+            error = (errors.get(key, 0) if key in counts else floor) + \
+                (other_errors.get(key, 0) if key in other_counts else other_floor)
+            if error:
+                merged_errors[key] = error
+
+        self.total += other.total
+        self._counts = merged
+        self._errors = merged_errors
+        if self._heap is None and other._heap is None and len(merged) <= self.capacity:
+            return
+        self._approximate()
+
+    def _floor(self):
+        """Return the highest count a key that is not kept may have"""
+        if self._heap is None:
+            return 0
+        count, key = self._heap[0]
+        while count != self._counts[key]:
+            heapq.heapreplace(self._heap, (self._counts[key], key))
+            count, key = self._heap[0]
+        return count
+
+    def _pop_min(self):
+        """Drop the key with the lowest count, return its count"""
+        count = self._floor()
+        key = heapq.heappop(self._heap)[1]
+        del self._counts[key]
+        self._errors.pop(key, None)
+        return count
+
+    def _approximate(self):
+        """Keep the `capacity` most common keys, and index them by count"""
+        counts = self._counts
+        if len(counts) > self.capacity:
+            kept = heapq.nlargest(self.capacity, counts.items(), key=itemgetter(1))
+            self._counts = counts = Counter(dict(kept))
+            self._errors = dict((key, error) for key, error in self._errors.items()
+                                if key in counts)
+        self._heap = [(count, key) for key, count in counts.items()]
+        heapq.heapify(self._heap)
+
+
+class EntityCounter(object):
+    """Count the hashtags and usernames of a stream of captions
+
+    Keys are normalized with `normalize`, by default lower case, as
+    hashtags and usernames are matched case insensitively. `tags` and
+    `users` are HeavyHitters of at most `capacity` keys each. The default
+    parser only looks for hashtags and usernames.
+    """
+
+    def __init__(self, capacity=100000, parser=None, normalize=normalize):
+        self.parser = Parser(entities=('tags', 'users')) if parser is None else parser
+        self.normalize = normalize
+        self.captions = 0
+        self.tags = HeavyHitters(capacity)
+        self.users = HeavyHitters(capacity)
+
+    def add(self, text):
+        """Count the entities of a caption"""
+        self._count(text, self.parser._scan(ParseContext(), text))
+
+    def update(self, texts):
+        """Count the entities of every caption in an iterable"""
+        scan, ctx, count = self.parser._scan, ParseContext(), self._count
+        for text in texts:
+            count(text, scan(ctx, text))
+
+    def add_result(self, result):
+        """Count the entities of a ParseResult"""
+        self._count(result._text, result._entities)
+
+    def _count(self, text, records):
+        self.captions += 1
+        if not records:
+            return
+        normalize = self.normalize
+        tags = []
+        users = []
+        for i in range(0, len(records), 3):
+            kind = records[i]
+            if kind == TAG_ENTITY:
+                tags.append(normalize(text[records[i + 1] + 1:records[i + 2]]))
+            elif kind == USER_ENTITY:
+                users.append(normalize(text[records[i + 1] + 1:records[i + 2]]))
+        if tags:
+            self.tags.update(tags)
+        if users:
+            self.users.update(users)
+
+    def merge(self, other):
+        """Add the counts of another EntityCounter"""
+        self.captions += other.captions
+        self.tags.merge(other.tags)
+        self.users.merge(other.users)
@@ -0,0 +1,219 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Parse captions and resolve shortlinks from asyncio code (Python 3.6+)
+
+Short texts are parsed on the event loop, where that is cheaper than
+handing them to another thread. Larger chunks of texts are scanned in an
+executor, e.g. a ProcessPoolExecutor, so the loop keeps serving other
+tasks. Shortlinks are followed by `utils.ShortlinkResolver` on a thread
+pool, with the number of links in flight and per host bounded in the loop.
+"""
+from __future__ import unicode_literals
+import asyncio
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from .itp import Parser, ParseResult
+from .parallel import DEFAULT_CHUNKSIZE, _parse_chunk
+
+try:
+    from urllib.parse import urlsplit  # Python3
+except ImportError:
+    from urlparse import urlsplit
+
+try:
+    _running_loop = asyncio.get_running_loop  # Python 3.7+
+except AttributeError:
+    _running_loop = asyncio.get_event_loop
+
+# Texts, or chunks of texts, of at most this many characters are parsed on
+# the event loop; parsing them takes in the order of a millisecond
+INLINE_LENGTH = 2000
+
+
+async def _iterate(items):
+    """Iterate over an iterable or an asynchronous iterable"""
+    if hasattr(items, '__aiter__'):
+        async for item in items:
+            yield item
+    else:
+        for item in items:
+            yield item
+
+
+async def _chunks(texts, chunksize):
+    """Split an (asynchronous) iterable into lists of at most chunksize items"""
+    chunk = []
+    async for text in _iterate(texts):
+        chunk.append(text)
+        if len(chunk) >= chunksize:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+async def parse(text, html=True, parser=None, executor=None):
+    """Parse a text, in `executor` if it is longer than INLINE_LENGTH
+
+    `executor` defaults to the loop's default executor.
+    """
+    if parser is None:
+        parser = Parser()
+    if len(text) <= INLINE_LENGTH:
+        return parser.parse(text, html=html)
+    loop = _running_loop()
+    entities = await loop.run_in_executor(executor, _parse_chunk, parser, [text])
+    return ParseResult.from_entities(parser, text, entities[0], html)
+
+
+async def parse_many(texts, html=True, parser=None, executor=None,
+                     chunksize=DEFAULT_CHUNKSIZE, max_pending=4):
+    """Parse an iterable or asynchronous iterable of texts, yield ParseResults
+
+    Texts are taken `chunksize` at a time. A chunk of at most INLINE_LENGTH
+    characters is parsed on the loop, larger ones are scanned in
+    `executor`. Results are yielded in input order. At most `max_pending`
+    chunks are in the executor at a time, so texts are only read as fast
+    as results are consumed. Pending chunks are cancelled when the
+    generator is closed.
+    """
+    if chunksize < 1:
+        raise ValueError('chunksize must be at least 1')
+    if parser is None:
+        parser = Parser()
+    loop = _running_loop()
+    pending = deque()
+    try:
+        async for chunk in _chunks(texts, chunksize):
+            if not pending and sum(map(len, chunk)) <= INLINE_LENGTH:
+                for text in chunk:
+                    yield parser.parse(text, html=html)
+                # Let other tasks run between inline chunks
+                await asyncio.sleep(0)
+                continue
+
+            pending.append((chunk, loop.run_in_executor(executor, _parse_chunk, parser, chunk)))
+            if len(pending) >= max_pending:
+                chunk, future = pending.popleft()
+                for text, entities in zip(chunk, await future):
+                    yield ParseResult.from_entities(parser, text, entities, html)
+
+        while pending:
+            chunk, future = pending.popleft()
+            for text, entities in zip(chunk, await future):
+                yield ParseResult.from_entities(parser, text, entities, html)
+    finally:
+        for chunk, future in pending:
+            future.cancel()
+
+
+class ShortlinkResolver(object):
+    """Follow the redirects of shortlinks without blocking the event loop
+
+    Takes the same arguments as `utils.ShortlinkResolver`, which follows
+    each link on a pool of `max_workers` threads. At most `max_per_host`
+    links of the same host are followed at a time. Cancelling a task stops
+    waiting for its link at once, its thread finishes the request within
+    `timeout`. Needs the Requests library.
+    """
+
+    def __init__(self, max_workers=10, max_per_host=2, timeout=5,
+                 max_redirects=10, session=None, cache=None):
+        from .utils import ShortlinkResolver as Resolver
+        self.max_workers = max_workers
+        self.max_per_host = max_per_host
+        self.cache = cache
+        self._resolver = Resolver(max_workers=max_workers, max_per_host=max_per_host,
+                                  timeout=timeout, max_redirects=max_redirects,
+                                  session=session)
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+        self._host_semaphores = {}
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        # Waiting for the pool threads would block the loop
+        await _running_loop().run_in_executor(None, self.close)
+
+    def close(self):
+        """Shut down the thread pool and close the session
+
+        Waits for the links still being followed, at most `timeout` per
+        request, as their threads use the session.
+        """
+        self._executor.shutdown(wait=True)
+        self._resolver.close()
+
+    async def follow(self, shortlink):
+        """Return the list of URLs a shortlink redirects through
+
+        The cache, which may be on disk, is used from the thread pool.
+        """
+        loop = _running_loop()
+        if self.cache is not None:
+            urls = await loop.run_in_executor(self._executor, self.cache.get, shortlink)
+            if urls is not None:
+                return urls
+
+        host = urlsplit(shortlink).netloc.lower()
+        semaphore = self._host_semaphores.get(host)
+        if semaphore is None:
+            semaphore = self._host_semaphores[host] = asyncio.Semaphore(self.max_per_host)
+        async with semaphore:
+            urls = await loop.run_in_executor(self._executor, self._resolver.follow, shortlink)
+
+        if self.cache is not None:
+            await loop.run_in_executor(self._executor, self.cache.set, shortlink, urls)
+        return urls
+
+    async def _follow_pair(self, shortlink):
+        return shortlink, await self.follow(shortlink)
+
+    async def stream(self, shortlinks, max_pending=None):
+        """Yield `(shortlink, urls)` for an (asynchronous) iterable of links
+
+        Pairs are yielded as links are resolved, each link once. At most
+        `max_pending` links, by default twice `max_workers`, are resolved
+        at a time, and links are only read when there is room for them.
+        Links still pending are cancelled when the generator is closed.
+        """
+        if max_pending is None:
+            max_pending = 2 * self.max_workers
+        seen = set()
+        pending = set()
+        try:
+            async for shortlink in _iterate(shortlinks):
+                if shortlink in seen:
+                    continue
+                seen.add(shortlink)
+                pending.add(asyncio.ensure_future(self._follow_pair(shortlink)))
+                if len(pending) >= max_pending:
+                    done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                    for task in done:
+                        yield task.result()
+
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    yield task.result()
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def resolve(self, shortlinks):
+        """Follow redirects in list of shortlinks, return dict of resulting URLs"""
+        resolved = {}
+        async for shortlink, urls in self.stream(shortlinks):
+            resolved[shortlink] = urls
+        return resolved
+
+
+async def follow_shortlinks(shortlinks, **kwargs):
+    """Follow redirects in list of shortlinks, return dict of resulting URLs
+
+    Keyword arguments are passed on to ShortlinkResolver.
+    """
+    async with ShortlinkResolver(**kwargs) as resolver:
+        return await resolver.resolve(shortlinks)
@@ -0,0 +1,186 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Measure parser throughput, latency and allocations on a synthetic corpus
+
+Run `python -m itp.benchmarks --help` for the command line interface. Every
+corpus category is parsed in two modes: `html`, which builds the HTML of
+each result, and `text`, which parses with `html=False` and builds the
+entity lists. Results can be saved as a JSON baseline that later runs are
+compared against.
+"""
+from __future__ import unicode_literals, division
+import gc
+import json
+import platform
+import timeit
+
+try:
+    import tracemalloc  # Python 3.4+
+except ImportError:
+    tracemalloc = None
+
+from ..itp import Parser, __version__
+from .corpus import CATEGORIES, generate
+
+MODES = ('html', 'text')
+
+# The metrics compared against a baseline, and whether higher is better
+GATED_METRICS = (('captions_per_sec', True), ('peak_bytes_per_call', False))
+
+
+def _call(parser, mode):
+    """Return a function that parses one caption the way `mode` uses it"""
+    if mode == 'html':
+        def call(text):
+            return parser.parse(text).html
+    else:
+        def call(text):
+            result = parser.parse(text, html=False)
+            return result.urls, result.users, result.tags, result.emojis
+    return call
+
+
+def _percentile(ordered, fraction):
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def measure(texts, call, rounds=5):
+    """Time `call` on every text, return a dict of metrics
+
+    Throughput is taken from the fastest of `rounds` passes over the texts,
+    latency percentiles from every call. Allocations are traced in one
+    extra pass with tracemalloc, where available: the peak of the memory
+    allocated during a call, which includes what the call frees again, and
+    the memory still held by the returned values, both averaged per call.
+    Traces already taken by the caller are cleared before Python 3.9.
+    """
+    timer = timeit.default_timer
+    latencies = []
+    best = None
+    gc.collect()
+    for _ in range(rounds):
+        started = timer()
+        for text in texts:
+            before = timer()
+            call(text)
+            latencies.append(timer() - before)
+        elapsed = timer() - started
+        best = elapsed if best is None else min(best, elapsed)
+
+    latencies.sort()
+    metrics = {
+        'captions': len(texts),
+        'captions_per_sec': len(texts) / best if best else 0.0,
+        'p50_us': _percentile(latencies, 0.5) * 1e6,
+        'p99_us': _percentile(latencies, 0.99) * 1e6,
+        'peak_bytes_per_call': None,
+        'bytes_per_call': None,
+    }
+
+    if tracemalloc is not None:
+        tracing = tracemalloc.is_tracing()
+        if not tracing:
+            tracemalloc.start()
+        reset_peak = getattr(tracemalloc, 'reset_peak', None)  # Python 3.9+
+        get_traced_memory = tracemalloc.get_traced_memory
+        peak_bytes = held_bytes = 0
+        gc.collect()
+        for text in texts:
+            if reset_peak is not None:
+                reset_peak()
+                start = get_traced_memory()[0]
+            else:
+                # Forgets the traces, so only what the call allocates counts
+                tracemalloc.clear_traces()
+                start = 0
+            result = call(text)
+            current, peak = get_traced_memory()
+            peak_bytes += peak - start
+            held_bytes += current - start
+            del result
+        if not tracing:
+            tracemalloc.stop()
+        metrics['peak_bytes_per_call'] = peak_bytes / len(texts)
+        metrics['bytes_per_call'] = held_bytes / len(texts)
+    return metrics
+
+
+def run(corpus=None, parser=None, modes=MODES, rounds=5):
+    """Benchmark a parser on a corpus, return a JSON serialisable report
+
+    `corpus` is a dict of category name to a list of captions and defaults
+    to `corpus.generate()`. The report maps `category/mode` names to the
+    metrics returned by `measure()`.
+    """
+    if corpus is None:
+        corpus = generate()
+    if parser is None:
+        parser = Parser()
+
+    results = {}
+    names = [name for name in CATEGORIES if name in corpus]
+    names.extend(sorted(name for name in corpus if name not in CATEGORIES))
+    for name in names:
+        for mode in modes:
+            results['%s/%s' % (name, mode)] = measure(corpus[name], _call(parser, mode), rounds)
+
+    return {
+        'itp': __version__,
+        'python': platform.python_version(),
+        'implementation': platform.python_implementation(),
+        'results': results,
+    }
+
+
+def compare(baseline, report, threshold=0.2):
+    """Return a list of regressions of a report against a baseline report
+
+    A benchmark regresses when its throughput is more than `threshold` (a
+    fraction) below the baseline, or the peak of the memory it allocates
+    per call is more than `threshold` above the baseline. Benchmarks missing from either report are
+    ignored.
+    """
+    regressions = []
+    for name, metrics in sorted(report['results'].items()):
+        expected = baseline['results'].get(name)
+        if expected is None:
+            continue
+        for metric, higher_is_better in GATED_METRICS:
+            old, new = expected.get(metric), metrics.get(metric)
+            if old is None or new is None:
+                continue
+            if higher_is_better:
+                regressed = new < old * (1 - threshold)
+            else:
+                regressed = new > old * (1 + threshold) and new - old >= 1
+            if regressed:
+                regressions.append('%s: %s %.1f, baseline %.1f' % (name, metric, new, old))
+    return regressions
+
+
+def save(report, path):
+    """Write a report as a JSON baseline"""
+    with open(path, 'w') as f:
+        json.dump(report, f, indent=2, sort_keys=True)
+        f.write('\n')
+
+
+def load(path):
+    """Read a JSON baseline"""
+    with open(path) as f:
+        return json.load(f)
+
+
+def format_report(report):
+    """Return a report as a text table"""
+    lines = ['%-26s %12s %10s %10s %10s %12s' % (
+        'benchmark', 'captions/s', 'p50 us', 'p99 us', 'peak bytes', 'bytes')]
+    for name, metrics in sorted(report['results'].items()):
+        lines.append('%-26s %12.0f %10.1f %10.1f %10s %12s' % (
+            name, metrics['captions_per_sec'], metrics['p50_us'], metrics['p99_us'],
+            _optional(metrics['peak_bytes_per_call']), _optional(metrics['bytes_per_call'])))
+    return '\n'.join(lines)
+
+
+def _optional(value):
+    return '-' if value is None else '%.1f' % value
@@ -0,0 +1,50 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Command line interface of the benchmarks, see `--help`"""
+from __future__ import unicode_literals, print_function
+import argparse
+import sys
+
+from . import MODES, compare, format_report, load, run, save
+from .corpus import CATEGORIES, generate
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='python -m itp.benchmarks',
+        description='Benchmark the caption parser on a synthetic corpus.')
+    parser.add_argument('--size', type=int, default=1000,
+                        help='captions per category (default: %(default)s)')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='corpus random seed (default: %(default)s)')
+    parser.add_argument('--rounds', type=int, default=5,
+                        help='timed passes over each category (default: %(default)s)')
+    parser.add_argument('--category', action='append', choices=CATEGORIES,
+                        help='only run this category, may be repeated')
+    parser.add_argument('--mode', action='append', choices=MODES,
+                        help='only run this mode, may be repeated')
+    parser.add_argument('--save', metavar='FILE', help='write the results as a JSON baseline')
+    parser.add_argument('--baseline', metavar='FILE',
+                        help='compare against a JSON baseline, exit with status 1 on regressions')
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help='allowed slowdown as a fraction of the baseline (default: %(default)s)')
+    args = parser.parse_args(argv)
+
+    corpus = generate(args.size, args.seed, args.category or CATEGORIES)
+    report = run(corpus, modes=args.mode or MODES, rounds=args.rounds)
+    print(format_report(report))
+
+    if args.save:
+        save(report, args.save)
+
+    if args.baseline:
+        regressions = compare(load(args.baseline), report, args.threshold)
+        for regression in regressions:
+            print('REGRESSION %s' % regression)
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
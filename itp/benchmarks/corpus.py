@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""A synthetic, reproducible caption corpus for the benchmarks"""
+from __future__ import unicode_literals
+import random
+
+WORDS = (
+    'love', 'summer', 'vibes', 'coffee', 'the', 'and', 'with', 'my', 'new',
+    'today', 'beach', 'sunset', 'friends', 'happy', 'weekend', 'food', 'style',
+    'travel', 'photo', 'life', 'goals', 'morning', 'best', 'day', 'ever',
+    'café', 'über', 'naïve', '서울', 'niño', 'crème', 'brûlée',
+)
+EMOJIS = (
+    '\U0001f600', '\U0001f60d', '\U0001f525', '\u2764\ufe0f', '\U0001f64c',
+    '\U0001f44d\U0001f3fd', '\U0001f1ec\U0001f1e7', '\U0001f469\u200d\U0001f4bb',
+    '\u2728', '\U0001f338', '1\ufe0f\u20e3', '\U0001f602',
+)
+DOMAINS = ('example.com', 'bit.ly', 't.co', 'www.instagram.com', 'shop.example.co.uk')
+
+# Category names, in the order they are reported
+CATEGORIES = ('comments', 'hashtag_walls', 'emoji_dense', 'url_heavy', 'pathological')
+
+
+def _words(rng, count):
+    return [rng.choice(WORDS) for _ in range(count)]
+
+
+def _user(rng):
+    return '@%s%s%d' % (rng.choice(WORDS), rng.choice(('', '.', '_')), rng.randint(0, 999))
+
+
+def _tag(rng):
+    return '#%s%s' % (rng.choice(WORDS), rng.choice(('', '', str(rng.randint(0, 99)))))
+
+
+def _url(rng):
+    url = '%s://%s/%s' % (rng.choice(('http', 'https')), rng.choice(DOMAINS),
+                          '/'.join(_words(rng, rng.randint(0, 3))))
+    if rng.random() < 0.3:
+        url += '?id=%d&ref=%s' % (rng.randint(0, 10 ** 6), rng.choice(WORDS))
+    return url
+
+
+def comment(rng):
+    """A short comment, sometimes a reply"""
+    words = _words(rng, rng.randint(1, 8))
+    if rng.random() < 0.4:
+        words.insert(0, _user(rng))
+    if rng.random() < 0.3:
+        words.append(rng.choice(EMOJIS))
+    return ' '.join(words)
+
+
+def hashtag_wall(rng):
+    """A caption followed by a block of hashtags"""
+    words = _words(rng, rng.randint(3, 15))
+    words.append('.\n.\n.\n')
+    words.extend(_tag(rng) for _ in range(rng.randint(10, 30)))
+    return ' '.join(words)
+
+
+def emoji_dense(rng):
+    """Mostly emojis, with some words and mentions"""
+    parts = []
+    for _ in range(rng.randint(5, 40)):
+        roll = rng.random()
+        if roll < 0.6:
+            parts.append(rng.choice(EMOJIS) * rng.randint(1, 3))
+        elif roll < 0.9:
+            parts.append(rng.choice(WORDS))
+        else:
+            parts.append(_user(rng))
+    return ' '.join(parts)
+
+
+def url_heavy(rng):
+    """A post with several links"""
+    words = _words(rng, rng.randint(2, 10))
+    for _ in range(rng.randint(1, 5)):
+        words.insert(rng.randint(0, len(words)), _url(rng))
+    if rng.random() < 0.5:
+        words.append('www.%s' % rng.choice(DOMAINS))
+    return ' '.join(words)
+
+
+def pathological(rng):
+    """Long inputs that stress the matchers"""
+    kind = rng.randint(0, 6)
+    if kind == 0:
+        return ' '.join(_words(rng, 800))
+    elif kind == 1:
+        return '#' * rng.randint(500, 2000)
+    elif kind == 2:
+        return '#a' * rng.randint(200, 1000)
+    elif kind == 3:
+        return '@' + 'a.' * rng.randint(200, 500)
+    elif kind == 4:
+        return 'http://example.com/' + 'a,' * rng.randint(200, 500)
+    elif kind == 5:
+        return ''.join(rng.choice(EMOJIS) for _ in range(rng.randint(200, 800)))
+    # A domain of alternating labels and hyphens with no top level domain
+    return 'www.' + 'a-' * rng.randint(200, 1000) + '.'
+
+
+GENERATORS = {
+    'comments': comment,
+    'hashtag_walls': hashtag_wall,
+    'emoji_dense': emoji_dense,
+    'url_heavy': url_heavy,
+    'pathological': pathological,
+}
+
+
+def generate(size=1000, seed=0, categories=CATEGORIES):
+    """Return a dict of category name to a list of `size` captions
+
+    The same size and seed always give the same corpus. The pathological
+    category is ten times smaller as its captions are long.
+    """
+    corpus = {}
+    for name in categories:
+        rng = random.Random('%s-%s' % (seed, name))
+        count = max(1, size // 10) if name == 'pathological' else size
+        corpus[name] = [GENERATORS[name](rng) for _ in range(count)]
+    return corpus
@@ -0,0 +1,266 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""The `itp` command: parse a stream of captions into NDJSON entity records
+
+Captions are read one per line from files or stdin, as plain text, NDJSON
+objects or CSV rows, optionally gzipped. Every caption becomes one JSON
+object on the output with its urls, users, tags, emojis and reply (and
+html with `--html`). Input is streamed, so memory use does not depend on
+its size, and `--workers` spreads the parsing over several processes.
+"""
+from __future__ import unicode_literals, print_function
+import argparse
+import csv
+import gzip
+import io
+import json
+import sys
+from collections import deque
+
+from .itp import Parser, CODEPOINTS, UTF16, ENTITY_NAMES
+
+FORMATS = ('lines', 'ndjson', 'csv')
+
+PY2 = sys.version_info[0] < 3
+
+
+class InputError(ValueError):
+    """Raised for records without a caption or input that is not UTF-8"""
+
+
+def _std_stream(stream, mode):
+    """Return the binary stream under stdin or stdout"""
+    if hasattr(stream, 'buffer'):
+        return stream.buffer
+    return io.open(stream.fileno(), mode, closefd=False)  # Python2
+
+
+def _open_binary(path, force_gzip=False):
+    """Open a file, or stdin for '-', for reading bytes
+
+    Files ending in `.gz` are decompressed, as is stdin with `force_gzip`.
+    """
+    if path == '-':
+        stream = _std_stream(sys.stdin, 'rb')
+        if force_gzip:
+            stream = gzip.GzipFile(fileobj=stream, mode='rb')
+    elif force_gzip or path.endswith('.gz'):
+        stream = gzip.GzipFile(path, 'rb')
+    else:
+        stream = io.open(path, 'rb')
+    return stream
+
+
+def _decode_lines(stream):
+    """Yield the lines of a binary stream as text, raise InputError for a
+    line that is not UTF-8
+
+    Lines are only split on newlines, not on other line breaks a caption
+    may contain.
+    """
+    for number, line in enumerate(stream, 1):
+        try:
+            yield line.decode('utf-8')
+        except UnicodeDecodeError as error:
+            raise InputError('line %d: invalid UTF-8 (%s)' % (number, error.reason))
+
+
+def open_output(path):
+    """Open a file, or stdout for '-', for writing text, gzipped for `.gz`"""
+    if path == '-':
+        stream = _std_stream(sys.stdout, 'wb')
+    elif path.endswith('.gz'):
+        stream = gzip.GzipFile(path, 'wb')
+    else:
+        stream = io.open(path, 'wb')
+    return io.TextIOWrapper(stream, encoding='utf-8', newline='\n')
+
+
+def _strip_newline(line):
+    return line.rstrip('\r\n')
+
+
+def read_lines(lines, field=None, id_field=None):
+    """Yield `(id, text)` for each line of plain text, the id is the line number"""
+    for number, line in enumerate(lines, 1):
+        yield number, _strip_newline(line)
+
+
+def read_ndjson(lines, field='text', id_field=None):
+    """Yield `(id, text)` for each JSON object line, skipping blank lines
+
+    The id is the `id_field` of the object, or the line number.
+    """
+    for number, line in enumerate(lines, 1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError:
+            raise InputError('line %d: invalid JSON' % number)
+        yield _field(record, field, id_field, number)
+
+
+def read_csv(lines, field='text', id_field=None):
+    """Yield `(id, text)` for each row of a CSV file with a header row
+
+    The id is the `id_field` column of the row, or the row number.
+    """
+    if PY2:
+        rows = csv.DictReader(line.encode('utf-8') for line in lines)
+        rows = (dict((_decode(key), _decode(value)) for key, value in row.items()) for row in rows)
+    else:
+        rows = csv.DictReader(lines)
+    for number, row in enumerate(rows, 1):
+        yield _field(row, field, id_field, number)
+
+
+def _decode(value):
+    return value.decode('utf-8') if isinstance(value, bytes) else value
+
+
+def _field(record, field, id_field, number):
+    text = record.get(field) if isinstance(record, dict) else None
+    if text is None:
+        raise InputError('record %d: no "%s" field' % (number, field))
+    if not isinstance(text, type('')):
+        raise InputError('record %d: "%s" is not a string' % (number, field))
+    if id_field is None:
+        return number, text
+    return record.get(id_field), text
+
+
+READERS = {'lines': read_lines, 'ndjson': read_ndjson, 'csv': read_csv}
+
+
+def read_captions(paths, format='lines', field='text', id_field=None, force_gzip=False):
+    """Yield `(source, id, text)` for the captions of every input in turn"""
+    reader = READERS[format]
+    for path in paths:
+        stream = _open_binary(path, force_gzip)
+        try:
+            for id, text in reader(_decode_lines(stream), field, id_field):
+                yield path, id, text
+        except InputError as error:
+            raise InputError('%s: %s' % (path, error))
+        finally:
+            if path != '-' or force_gzip:
+                stream.close()
+
+
+def parse_captions(captions, parser, html=False, workers=1, chunksize=None):
+    """Parse `(source, id, text)` tuples, yield `(source, id, ParseResult)`
+
+    With more than one worker the texts are parsed by `itp.parallel`, which
+    keeps only a few chunks per worker in flight.
+    """
+    if workers <= 1:
+        for source, id, text in captions:
+            yield source, id, parser.parse(text, html=html)
+        return
+
+    from . import parallel
+
+    keys = deque()
+
+    def texts():
+        for source, id, text in captions:
+            keys.append((source, id))
+            yield text
+
+    results = parallel.parse_many(texts(), html=html, parser=parser, max_workers=workers,
+                                  chunksize=chunksize or parallel.DEFAULT_CHUNKSIZE)
+    for result in results:
+        source, id = keys.popleft()
+        yield source, id, result
+
+
+def entity_record(result, id=None, id_name='line', source=None, entities=ENTITY_NAMES):
+    """Return the JSON serialisable record of a ParseResult
+
+    Only the lists of `entities` are included, and the reply with 'users'.
+    """
+    record = {}
+    if source is not None:
+        record['file'] = source
+    record[id_name] = id
+    for name in entities:
+        record[name] = getattr(result, name)
+    if 'users' in entities:
+        record['reply'] = result.reply
+    if result.html is not None:
+        record['html'] = result.html
+    return record
+
+
+def main(argv=None):
+    """Run the `itp` command, return its exit status"""
+    parser = argparse.ArgumentParser(
+        prog='itp', description='Extract entities from captions, one NDJSON record per caption.')
+    parser.add_argument('inputs', metavar='FILE', nargs='*', default=['-'],
+                        help="input files, '-' or none for stdin; .gz files are decompressed")
+    parser.add_argument('-f', '--format', choices=FORMATS, default='lines',
+                        help='input format (default: %(default)s)')
+    parser.add_argument('--field', default='text',
+                        help='the caption field of NDJSON objects or CSV columns (default: %(default)s)')
+    parser.add_argument('--id-field',
+                        help="copy this field to the output as 'id' instead of the line or CSV row number")
+    parser.add_argument('--gzip', action='store_true', help='decompress stdin')
+    parser.add_argument('-o', '--output', default='-',
+                        help="output file, gzipped if it ends in .gz (default: stdout)")
+    parser.add_argument('--html', action='store_true', help='also output the formatted HTML')
+    parser.add_argument('--spans', choices=('none', CODEPOINTS, UTF16), default='none',
+                        help='output entities as [value, [start, end]] (default: %(default)s)')
+    parser.add_argument('--max-url-length', type=int, default=30,
+                        help='shorten URLs in the HTML to this length (default: %(default)s)')
+    parser.add_argument('-e', '--entities', default=','.join(ENTITY_NAMES),
+                        help='comma separated entities to look for, the others are left out '
+                             '(default: %(default)s)')
+    parser.add_argument('--emoji-sequences', action='store_true',
+                        help='find emojis with a skin tone and ZWJ sequences as one emoji')
+    parser.add_argument('--max-text-length', type=int,
+                        help='only look for entities in the first characters of a caption')
+    parser.add_argument('-j', '--workers', type=int, default=1,
+                        help='parse on this many processes (default: %(default)s)')
+    parser.add_argument('--chunksize', type=int,
+                        help='captions sent to a worker at a time')
+    args = parser.parse_args(argv)
+    if args.id_field is not None and args.format == 'lines':
+        parser.error('--id-field needs --format ndjson or csv')
+    entities = [name.strip() for name in args.entities.split(',') if name.strip()]
+    unknown = set(entities).difference(ENTITY_NAMES)
+    if unknown:
+        parser.error('unknown --entities %s, choose from %s'
+                     % (', '.join(sorted(unknown)), ','.join(ENTITY_NAMES)))
+
+    text_parser = Parser(max_url_length=args.max_url_length,
+                         include_spans=False if args.spans == 'none' else args.spans,
+                         max_text_length=args.max_text_length, entities=entities,
+                         emoji_sequences=args.emoji_sequences)
+    captions = read_captions(args.inputs, args.format, args.field, args.id_field, args.gzip)
+    results = parse_captions(captions, text_parser, args.html, args.workers, args.chunksize)
+    if args.id_field is not None:
+        id_name = 'id'
+    else:
+        id_name = 'row' if args.format == 'csv' else 'line'
+    several = len(args.inputs) > 1
+
+    output = open_output(args.output)
+    try:
+        for source, id, result in results:
+            record = entity_record(result, id, id_name, source if several else None, entities)
+            output.write('%s\n' % json.dumps(record, ensure_ascii=False, sort_keys=True))
+    except InputError as error:
+        print('itp: %s' % error, file=sys.stderr)
+        return 1
+    finally:
+        if args.output == '-':
+            output.flush()
+            output.detach()
+        else:
+            output.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
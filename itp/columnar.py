@@ -0,0 +1,168 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Parse batches of captions into flat entity columns
+
+`parse_table()` returns an EntityTable: one row per entity, kept in a few
+flat arrays instead of a ParseResult with lists of strings per caption. The
+arrays support the buffer protocol, so NumPy and pyarrow can wrap them
+without copying.
+"""
+from __future__ import unicode_literals
+from array import array
+from itertools import chain, islice, repeat
+from operator import add, methodcaller
+
+try:
+    from itertools import accumulate  # Python3
+
+    def _offsets(lengths, total):
+        """Yield total plus the running sum of lengths, after each length"""
+        return islice(accumulate(chain((total,), lengths)), 1, None)
+
+except ImportError:
+    def _offsets(lengths, total):
+        """Yield total plus the running sum of lengths, after each length"""
+        for length in lengths:
+            total += length
+            yield total
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+try:
+    import pyarrow
+except ImportError:
+    pyarrow = None
+
+from .itp import Parser, ParseContext, UTF16, _is_ascii, utf16_offsets
+
+# The names of the entity kinds, indexed by kind
+KIND_NAMES = ('url', 'user', 'tag', 'emoji')
+
+# The width of the sign in front of the value of each kind of entity
+_SIGN_WIDTHS = (0, 1, 1, 0)
+
+# Encodes a non-ASCII value
+_encode = methodcaller('encode', 'utf-8')
+
+# The NumPy types of the array typecodes used by EntityTable
+_NUMPY_TYPES = {'b': 'int8', 'i': 'intc'}
+
+
+class EntityTable(object):
+    """The entities of a batch of captions, one row per entity
+
+    Columns:
+    - caption: the index of the caption in the batch
+    - kind: the entity kind, `URL_ENTITY` to `EMOJI_ENTITY`
+    - start, end: the span of the entity in its caption, in the units of
+      the parser's `include_spans` (code points unless it is 'utf16')
+    - value_offsets: `len(table) + 1` offsets into `values`, the UTF-8
+      encoded entity values (usernames and tags without their sign) one
+      after the other, as in an Arrow string array
+
+    Rows are in caption order, and within a caption grouped by kind.
+    """
+
+    def __init__(self, captions=0):
+        self.captions = captions
+        self.caption = array('i')
+        self.kind = array('b')
+        self.start = array('i')
+        self.end = array('i')
+        self.value_offsets = array('i', [0])
+        self.values = bytearray()
+
+    def __len__(self):
+        return len(self.kind)
+
+    def value(self, row):
+        """Return the value of a row as a string"""
+        offsets = self.value_offsets
+        return self.values[offsets[row]:offsets[row + 1]].decode('utf-8')
+
+    def rows(self):
+        """Yield `(caption, kind, start, end, value)` for every row"""
+        for row in range(len(self)):
+            yield (self.caption[row], self.kind[row], self.start[row], self.end[row],
+                   self.value(row))
+
+    def to_numpy(self):
+        """Return the columns as a dict of NumPy arrays sharing their memory
+
+        `values` is an array of bytes (uint8). Needs NumPy.
+        """
+        if numpy is None:
+            raise ImportError('EntityTable.to_numpy() needs NumPy')
+        columns = {}
+        for name in ('caption', 'kind', 'start', 'end', 'value_offsets'):
+            column = getattr(self, name)
+            columns[name] = numpy.frombuffer(column, dtype=_NUMPY_TYPES[column.typecode])
+        columns['values'] = numpy.frombuffer(self.values, dtype='uint8')
+        return columns
+
+    def to_arrow(self):
+        """Return a pyarrow Table sharing the memory of the columns
+
+        The values become a `value` string column. Needs pyarrow.
+        """
+        if pyarrow is None:
+            raise ImportError('EntityTable.to_arrow() needs pyarrow')
+        count = len(self)
+        arrays = [
+            pyarrow.Array.from_buffers(pyarrow.int32(), count, [None, pyarrow.py_buffer(self.caption)]),
+            pyarrow.Array.from_buffers(pyarrow.int8(), count, [None, pyarrow.py_buffer(self.kind)]),
+            pyarrow.Array.from_buffers(pyarrow.int32(), count, [None, pyarrow.py_buffer(self.start)]),
+            pyarrow.Array.from_buffers(pyarrow.int32(), count, [None, pyarrow.py_buffer(self.end)]),
+            pyarrow.Array.from_buffers(pyarrow.string(), count, [
+                None, pyarrow.py_buffer(self.value_offsets), pyarrow.py_buffer(self.values)]),
+        ]
+        return pyarrow.Table.from_arrays(arrays, ['caption', 'kind', 'start', 'end', 'value'])
+
+
+def parse_table(texts, parser=None):
+    """Parse an iterable of texts, return an EntityTable of their entities
+
+    No Python object is kept per entity, the values are copied into one
+    shared UTF-8 buffer.
+    """
+    if parser is None:
+        parser = Parser()
+    scan = parser._scan
+    utf16 = parser._include_spans == UTF16
+    ctx = ParseContext()
+    table = EntityTable()
+    caption, kind, start, end = table.caption, table.kind, table.start, table.end
+    value_offsets, values = table.value_offsets, table.values
+
+    index = -1
+    for index, text in enumerate(texts):
+        records = scan(ctx, text)
+        if not records:
+            continue
+
+        # Work on whole columns of the caption's records at a time
+        kinds, starts, ends = records[0::3], records[1::3], records[2::3]
+        value_starts = map(add, starts, map(_SIGN_WIDTHS.__getitem__, kinds))
+        values_at = map(slice, value_starts, ends)
+        if _is_ascii(text):
+            chunks = map(text.encode('ascii').__getitem__, values_at)
+        else:
+            chunks = map(_encode, map(text.__getitem__, values_at))
+            spans_at = utf16_offsets(text) if utf16 else None
+            if spans_at is not None:
+                starts = array('i', map(spans_at.__getitem__, starts))
+                ends = array('i', map(spans_at.__getitem__, ends))
+
+        chunks = list(chunks)
+        value_offsets.extend(_offsets(map(len, chunks), len(values)))
+        values += b''.join(chunks)
+        caption.extend(repeat(index, len(kinds)))
+        kind.fromlist(kinds.tolist())
+        start.extend(starts)
+        end.extend(ends)
+
+    table.captions = index + 1
+    return table
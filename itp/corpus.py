@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Scan newline-delimited caption files of any size through a memory map
+
+The file is mapped instead of read into memory, and split into ranges that
+end on line boundaries. Each line is scanned as UTF-8 bytes, like
+`Parser.parse_bytes()` does, so only one line at a time is copied out of
+the mapping. Ranges can be scanned on worker processes, which map the same
+file themselves; only the entity records are sent back.
+"""
+from __future__ import unicode_literals
+import mmap
+import os
+from collections import deque
+
+from .itp import Parser, ParseContext
+
+DEFAULT_RANGE_SIZE = 64 * 1024 * 1024
+
+# The file mapped by this (worker) process, as `(path, size, mapping)`
+_mapped = None
+
+
+def map_file(path):
+    """Return a read-only memory map of a file, or None if it is empty"""
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return None
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def split(data, size=DEFAULT_RANGE_SIZE):
+    """Return `(start, end)` ranges of at least size bytes covering data
+
+    Every range but the last ends right after a newline.
+    """
+    if size < 1:
+        raise ValueError('size must be at least 1')
+    ranges = []
+    start, length = 0, len(data)
+    while start < length:
+        newline = data.find(b'\n', start + size - 1)
+        end = length if newline == -1 else newline + 1
+        ranges.append((start, end))
+        start = end
+    return ranges
+
+
+def scan_range(data, start, end, parser=None):
+    """Yield `(offset, records)` for the lines of data from start to end
+
+    `offset` is where the line starts in data, and `records` are its entity
+    records as `Parser._scan()` returns them, with byte offsets into the
+    line. Empty lines are skipped, a trailing `\\r` is left out.
+    """
+    from . import utf8
+    if parser is None:
+        parser = Parser()
+    ctx = ParseContext()
+    scan, find = utf8.scan, data.find
+    while start < end:
+        newline = find(b'\n', start, end)
+        if newline == -1:
+            newline = end
+        stop = newline
+        if stop > start and data[stop - 1:stop] == b'\r':
+            stop -= 1
+        if stop > start:
+            yield start, scan(parser, ctx, data[start:stop])
+        start = newline + 1
+
+
+def _scan_file_range(path, size, parser, start, end):
+    """Scan a range of a file in a worker, mapping the file once per process"""
+    global _mapped
+    if _mapped is None or _mapped[:2] != (path, size):
+        if _mapped is not None:
+            _mapped[2].close()
+        _mapped = (path, size, map_file(path))
+    return list(scan_range(_mapped[2], start, end, parser))
+
+
+def scan(path, parser=None, range_size=DEFAULT_RANGE_SIZE, workers=0, executor=None):
+    """Scan a newline-delimited caption file, yield `(offset, records)`
+
+    Lines are yielded in file order, see `scan_range()`; offsets are byte
+    offsets into the file. With `workers`, or an existing `executor`, ranges
+    of `range_size` bytes are scanned on worker processes, a few per worker
+    at a time. The file must not change while it is scanned.
+    """
+    data = map_file(path)
+    if data is None:
+        return
+    try:
+        ranges = split(data, range_size)
+        if not workers and executor is None:
+            for start, end in ranges:
+                for item in scan_range(data, start, end, parser):
+                    yield item
+            return
+
+        if parser is None:
+            parser = Parser()
+        own_executor = executor is None
+        if own_executor:
+            from concurrent.futures import ProcessPoolExecutor
+            executor = ProcessPoolExecutor(max_workers=workers)
+
+        path = os.path.abspath(path)
+        max_pending = 2 * (getattr(executor, '_max_workers', None) or 1)
+        pending = deque()
+        try:
+            for start, end in ranges:
+                pending.append(executor.submit(_scan_file_range, path, len(data), parser, start, end))
+                if len(pending) >= max_pending:
+                    for item in pending.popleft().result():
+                        yield item
+            while pending:
+                for item in pending.popleft().result():
+                    yield item
+        finally:
+            for future in pending:
+                future.cancel()
+            if own_executor:
+                executor.shutdown()
+    finally:
+        data.close()
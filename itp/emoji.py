@@ -0,0 +1,311 @@
+# -*- coding: utf-8 -*-
+#  This file is part of instagram-text-python.
+#
+#  The MIT License (MIT)
+#
+#  Copyright (c) 2016 Takumi
+#
+#  instagram-text-python is free software: you can redistribute it and/or
+#  modify it under the terms of the MIT License.
+#
+#  You should have received a copy of the MIT License along with
+#  instagram-text-python. If not, see <http://opensource.org/licenses/MIT>.
+#
+#  Maintained by Takumi:
+#  https://github.com/TakumiHQ/instagram-text-python
+#  (previously Ian Ozsvald, Ivo Wetzel and Edmond Burnett)
+
+
+# Emoji Tables and Matcher ----------------------------------------------------
+# -----------------------------------------------------------------------------
+"""Emoji data and the generator for the emoji regex used by `itp.Parser`.
+
+The tables are the emoji set of Instagram's hashtag emoji regex, from
+http://instagram-engineering.tumblr.com/post/118304328152/emojineering-part-2-implementing-hashtag-emoji
+Every emoji is put into a trie of code points (surrogate pairs on narrow
+Python builds) and the trie is turned into a regex once at import time, so
+single code points end up in one character class and sequences only branch
+where they differ.
+
+EMOJI_REGEX matches the emojis of the tables one at a time: a Fitzpatrick
+modifier following an emoji is a match of its own, which `Parser` drops,
+and a ZWJ sequence is matched as the emojis it joins, each with its ZWJ.
+EMOJI_SEQUENCE_REGEX, used with `Parser(emoji_sequences=True)`, matches an
+emoji with its modifier and a whole ZWJ sequence as one emoji.
+"""
+from __future__ import unicode_literals
+import re
+import sys
+
+try:
+    unichr
+except NameError:  # Python 3
+    unichr = chr
+
+# Code points matched as an emoji on their own, as (first, last) ranges.
+# This includes the Fitzpatrick modifiers, which `Parser` then ignores.
+EMOJI_RANGES = (
+    (0x00a9, 0x00a9), (0x00ae, 0x00ae), (0x203c, 0x203c), (0x2049, 0x2049),
+    (0x2122, 0x2122), (0x2139, 0x2139), (0x2194, 0x2199), (0x21a9, 0x21aa),
+    (0x231a, 0x231b), (0x2328, 0x2328), (0x2388, 0x2388), (0x23cf, 0x23cf),
+    (0x23e9, 0x23f3), (0x23f8, 0x23fa), (0x24c2, 0x24c2), (0x25aa, 0x25ab),
+    (0x25b6, 0x25b6), (0x25c0, 0x25c0), (0x25fb, 0x25fe), (0x2600, 0x2604),
+    (0x260e, 0x260e), (0x2611, 0x2611), (0x2614, 0x2615), (0x2618, 0x2618),
+    (0x261d, 0x261d), (0x2620, 0x2620), (0x2622, 0x2623), (0x2626, 0x2626),
+    (0x262a, 0x262a), (0x262e, 0x262f), (0x2638, 0x263a), (0x2648, 0x2653),
+    (0x2660, 0x2660), (0x2663, 0x2663), (0x2665, 0x2666), (0x2668, 0x2668),
+    (0x267b, 0x267b), (0x267f, 0x267f), (0x2692, 0x2694), (0x2696, 0x2697),
+    (0x2699, 0x2699), (0x269b, 0x269c), (0x26a0, 0x26a1), (0x26aa, 0x26ab),
+    (0x26b0, 0x26b1), (0x26bd, 0x26be), (0x26c4, 0x26c5), (0x26c8, 0x26c8),
+    (0x26ce, 0x26cf), (0x26d1, 0x26d1), (0x26d3, 0x26d4), (0x26e9, 0x26ea),
+    (0x26f0, 0x26f5), (0x26f7, 0x26fa), (0x26fd, 0x26fd), (0x2702, 0x2702),
+    (0x2705, 0x2705), (0x2708, 0x270d), (0x270f, 0x270f), (0x2712, 0x2712),
+    (0x2714, 0x2714), (0x2716, 0x2716), (0x271d, 0x271d), (0x2721, 0x2721),
+    (0x2728, 0x2728), (0x2733, 0x2734), (0x2744, 0x2744), (0x2747, 0x2747),
+    (0x274c, 0x274c), (0x274e, 0x274e), (0x2753, 0x2755), (0x2757, 0x2757),
+    (0x2763, 0x2764), (0x2795, 0x2797), (0x27a1, 0x27a1), (0x27b0, 0x27b0),
+    (0x27bf, 0x27bf), (0x2934, 0x2935), (0x2b05, 0x2b07), (0x2b1b, 0x2b1c),
+    (0x2b50, 0x2b50), (0x2b55, 0x2b55), (0x3030, 0x3030), (0x303d, 0x303d),
+    (0x3297, 0x3297), (0x3299, 0x3299), (0x1f004, 0x1f004), (0x1f0cf, 0x1f0cf),
+    (0x1f170, 0x1f171), (0x1f17e, 0x1f17f), (0x1f18e, 0x1f18e),
+    (0x1f191, 0x1f19a), (0x1f201, 0x1f202), (0x1f21a, 0x1f21a),
+    (0x1f22f, 0x1f22f), (0x1f232, 0x1f23a), (0x1f250, 0x1f251),
+    (0x1f300, 0x1f321), (0x1f324, 0x1f393), (0x1f396, 0x1f397),
+    (0x1f399, 0x1f39b), (0x1f39e, 0x1f3f0), (0x1f3f3, 0x1f3f5),
+    (0x1f3f7, 0x1f4fd), (0x1f4ff, 0x1f53d), (0x1f549, 0x1f54e),
+    (0x1f550, 0x1f567), (0x1f56f, 0x1f570), (0x1f573, 0x1f579),
+    (0x1f587, 0x1f587), (0x1f58a, 0x1f58d), (0x1f590, 0x1f590),
+    (0x1f595, 0x1f596), (0x1f5a5, 0x1f5a5), (0x1f5a8, 0x1f5a8),
+    (0x1f5b1, 0x1f5b2), (0x1f5bc, 0x1f5bc), (0x1f5c2, 0x1f5c4),
+    (0x1f5d1, 0x1f5d3), (0x1f5dc, 0x1f5de), (0x1f5e1, 0x1f5e1),
+    (0x1f5e3, 0x1f5e3), (0x1f5ef, 0x1f5ef), (0x1f5f3, 0x1f5f3),
+    (0x1f5fa, 0x1f64f), (0x1f680, 0x1f6c5), (0x1f6cb, 0x1f6d0),
+    (0x1f6e0, 0x1f6e5), (0x1f6e9, 0x1f6e9), (0x1f6eb, 0x1f6ec),
+    (0x1f6f0, 0x1f6f0), (0x1f6f3, 0x1f6f3), (0x1f910, 0x1f918),
+    (0x1f980, 0x1f984), (0x1f9c0, 0x1f9c0),
+)
+
+# Digits, `#` and `*` followed by the combining enclosing keycap
+KEYCAP_BASES = '0123456789#*'
+KEYCAP = '\u20e3'
+
+# Pairs of regional indicator symbols matched as flags, by region code
+FLAG_REGIONS = (
+    'AC AD AE AF AG AI AL AM AO AQ AR AS AT AU AW AX AZ BA BB BD BE BF BG BH '
+    'BI BJ BL BM BN BO BQ BR BS BT BV BW BY BZ CA CC CD CF CG CH CI CK CL CM '
+    'CN CO CP CR CU CV CW CX CY CZ DE DG DJ DK DM DO DZ EA EC EE EG EH ER ES '
+    'ET EU FI FJ FK FM FO FR GA GB GD GE GF GG GH GI GL GM GN GP GQ GR GS GT '
+    'GU GW GY HK HM HN HR HT HU IC ID IE IL IM IN IO IQ IR IS IT JE JM JO JP '
+    'KE KG KH KI KM KN KP KR KW KY KZ LA LB LC LI LK LR LS LT LU LV LY MA MC '
+    'MD ME MF MG MH MK ML MM MN MO MP MQ MR MS MT MU MV MW MX MY MZ NA NC NE '
+    'NF NG NI NL NO NP NR NU NZ OM PA PE PF PG PH PK PL PM PN PR PS PT PW PY '
+    'QA RE RO RS RU RW SA SB SC SD SE SG SH SI SJ SK SL SM SN SO SR SS ST SV '
+    'SX SY SZ TA TC TD TF TG TH TJ TK TL TM TN TO TR TT TV TW TZ UA UG UM US '
+    'UY UZ VA VC VE VG VI VN VU WF WS XK YE YT ZA ZM ZW'
+).split()
+REGIONAL_INDICATOR_A = 0x1f1e6
+
+# A variation selector or zero width joiner following an emoji is part of it
+EMOJI_SUFFIX = '[\ufe00-\ufe0f\u200d]?'
+
+FITZPATRICK_MODIFIERS = tuple(range(0x1f3fb, 0x1f400))
+VARIATION_SELECTORS = tuple(range(0xfe00, 0xfe10))
+ZWJ = '\u200d'
+
+
+def code_point(value):
+    """Return the string for a code point, a surrogate pair on narrow builds"""
+    if value > sys.maxunicode:
+        value -= 0x10000
+        return unichr(0xd800 + (value >> 10)) + unichr(0xdc00 + (value & 0x3ff))
+    return unichr(value)
+
+
+def flag(region):
+    """Return the regional indicator sequence for a two letter region code"""
+    return ''.join(code_point(REGIONAL_INDICATOR_A + ord(letter) - ord('A'))
+                   for letter in region)
+
+
+def emoji_sequences():
+    """Yield every emoji in the tables as a string"""
+    for first, last in EMOJI_RANGES:
+        for value in range(first, last + 1):
+            yield code_point(value)
+    for base in KEYCAP_BASES:
+        yield base + KEYCAP
+    for region in FLAG_REGIONS:
+        yield flag(region)
+
+
+def build_trie(sequences):
+    """Return a trie of nested dicts, '' marks the end of a sequence"""
+    trie = {}
+    for sequence in sequences:
+        node = trie
+        for char in sequence:
+            node = node.setdefault(char, {})
+        node[''] = {}
+    return trie
+
+
+def char_class(chars):
+    """Return a regex character class matching any of chars"""
+    ranges = _ranges(ord(char) for char in chars)
+    if len(ranges) == 1 and ranges[0][0] == ranges[0][1]:
+        return re.escape(unichr(ranges[0][0]))
+    return _ranges_class(ranges)
+
+
+def gate_class(chars):
+    """Return a character class matching every one of chars and maybe more
+
+    Characters outside the BMP are folded into a single range, as the regex
+    engine checks the ranges of a class one by one for those, but uses a
+    lookup table for BMP characters.
+    """
+    bmp = [char for char in chars if ord(char) <= 0xffff]
+    astral = [ord(char) for char in chars if ord(char) > 0xffff]
+    if not astral:
+        return char_class(bmp)
+
+    ranges = _ranges(ord(char) for char in bmp)
+    ranges.append([min(astral), max(astral)])
+    return _ranges_class(ranges)
+
+
+def _ranges(values):
+    ranges = []
+    for value in sorted(set(values)):
+        if ranges and ranges[-1][1] == value - 1:
+            ranges[-1][1] = value
+        else:
+            ranges.append([value, value])
+    return ranges
+
+
+def _ranges_class(ranges):
+    parts = []
+    for first, last in ranges:
+        parts.append(re.escape(unichr(first)))
+        if last > first + 1:
+            parts.append('-')
+        if last > first:
+            parts.append(re.escape(unichr(last)))
+    return '[%s]' % ''.join(parts)
+
+
+def trie_expression(node):
+    """Return a regex matching the sequences of a trie, longest first"""
+    leaves = []
+    branches = []
+    for char in sorted(node):
+        if not char:
+            continue
+        child = node[char]
+        if list(child) == ['']:
+            leaves.append(char)
+            continue
+        expression = re.escape(char) + _group(trie_expression(child))
+        if '' in child:
+            expression += '?'
+        branches.append(expression)
+
+    if leaves:
+        branches.append(char_class(leaves))
+    return '|'.join(branches)
+
+
+def _group(expression):
+    if '|' in expression:
+        return '(?:%s)' % expression
+    if len(expression) > 1 and not expression.startswith('['):
+        return '(?:%s)' % expression
+    return expression
+
+
+def emoji_expression(suffix=EMOJI_SUFFIX):
+    """Return the emoji regex built from the tables, each emoji followed by
+    what `suffix` matches
+
+    The regex starts with a single character class of (a superset of) every
+    first character, so the regex engine can skip ahead to possible emojis
+    instead of trying each alternative at every position. The first
+    character is then checked, and what may follow it chosen, with one
+    character lookbehinds. Alternatives for characters outside the BMP sit
+    behind one more lookbehind so BMP characters such as digits (keycap
+    bases) do not have to try them all.
+    """
+    trie = build_trie(emoji_sequences())
+
+    # First characters followed by the same sequences share one alternative,
+    # e.g. all the keycap bases
+    firsts = {}
+    for char in sorted(trie):
+        child = trie[char]
+        if list(child) != ['']:
+            firsts.setdefault(_group(trie_expression(child)), []).append(char)
+    sequences = sorted((chars, expression) for expression, chars in firsts.items())
+    leaves = [char for char in sorted(trie) if '' in trie[char]]
+
+    # Sequences are tried before single characters, so the longest match wins
+    alternatives = [_lookbehind(chars, expression) for chars, expression in sequences
+                    if not _is_astral(chars)]
+    bmp_leaves = [char for char in leaves if not _is_astral(char)]
+    if bmp_leaves:
+        alternatives.append(_lookbehind(bmp_leaves, ''))
+
+    astral = [(chars, expression) for chars, expression in sequences
+              if _is_astral(chars)]
+    astral_leaves = [char for char in leaves if _is_astral(char)]
+    if astral_leaves:
+        astral.append((astral_leaves, ''))
+    if astral:
+        alternatives.append(_guarded(astral))
+
+    return '(%s(?:%s)%s)' % (gate_class(trie), '|'.join(alternatives), suffix)
+
+
+def emoji_sequence_expression():
+    """Return a regex matching modified emojis and ZWJ sequences as one emoji
+
+    Every emoji of `emoji_expression()` may be followed by a Fitzpatrick
+    modifier and a variation selector, and emojis joined by zero width
+    joiners are one match.
+    """
+    modifier = _group(trie_expression(build_trie(code_point(value) for value in FITZPATRICK_MODIFIERS)))
+    selector = char_class([unichr(value) for value in VARIATION_SELECTORS])
+    emoji = emoji_expression('%s?%s?' % (modifier, selector))
+    return '(%s(?:%s%s)*%s?)' % (emoji, ZWJ, emoji, ZWJ)
+
+
+def _is_astral(chars):
+    return all(ord(char) > 0xffff for char in chars)
+
+
+def _lookbehind(chars, expression):
+    return '(?<=%s)%s' % (char_class(chars), expression)
+
+
+def _guarded(sequences):
+    """Return the alternatives for sequences behind one check of all their
+    first characters, with the multi character sequences (the flags) behind
+    one more check so single emojis do not try each of them"""
+    alternatives = [_lookbehind(chars, expression)
+                    for chars, expression in sequences if expression]
+    if len(alternatives) > 1:
+        alternatives = ['(?<=%s)(?:%s)' % (
+            gate_class([char for chars, expression in sequences if expression
+                        for char in chars]),
+            '|'.join(alternatives))]
+    alternatives.extend(_lookbehind(chars, '')
+                        for chars, expression in sequences if not expression)
+    return '(?<=%s)(?:%s)' % (
+        gate_class([char for chars, _ in sequences for char in chars]),
+        '|'.join(alternatives))
+
+
+EMOJI_EXP = emoji_expression()
+EMOJI_REGEX = re.compile(EMOJI_EXP, re.UNICODE)
+EMOJI_SEQUENCE_REGEX = re.compile(emoji_sequence_expression(), re.UNICODE)
+FITZPATRICK_EMOJIS = frozenset(code_point(value) for value in FITZPATRICK_MODIFIERS)
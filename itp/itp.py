@@ -18,22 +18,35 @@
 # Instagram Parser and Formatter ----------------------------------------------
 # -----------------------------------------------------------------------------
 from __future__ import unicode_literals
+import heapq
+import json
 import re
 import sys
+import threading
+import time
+from array import array
+from collections import OrderedDict
+from string import Formatter
 
 try:
     from urllib.parse import quote  # Python3
 except ImportError:
     from urllib import quote
 
-__version__ = "2.1.0"
+try:
+    _timer = time.perf_counter  # Python3
+except AttributeError:
+    _timer = time.time
 
-# A partial regex from Instagram, from the following blog post
-# http://instagram-engineering.tumblr.com/post/118304328152/emojineering-part-2-implementing-hashtag-emoji
-# Their regex was to match emojis in hashtags, while we just want to match the emojis themselves
-EMOJI_EXP = r'((?:[\xa9\xae\u203c\u2049\u2122\u2139\u2194-\u2199\u21a9\u21aa\u231a\u231b\u2328\u2388\u23cf\u23e9-\u23f3\u23f8-\u23fa\u24c2\u25aa\u25ab\u25b6\u25c0\u25fb-\u25fe\u2600-\u2604\u260e\u2611\u2614\u2615\u2618\u261d\u2620\u2622\u2623\u2626\u262a\u262e\u262f\u2638-\u263a\u2648-\u2653\u2660\u2663\u2665\u2666\u2668\u267b\u267f\u2692-\u2694\u2696\u2697\u2699\u269b\u269c\u26a0\u26a1\u26aa\u26ab\u26b0\u26b1\u26bd\u26be\u26c4\u26c5\u26c8\u26ce\u26cf\u26d1\u26d3\u26d4\u26e9\u26ea\u26f0-\u26f5\u26f7-\u26fa\u26fd\u2702\u2705\u2708-\u270d\u270f\u2712\u2714\u2716\u271d\u2721\u2728\u2733\u2734\u2744\u2747\u274c\u274e\u2753-\u2755\u2757\u2763\u2764\u2795-\u2797\u27a1\u27b0\u27bf\u2934\u2935\u2b05-\u2b07\u2b1b\u2b1c\u2b50\u2b55\u3030\u303d\u3297\u3299]|\ud83c[\udc04\udccf\udd70\udd71\udd7e\udd7f\udd8e\udd91-\udd9a\ude01\ude02\ude1a\ude2f\ude32-\ude3a\ude50\ude51\udf00-\udf21\udf24-\udf93\udf96\udf97\udf99-\udf9b\udf9e-\udff0\udff3-\udff5\udff7-\udfff]|\ud83d[\udc00-\udcfd\udcff-\udd3d\udd49-\udd4e\udd50-\udd67\udd6f\udd70\udd73-\udd79\udd87\udd8a-\udd8d\udd90\udd95\udd96\udda5\udda8\uddb1\uddb2\uddbc\uddc2-\uddc4\uddd1-\uddd3\udddc-\uddde\udde1\udde3\uddef\uddf3\uddfa-\ude4f\ude80-\udec5\udecb-\uded0\udee0-\udee5\udee9\udeeb\udeec\udef0\udef3]|\ud83e[\udd10-\udd18\udd80-\udd84\uddc0]|(?:0\u20e3|1\u20e3|2\u20e3|3\u20e3|4\u20e3|5\u20e3|6\u20e3|7\u20e3|8\u20e3|9\u20e3|#\u20e3|\*\u20e3|\ud83c(?:\udde6\ud83c(?:\uddeb|\uddfd|\uddf1|\uddf8|\udde9|\uddf4|\uddee|\uddf6|\uddec|\uddf7|\uddf2|\uddfc|\udde8|\uddfa|\uddf9|\uddff|\uddea)|\udde7\ud83c(?:\uddf8|\udded|\udde9|\udde7|\uddfe|\uddea|\uddff|\uddef|\uddf2|\uddf9|\uddf4|\udde6|\uddfc|\uddfb|\uddf7|\uddf3|\uddec|\uddeb|\uddee|\uddf6|\uddf1)|\udde8\ud83c(?:\uddf2|\udde6|\uddfb|\uddeb|\uddf1|\uddf3|\uddfd|\uddf5|\udde8|\uddf4|\uddec|\udde9|\uddf0|\uddf7|\uddee|\uddfa|\uddfc|\uddfe|\uddff|\udded)|\udde9\ud83c(?:\uddff|\uddf0|\uddec|\uddef|\uddf2|\uddf4|\uddea)|\uddea\ud83c(?:\udde6|\udde8|\uddec|\uddf7|\uddea|\uddf9|\uddfa|\uddf8|\udded)|\uddeb\ud83c(?:\uddf0|\uddf4|\uddef|\uddee|\uddf7|\uddf2)|\uddec\ud83c(?:\uddf6|\uddeb|\udde6|\uddf2|\uddea|\udded|\uddee|\uddf7|\uddf1|\udde9|\uddf5|\uddfa|\uddf9|\uddec|\uddf3|\uddfc|\uddfe|\uddf8|\udde7)|\udded\ud83c(?:\uddf7|\uddf9|\uddf2|\uddf3|\uddf0|\uddfa)|\uddee\ud83c(?:\uddf4|\udde8|\uddf8|\uddf3|\udde9|\uddf7|\uddf6|\uddea|\uddf2|\uddf1|\uddf9)|\uddef\ud83c(?:\uddf2|\uddf5|\uddea|\uddf4)|\uddf0\ud83c(?:\udded|\uddfe|\uddf2|\uddff|\uddea|\uddee|\uddfc|\uddec|\uddf5|\uddf7|\uddf3)|\uddf1\ud83c(?:\udde6|\uddfb|\udde7|\uddf8|\uddf7|\uddfe|\uddee|\uddf9|\uddfa|\uddf0|\udde8)|\uddf2\ud83c(?:\uddf4|\uddf0|\uddec|\uddfc|\uddfe|\uddfb|\uddf1|\uddf9|\udded|\uddf6|\uddf7|\uddfa|\uddfd|\udde9|\udde8|\uddf3|\uddea|\uddf8|\udde6|\uddff|\uddf2|\uddf5|\uddeb)|\uddf3\ud83c(?:\udde6|\uddf7|\uddf5|\uddf1|\udde8|\uddff|\uddee|\uddea|\uddec|\uddfa|\uddeb|\uddf4)|\uddf4\U0001f1f2|\uddf5\ud83c(?:\uddeb|\uddf0|\uddfc|\uddf8|\udde6|\uddec|\uddfe|\uddea|\udded|\uddf3|\uddf1|\uddf9|\uddf7|\uddf2)|\uddf6\U0001f1e6|\uddf7\ud83c(?:\uddea|\uddf4|\uddfa|\uddfc|\uddf8)|\uddf8\ud83c(?:\uddfb|\uddf2|\uddf9|\udde6|\uddf3|\udde8|\uddf1|\uddec|\uddfd|\uddf0|\uddee|\udde7|\uddf4|\uddf8|\udded|\udde9|\uddf7|\uddef|\uddff|\uddea|\uddfe)|\uddf9\ud83c(?:\udde9|\uddeb|\uddfc|\uddef|\uddff|\udded|\uddf1|\uddec|\uddf0|\uddf4|\uddf9|\udde6|\uddf3|\uddf7|\uddf2|\udde8|\uddfb)|\uddfa\ud83c(?:\uddec|\udde6|\uddf8|\uddfe|\uddf2|\uddff)|\uddfb\ud83c(?:\uddec|\udde8|\uddee|\uddfa|\udde6|\uddea|\uddf3)|\uddfc\ud83c(?:\uddf8|\uddeb)|\uddfd\U0001f1f0|\uddfe\ud83c(?:\uddf9|\uddea)|\uddff\ud83c(?:\udde6|\uddf2|\uddfc))))[\ufe00-\ufe0f\u200d]?)'  # noqa
-EMOJI_REGEX = re.compile(EMOJI_EXP, re.UNICODE)
-FITZPATRICK_EMOJIS = [u'\U0001F3FB', u'\U0001F3FC', u'\U0001F3FD', u'\U0001F3FE', u'\U0001F3FF']
+try:
+    _string_types = basestring  # Python2
+except NameError:
+    _string_types = str
+
+# Emojis are matched with a regex generated from the tables in emoji.py
+from .emoji import EMOJI_EXP, EMOJI_REGEX, EMOJI_SEQUENCE_REGEX, FITZPATRICK_EMOJIS  # noqa
+
+__version__ = "2.1.0"
 
 AT_SIGNS = r'[@\uff20]'
 UTF_CHARS = r'a-z0-9_\u00c0-\u00d6\u00d8-\u00f6\u00f8-\u00ff\uac00-\ud7a3'
@@ -60,9 +73,15 @@ HASHTAG_EXP = r'(#|\uff03)([%s]{1,})' % UTF_CHARS
 HASHTAG_REGEX = re.compile(HASHTAG_EXP, re.IGNORECASE)
 
 # URLs
+# Every part of the URL regex matches its characters in exactly one way, so
+# backtracking is linear in the length of a match attempt. `find_urls()`
+# also avoids retrying attempts that are bound to fail.
 PRE_CHARS = r'(?:[^/"\':!=]|^|\:)'
-DOMAIN_CHARS = r'([\.-]|[^\s_\!\.\/])+\.[a-z]{2,}(?::[0-9]+)?'
-PATH_CHARS = r'(?:[\.,]?[%s!\*\'\(\);:=\+\$/%s#\[\]\-_,~@])' % (UTF_CHARS, '%')
+PRE_EXCLUDED_CHARS = '/"\'!='
+DOMAIN_CHARS = r'[^\s_\!\/]+\.[a-z]{2,}(?::[0-9]+)?'
+PATH_CHAR = r'[%s!\*\'\(\);:=\+\$/%s#\[\]\-_,~@]' % (UTF_CHARS, '%')
+# A dot must be followed by another path character
+PATH_CHARS = r'(?:%s|\.%s)' % (PATH_CHAR, PATH_CHAR)
 QUERY_CHARS = r'[a-z0-9!\*\'\(\);:&=\+\$/%#\[\]\-_\.,~]'
 
 # Valid end-of-path chracters (so /foo. does not gobble the period).
@@ -71,15 +90,173 @@ QUERY_CHARS = r'[a-z0-9!\*\'\(\);:&=\+\$/%#\[\]\-_\.,~]'
 PATH_ENDING_CHARS = r'[%s\)=#/]' % UTF_CHARS
 QUERY_ENDING_CHARS = '[a-z0-9_&=#]'
 
-URL_REGEX = re.compile('((%s)((https?://|www\\.)(%s)(\/(%s*%s)?)?(\?%s*%s)?))'
+URL_REGEX = re.compile(r'((%s)((https?://|www\.)(%s)(/(%s*%s)?)?(\?%s*%s)?))'
                        % (PRE_CHARS, DOMAIN_CHARS, PATH_CHARS,
                           PATH_ENDING_CHARS, QUERY_CHARS, QUERY_ENDING_CHARS),
                        re.IGNORECASE)
 
+# Pieces of URL_REGEX used by `find_urls()`
+URL_PROTOCOL_REGEX = re.compile(r'https?://|www\.', re.IGNORECASE)
+DOMAIN_RUN_REGEX = re.compile(r'[^\s_\!\/]*')
+TLD_START_REGEX = re.compile(r'[a-z]{2}', re.IGNORECASE)
+
+# Entities never contain whitespace, so an edit can only change the entities
+# in the run of non-space characters around it, see `Parser.reparse()`
+TOKEN_REGEX = re.compile(r'\S*')
+
+# What `find_urls()` works with, a bytes version is in `itp.utf8`
+URL_SYNTAX = (URL_REGEX, URL_PROTOCOL_REGEX, DOMAIN_RUN_REGEX, TLD_START_REGEX,
+              PRE_EXCLUDED_CHARS, '.')
+
 # Registered IANA one letter domains
 IANA_ONE_LETTER_DOMAINS = (
     'x.com', 'x.org', 'z.com', 'q.net', 'q.com', 'i.net')
 
+# Pre-filter: every URL contains one of these, and every emoji contains a
+# non-ASCII character
+URL_TRIGGER_REGEX = re.compile(r'://|www\.', re.IGNORECASE)
+
+try:
+    ''.isascii  # Python 3.7+
+
+    def _is_ascii(text):
+        return text.isascii()
+
+except AttributeError:
+    _NON_ASCII_REGEX = re.compile(r'[^\x00-\x7f]')
+
+    def _is_ascii(text):
+        return _NON_ASCII_REGEX.search(text) is None
+
+
+# Pre-filter triggers, whether a text may contain entities of a kind
+def _has_url_trigger(text):
+    return URL_TRIGGER_REGEX.search(text) is not None
+
+
+def _has_at_sign(text):
+    return '@' in text or '\uff20' in text
+
+
+def _has_hash_sign(text):
+    return '#' in text or '\uff03' in text
+
+
+def _has_non_ascii(text):
+    return not _is_ascii(text)
+
+
+# Entity kinds of the `(kind, start, end)` records kept by ParseResult. The
+# order is the priority used when matches overlap in the HTML output.
+URL_ENTITY, USER_ENTITY, TAG_ENTITY, EMOJI_ENTITY = range(4)
+
+# Marks a ParseResult attribute that has not been built yet
+_UNSET = object()
+
+# Units for entity spans, see `Parser`
+CODEPOINTS = 'codepoints'
+UTF16 = 'utf16'
+
+# The names of the entity kinds a Parser can be asked to extract
+ENTITY_NAMES = ('urls', 'users', 'tags', 'emojis')
+
+
+def utf16_offsets(text):
+    '''Return a list mapping the code point offsets of text to UTF-16 offsets.
+
+    Returns None if the text has no characters outside the BMP, in which case
+    both offsets are the same.
+    '''
+    if len(text.encode('utf-16-le')) == 2 * len(text):
+        return None
+
+    offsets = []
+    pos = 0
+    for char in text:
+        offsets.append(pos)
+        pos += 2 if ord(char) > 0xffff else 1
+    offsets.append(pos)
+    return offsets
+
+
+def find_urls(text, syntax=URL_SYNTAX):
+    '''Yield the matches of URL_REGEX in text, like `URL_REGEX.finditer()`.
+
+    Runs in time linear in the length of the text. Only positions where a
+    protocol or `www.` starts are tried, and a match is only attempted once
+    the domain is known to have a top level domain. The greedy domain ends
+    at the last `.tld` in its run of domain characters, which is the same
+    for every attempt starting in the run, so each run is searched once.
+    '''
+    url_regex, protocol_regex, domain_run_regex, tld_start_regex, pre_excluded, dot = syntax
+    at = 0  # where to look for the next protocol
+    run_end = -1  # the current run of domain characters and its last dot
+    last_dot = -1
+    search = protocol_regex.search
+    while True:
+        protocol = search(text, at)
+        if protocol is None:
+            return
+        start = protocol.start()
+        at = start + 1
+
+        # The character in front of the URL is part of the match
+        if start > 0 and text[start - 1] in pre_excluded:
+            continue
+
+        domain = protocol.end()
+        if domain > run_end:
+            run_end = domain_run_regex.match(text, domain).end()
+            last_dot = text.rfind(dot, domain + 1, run_end)
+            while last_dot != -1 and tld_start_regex.match(text, last_dot + 1) is None:
+                last_dot = text.rfind(dot, domain + 1, last_dot)
+        if last_dot <= domain:
+            continue
+
+        match = url_regex.match(text, start - 1 if start > 0 else 0)
+        if match is None:
+            continue
+        yield match
+        # The next match starts after this one, with a protocol after that
+        at = match.end() + 1
+
+
+def _bisect_records(records, lo, hi, field, value):
+    '''Return the index of the first of the `(kind, start, end)` records
+    lo to hi whose `field` is at least value, the field being sorted.'''
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if records[3 * mid + field] < value:
+            lo = mid + 1
+        else:
+            hi = mid
+    return lo
+
+
+def _shift_records(records, shift):
+    '''Return a copy of entity records with their offsets moved by shift.'''
+    records = array('i', records)
+    if shift and records:
+        records[1::3] = array('i', map(shift.__add__, records[1::3]))
+        records[2::3] = array('i', map(shift.__add__, records[2::3]))
+    return records
+
+
+def _lazy_attribute(slot, build, doc):
+    '''Return a property that calls `build(result)` on first access.'''
+
+    def getter(self):
+        value = getattr(self, slot)
+        if value is _UNSET:
+            value = build(self)
+            setattr(self, slot, value)
+        return value
+
+    def setter(self, value):
+        setattr(self, slot, value)
+
+    return property(getter, setter, doc=doc)
+
 
 class ParseResult(object):
 
@@ -107,96 +284,605 @@ class ParseResult(object):
         To change the formatting sublcass twp.Parser and override the format_*
         methods.
 
+    Results returned by `Parser.parse()` only keep the parsed text and a
+    flat array of `(kind, start, end)` entity records, the attributes above
+    are built from them the first time they are accessed.
+
     '''
 
+    __slots__ = ('_parser', '_text', '_entities', '_urls', '_users',
+                 '_reply', '_tags', '_emojis', '_html')
+
     def __init__(self, urls, users, reply, tags, emojis, html):
-        self.urls = urls if urls else []
-        self.users = users if users else []
-        self.reply = reply if reply else None
-        self.tags = tags if tags else []
-        self.emojis = emojis if emojis else []
-        self.html = html
+        self._parser = None
+        self._text = None
+        self._entities = ()
+        self._urls = urls if urls else []
+        self._users = users if users else []
+        self._reply = reply if reply else None
+        self._tags = tags if tags else []
+        self._emojis = emojis if emojis else []
+        self._html = html
+
+    @classmethod
+    def from_entities(cls, parser, text, entities, html=True):
+        '''Return a result building its attributes from entity records.
+
+        `entities` is a flat sequence of `kind, start, end` triples over
+        `text`, as returned by `Parser._scan()`.
+        '''
+        result = cls.__new__(cls)
+        result._parser = parser
+        result._text = text
+        result._entities = entities
+        result._urls = result._users = result._reply = _UNSET
+        result._tags = result._emojis = _UNSET
+        result._html = _UNSET if html else None
+        return result
+
+    @property
+    def entities(self):
+        '''A list of `(kind, start, end)` tuples for the entities found.
+
+        Offsets are code points of the original text.
+        '''
+        entities = self._entities
+        return [tuple(entities[i:i + 3]) for i in range(0, len(entities), 3)]
+
+    @property
+    def utf16_entities(self):
+        '''Like `entities`, with offsets in UTF-16 code units.'''
+        offsets = utf16_offsets(self._text) if self._entities else None
+        if offsets is None:
+            return self.entities
+        return [(kind, offsets[start], offsets[end])
+                for kind, start, end in self.entities]
+
+    def _values(self, kind):
+        return self._parser._entity_values(self._text, self._entities, kind)
+
+    urls = _lazy_attribute(
+        '_urls', lambda result: result._values(URL_ENTITY), 'The urls found.')
+    users = _lazy_attribute(
+        '_users', lambda result: result._values(USER_ENTITY), 'The usernames found.')
+    tags = _lazy_attribute(
+        '_tags', lambda result: result._values(TAG_ENTITY), 'The hashtags found.')
+    emojis = _lazy_attribute(
+        '_emojis', lambda result: result._values(EMOJI_ENTITY), 'The emojis found.')
+    reply = _lazy_attribute(
+        '_reply', lambda result: result._parser._reply(result._text),
+        'The username replied to, or None.')
+    html = _lazy_attribute(
+        '_html', lambda result: result._parser._render(result._text, result._entities),
+        'The formatted HTML, or None when parsed with html=False.')
+
+    def render(self, renderer=None):
+        '''Return the text rendered by a renderer, e.g. a MarkdownRenderer.
+
+        Defaults to the renderer of the parser, like `html` but without
+        keeping the output.
+        '''
+        if self._parser is None:
+            raise ValueError('only results returned by a Parser can be rendered')
+        if renderer is None:
+            return self._parser._render(self._text, self._entities)
+        return renderer.render(self._parser, self._text, self._entities)
+
+
+class ParseContext(object):
+
+    '''The state of a `Parser` scan.
+
+    Every call gets its own context, so one Parser instance can be shared
+    between threads or asyncio tasks without results leaking between calls.
+    `entities` is a scratch array the matchers append `kind, start, end`
+    triples to, `Parser.parse_many()` reuses one context for a whole batch.
+    '''
+
+    def __init__(self):
+        self.entities = array('i')
+
+
+class ParseCache(object):
+
+    '''A bounded cache of parsed texts, see `Parser(cache=...)`.
+
+    Keeps the entity records and HTML of the `maxsize` most recently parsed
+    texts, evicting the least recently used ones first. With `maxbytes` the
+    entries are also limited by their approximate size in memory. A cache
+    can be shared by several parsers, as long as instances of the same
+    Parser subclass format HTML the same way.
+    '''
+
+    def __init__(self, maxsize=10000, maxbytes=None):
+        self.maxsize = maxsize
+        self.maxbytes = maxbytes
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._bytes = 0
+        self.reset_stats()
+
+    def __reduce__(self):
+        # Copies, e.g. in the worker processes of itp.parallel, start empty
+        return (self.__class__, (self.maxsize, self.maxbytes))
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        '''Return the `(entities, html)` entry for a key, or None.'''
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None:
+                self._misses += 1
+                return None
+            self._entries[key] = entry
+            self._hits += 1
+            return entry[0]
+
+    def set(self, key, value):
+        '''Store an `(entities, html)` entry.'''
+        size = (sys.getsizeof(key[0]) + sys.getsizeof(value[0])
+                + sys.getsizeof(value[1]))
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= old[1]
+            self._entries[key] = (value, size)
+            self._bytes += size
+            entries = self._entries
+            while entries and (len(entries) > self.maxsize or (
+                    self.maxbytes is not None and self._bytes > self.maxbytes)):
+                self._bytes -= entries.popitem(last=False)[1][1]
+                self._evictions += 1
+
+    def clear(self):
+        '''Remove every entry.'''
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        '''Return the hit and miss counts, hit rate and size as a dict.'''
+        lookups = self._hits + self._misses
+        return {'hits': self._hits, 'misses': self._misses,
+                'hit_rate': float(self._hits) / lookups if lookups else 0.0,
+                'evictions': self._evictions, 'entries': len(self._entries),
+                'bytes': self._bytes}
+
+    def reset_stats(self):
+        '''Set the hit, miss and eviction counts back to zero.'''
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+
+
+class Instrumentation(object):
+
+    '''Where a Parser spends its time, see `Parser(instrumentation=...)`.
+
+    For each entity pass (the URL, username, hashtag and emoji matchers) it
+    counts the texts the pass ran on, its wall time, its regex matches and
+    how many of them were rejected, e.g. URLs with an unregistered one
+    letter domain or username lists. The `slowest` texts scanned are kept
+    with their scan time, to find pathological inputs.
+
+    Counts are not locked, like the pre-filter counts, so they may be
+    slightly off when parsers share an instrumentation between threads.
+    '''
+
+    def __init__(self, slowest=10):
+        self.slowest = slowest
+        self._lock = threading.Lock()
+        self.reset()
+
+    def __reduce__(self):
+        # Copies, e.g. in the worker processes of itp.parallel, start empty
+        return (self.__class__, (self.slowest,))
+
+    def snapshot(self):
+        '''Return the counts, timings and slowest texts as a dict.
+
+        `slowest` lists `(seconds, text)` pairs, slowest first.
+        '''
+        passes = {}
+        for kind, name in enumerate(ENTITY_NAMES):
+            passes[name] = {'runs': self._runs[kind], 'seconds': self._seconds[kind],
+                            'matches': self._matches[kind], 'rejected': self._rejected[kind]}
+        with self._lock:
+            slowest = sorted(self._slowest, reverse=True)
+        return {'texts': self._texts, 'seconds': self._total, 'passes': passes,
+                'slowest': [(seconds, text) for seconds, _, text in slowest]}
+
+    def reset(self):
+        '''Set every count and timing back to zero and forget the slowest texts.'''
+        self._texts = 0
+        self._total = 0.0
+        self._runs = [0, 0, 0, 0]
+        self._seconds = [0.0, 0.0, 0.0, 0.0]
+        self._matches = [0, 0, 0, 0]
+        self._rejected = [0, 0, 0, 0]
+        with self._lock:
+            # A min-heap of `(seconds, sequence, text)`, the sequence number
+            # keeps texts from being compared
+            self._slowest = []
+            self._sequence = 0
+
+    def _record_pass(self, kind, seconds, matches, found):
+        self._runs[kind] += 1
+        self._seconds[kind] += seconds
+        self._matches[kind] += matches
+        self._rejected[kind] += matches - found
+
+    def _record_text(self, text, seconds):
+        self._texts += 1
+        self._total += seconds
+        with self._lock:
+            # Read under the lock, `reset()` may replace the list
+            slowest = self._slowest
+            if len(slowest) < self.slowest:
+                self._sequence += 1
+                heapq.heappush(slowest, (seconds, self._sequence, text))
+            elif slowest and seconds > slowest[0][0]:
+                self._sequence += 1
+                heapq.heapreplace(slowest, (seconds, self._sequence, text))
 
 
 class Parser(object):
 
-    '''A Instagram caption/comment Parser'''
+    '''A Instagram caption/comment Parser
+
+    With `include_spans` every entity is returned as a `(value, (start,
+    end))` tuple, with offsets into the original text whether or not HTML
+    is generated. Offsets count code points, pass `include_spans='utf16'`
+    to count UTF-16 code units instead (as used by JavaScript and Java).
+
+    With `prefilter` (the default) a matcher is only run when the text
+    contains a character its entities need, e.g. the username regex only
+    runs on texts with an `@`. `prefilter_stats()` tells how often each
+    matcher was skipped.
+
+    With a `ParseCache` as `cache`, texts that were parsed before are not
+    scanned or formatted again. This pays off on inputs with many duplicate
+    captions, e.g. reposts or bot comments.
+
+    Parsing takes time linear in the length of the text. To bound it for
+    untrusted input, `max_text_length` only looks for entities in the first
+    that many characters of a text; the rest is kept as it is.
+
+    `entities` selects the kinds of entities to look for, e.g. `('tags',
+    'urls')`, out of 'urls', 'users', 'tags' and 'emojis'. The matchers of
+    the other kinds are not run, their lists are empty, and `reply` is
+    None unless 'users' is selected. The HTML only links the selected
+    entities.
+
+    Emojis are matched one code point (or flag or keycap) at a time, so an
+    emoji with a skin tone modifier is found without the modifier, and a
+    ZWJ sequence such as a family as the emojis it joins. With
+    `emoji_sequences` both are found as one emoji instead.
+
+    `result.html` is produced by `renderer`, an `HTMLRenderer` by default.
+    Pass an `HTMLRenderer` with other templates, or a `MarkdownRenderer`
+    or `JSONRenderer`, to change the output. Overriding the `format_*`
+    methods in a subclass works too.
+
+    With an `Instrumentation` as `instrumentation`, every scan records the
+    time and matches of each entity pass and the slowest texts. Without
+    one, nothing is timed.
+    '''
 
-    def __init__(self, max_url_length=30, include_spans=False):
+    def __init__(self, max_url_length=30, include_spans=False, prefilter=True,
+                 cache=None, max_text_length=None, renderer=None, entities=None,
+                 instrumentation=None, emoji_sequences=False):
+        if include_spans not in (False, True, CODEPOINTS, UTF16):
+            raise ValueError('include_spans must be a boolean, %r or %r'
+                             % (CODEPOINTS, UTF16))
+        if entities is None:
+            entities = ENTITY_NAMES
+        elif isinstance(entities, _string_types):
+            entities = (entities,)
+        unknown = set(entities).difference(ENTITY_NAMES)
+        if unknown:
+            raise ValueError('unknown entities %s, choose from %s'
+                             % (', '.join(sorted(unknown)), ', '.join(ENTITY_NAMES)))
+        # Whether to extract each kind of entity, indexed by kind
+        self._extract = tuple(name in entities for name in ENTITY_NAMES)
         self._max_url_length = max_url_length
         self._include_spans = include_spans
+        self._prefilter = prefilter
+        self._cache = cache
+        self._max_text_length = max_text_length
+        self._renderer = HTMLRenderer() if renderer is None else renderer
+        self._instrumentation = instrumentation
+        self._emoji_sequences = emoji_sequences
+        # Everything besides the text and html flag that the cached entity
+        # records and HTML depend on; spans are computed per result, but a
+        # renderer may output UTF-16 offsets
+        self._cache_key = (self.__class__, max_url_length, max_text_length, self._extract,
+                           emoji_sequences, self._renderer.key(), include_spans == UTF16)
+        self.reset_prefilter_stats()
+
+    def prefilter_stats(self):
+        '''Return the number of texts scanned and how often each matcher was
+        skipped by the pre-filter, as a dict.
+
+        Counts are not locked, so they may be slightly off when the parser is
+        shared between threads.
+        '''
+        return {'texts': self._scanned, 'urls': self._skipped[URL_ENTITY],
+                'users': self._skipped[USER_ENTITY], 'tags': self._skipped[TAG_ENTITY],
+                'emojis': self._skipped[EMOJI_ENTITY]}
+
+    def reset_prefilter_stats(self):
+        '''Set the pre-filter counts back to zero.'''
+        self._scanned = 0
+        self._skipped = [0, 0, 0, 0]
 
     def parse(self, text, html=True):
         '''Parse the text and return a ParseResult instance.'''
-        self._urls = []
-        self._users = []
-        self._tags = []
-        self._emojis = []
-
-        reply = REPLY_REGEX.match(text)
-        reply = reply.groups(0)[0] if reply is not None else None
-
-        parsed_html = self._html(text) if html else self._text(text)
-        return ParseResult(self._urls, self._users, reply,
-                           self._tags, self._emojis, parsed_html)
-
-    def _text(self, text):
-        '''Parse a caption/comment without generating HTML.'''
-        URL_REGEX.sub(self._parse_urls, text)
-        USERNAME_REGEX.sub(self._parse_users, text)
-        HASHTAG_REGEX.sub(self._parse_tags, text)
-        EMOJI_REGEX.sub(self._parse_emojis, text)
-        return None
+        if self._cache is not None:
+            return self._cached_parse(ParseContext(), text, html)
+        return ParseResult.from_entities(
+            self, text, self._scan(ParseContext(), text), html)
+
+    def parse_bytes(self, data):
+        '''Parse UTF-8 encoded bytes without decoding them first.
+
+        Takes bytes, a bytearray or a memoryview, e.g. a line of a mapped
+        file. Entity spans (`entities`, and the values with `include_spans`)
+        are byte offsets into data, and only entity values are decoded.
+        `max_text_length` counts bytes. There is no HTML, and overridden
+        `_parse_*` methods are not used, see `itp.utf8`.
+        '''
+        from . import utf8
+        if isinstance(data, memoryview):
+            data = data.tobytes()
+        elif isinstance(data, bytearray) and bytes is str:
+            # Python 2 indexes a bytearray to ints, unlike bytes
+            data = bytes(data)
+        return utf8.BytesParseResult.from_entities(
+            self, data, utf8.scan(self, ParseContext(), data), False)
+
+    def parse_many(self, texts, html=True):
+        '''Parse an iterable of texts, yielding a ParseResult for each one.
+
+        Results are generated lazily and in input order, so inputs of any
+        size can be streamed with constant memory.
+        '''
+        ctx = ParseContext()
+        if self._cache is not None:
+            for text in texts:
+                yield self._cached_parse(ctx, text, html)
+            return
 
-    def _html(self, text):
-        '''Parse a caption/comment and generate HTML.'''
-        html = URL_REGEX.sub(self._parse_urls, text)
-        html = USERNAME_REGEX.sub(self._parse_users, html)
-        html = HASHTAG_REGEX.sub(self._parse_tags, html)
-        return EMOJI_REGEX.sub(self._parse_emojis, html)
+        scan = self._scan
+        from_entities = ParseResult.from_entities
+
+        for text in texts:
+            yield from_entities(self, text, scan(ctx, text), html)
+
+    def reparse(self, result, offset, deleted=0, inserted='', html=True):
+        '''Return the ParseResult of an edited text, reusing a previous result.
+
+        The edit replaces `deleted` characters at `offset` in the text of
+        `result`, a result of this parser, with `inserted`. Only the run of
+        non-space characters around the edit is scanned again, the entities
+        before it are kept and those after it shifted. Offsets count code
+        points. Results are the same as parsing the new text, but are not
+        cached.
+        '''
+        text = result._text
+        if text is None:
+            raise ValueError('only results returned by a Parser can be reparsed')
+        if offset < 0 or deleted < 0 or offset + deleted > len(text):
+            raise ValueError('edit out of range of the text')
+
+        new_text = text[:offset] + inserted + text[offset + deleted:]
+        max_length = self._max_text_length
+        if max_length is not None and max(len(text), len(new_text)) > max_length:
+            return ParseResult.from_entities(
+                self, new_text, self._scan(ParseContext(), new_text), html)
+
+        # The window to scan again, in the new text
+        end = offset + len(inserted)
+        start = offset - TOKEN_REGEX.match(text[offset - 1::-1]).end() if offset else 0
+        end = TOKEN_REGEX.match(new_text, end).end()
+        shift = len(inserted) - deleted
+        old_end = end - shift
+
+        # Records are grouped by kind and sorted by offset within a kind, so
+        # the records to keep are found by bisection and copied in slices
+        old = result._entities
+        window = self._scan(ParseContext(), new_text[start:end])
+        records = array('i')
+        group = window_group = 0
+        for kind in (URL_ENTITY, USER_ENTITY, TAG_ENTITY, EMOJI_ENTITY):
+            group_end = _bisect_records(old, group, len(old) // 3, 0, kind + 1)
+            before = _bisect_records(old, group, group_end, 2, start + 1)
+            after = _bisect_records(old, before, group_end, 1, old_end)
+            window_end = _bisect_records(window, window_group, len(window) // 3, 0, kind + 1)
+            records.extend(old[3 * group:3 * before])
+            records.extend(_shift_records(window[3 * window_group:3 * window_end], start))
+            records.extend(_shift_records(old[3 * after:3 * group_end], shift))
+            group, window_group = group_end, window_end
+
+        return ParseResult.from_entities(self, new_text, records if records else (), html)
 
     # Internal parser stuff ---------------------------------------------------
-    def _parse_urls(self, match):
+    def _cached_parse(self, ctx, text, html):
+        '''Parse the text, reusing the cached entities and HTML if any.
+
+        Results never share mutable state with the cache: every result gets
+        its own copy of the entity array and the attribute lists are built
+        per result.
+        '''
+        key = (text, html, self._cache_key)
+        entry = self._cache.get(key)
+        if entry is None:
+            entities = self._scan(ctx, text)
+            entry = (entities, self._render(text, entities) if html else None)
+            self._cache.set(key, entry)
+
+        result = ParseResult.from_entities(self, text, entry[0][:], html)
+        if html:
+            result.html = entry[1]
+        return result
+
+    def _scan(self, ctx, text):
+        '''Run every entity matcher once over the original text.
+
+        Returns the entity records as an exactly sized array, or an empty
+        tuple if there are none, and leaves the scratch array of `ctx` empty.
+        '''
+        if self._max_text_length is not None and len(text) > self._max_text_length:
+            text = text[:self._max_text_length]
+        passes = self._sequence_passes if self._emoji_sequences else self._passes
+        return self._run_passes(ctx, text, passes, self)
+
+    def _run_passes(self, ctx, text, passes, handlers):
+        '''Run the passes of the selected entities over the text.
+
+        `passes` is a table like `Parser._passes`, its handlers are looked
+        up by name on `handlers`, so overridden `_parse_*` methods are used.
+        Returns the records like `_scan()`, timing every pass with an
+        instrumentation.
+        '''
+        instrumentation = self._instrumentation
+        if instrumentation is not None:
+            started = _timer()
+        extract = self._extract
+        prefilter = self._prefilter
+        if prefilter:
+            self._scanned += 1
+        entities = ctx.entities
+
+        for kind, trigger, find, handler in passes:
+            if not extract[kind]:
+                continue
+            if prefilter and not trigger(text):
+                self._skipped[kind] += 1
+                continue
+            handle = getattr(handlers, handler)
+            if instrumentation is None:
+                for match in find(text):
+                    handle(ctx, match)
+                continue
+
+            pass_started = _timer()
+            found = len(entities)
+            matches = 0
+            for match in find(text):
+                handle(ctx, match)
+                matches += 1
+            instrumentation._record_pass(kind, _timer() - pass_started, matches,
+                                         (len(entities) - found) // 3)
+
+        if entities:
+            records = entities[:]
+            del entities[:]
+        else:
+            records = ()
+        if instrumentation is not None:
+            instrumentation._record_text(text, _timer() - started)
+        return records
+
+    def _reply(self, text):
+        '''Return the username the text is a reply to.'''
+        if not self._extract[USER_ENTITY]:
+            return None
+        reply = REPLY_REGEX.match(text)
+        return reply.groups(0)[0] if reply is not None else None
+
+    def _entity_values(self, text, entities, kind):
+        '''Return the values of one kind of entity records.'''
+        values = []
+        include_spans = self._include_spans
+        offsets = None
+        if include_spans == UTF16 and entities:
+            offsets = utf16_offsets(text)
+
+        for i in range(0, len(entities), 3):
+            if entities[i] != kind:
+                continue
+
+            start, end = entities[i + 1], entities[i + 2]
+            if kind == USER_ENTITY or kind == TAG_ENTITY:
+                value = text[start + 1:end]
+            else:
+                value = text[start:end]
+
+            if not include_spans:
+                values.append(value)
+            elif offsets is None:
+                values.append((value, (start, end)))
+            else:
+                values.append((value, (offsets[start], offsets[end])))
+        return values
+
+    def _render(self, text, entities):
+        '''Generate the output for a text from its entity records.'''
+        return self._renderer.render(self, text, entities)
+
+    def _links(self, entities):
+        '''Return the `(start, end, kind)` of the entities to link.
+
+        Emojis are left out, and overlapping matches resolved by priority.
+        '''
+        layers = ([], [], [])
+        for i in range(0, len(entities), 3):
+            kind, start, end = entities[i], entities[i + 1], entities[i + 2]
+            if kind != EMOJI_ENTITY:
+                layers[kind].append((start, end, kind))
+        return self._resolve(*layers)
+
+    def _resolve(self, *layers):
+        '''Merge match layers into one sorted, non-overlapping list.
+
+        Layers are given in priority order (URLs, usernames, hashtags) and a
+        match is only kept when it does not overlap a match of a higher
+        priority layer, which is what the former sequential `sub()` passes
+        did when a later pass could not see into HTML written by an earlier
+        one.
+        '''
+        accepted = []
+        for layer in layers:
+            if not accepted:
+                accepted = layer
+                continue
+
+            merged = []
+            i, count = 0, len(accepted)
+            for match in layer:
+                start, end = match[0], match[1]
+                while i < count and accepted[i][1] <= start:
+                    merged.append(accepted[i])
+                    i += 1
+                if i < count and accepted[i][0] < end:
+                    continue
+                merged.append(match)
+            merged.extend(accepted[i:])
+            accepted = merged
+        return accepted
+
+    def _parse_urls(self, ctx, match):
         '''Parse URLs.'''
 
-        mat = match.group(0)
-
         # Fix a bug in the regex concerning www...com and www.-foo.com domains
         # TODO fix this in the regex instead of working around it here
         domain = match.group(5)
         if domain[0] in '.-':
-            return mat
+            return
 
         # Only allow IANA one letter domains that are actually registered
         if len(domain) == 5 \
            and domain[-4:].lower() in ('.com', '.org', '.net') \
            and not domain.lower() in IANA_ONE_LETTER_DOMAINS:
 
-            return mat
-
-        # Check for urls without http(s)
-        pos = mat.find('http')
-        if pos != -1:
-            pre, url = mat[:pos], mat[pos:]
-            full_url = url
-
-        # Find the www and force https://
-        else:
-            pos = mat.lower().find('www')
-            pre, url = mat[:pos], mat[pos:]
-            full_url = 'https://%s' % url
-
-        if self._include_spans:
-            span = match.span(0)
-            # add an offset if pre is e.g. ' '
-            span = (span[0] + len(pre), span[1])
-            self._urls.append((url, span))
-        else:
-            self._urls.append(url)
+            return
 
-        if self._html:
-            return '%s%s' % (pre, self.format_url(
-                full_url, self._shorten_url(escape(url))))
+        # Leave out the character matched in front of the URL
+        start, end = match.span(3)
+        ctx.entities.extend((URL_ENTITY, start, end))
 
     def _parse_username(self, string):
         '''Parse individual username'''
@@ -220,66 +906,58 @@ class Parser(object):
 
         return string, extra
 
-    def _parse_users(self, match):
+    def _parse_users(self, ctx, match):
         '''Parse usernames.'''
 
         # Don't parse lists here
         if match.group(2) is not None:
-            return match.group(0)
-
-        mat = match.group(0)
+            return
 
-        parsed_username, extra = self._parse_username(mat[1:])
+        parsed_username, extra = self._parse_username(match.group(1))
 
         if not parsed_username:
-            if self._html:
-                return mat
             return
 
-        if self._include_spans:
-            self._users.append((parsed_username, match.span(0)))
-        else:
-            self._users.append(parsed_username)
-
-        if self._html:
-            return self.format_username(mat[0:1], parsed_username) + extra
+        # Anything cut off the username (`extra`) is not part of the entity
+        start = match.start(0)
+        ctx.entities.extend((USER_ENTITY, start, start + 1 + len(parsed_username)))
 
-    def _parse_tags(self, match):
+    def _parse_tags(self, ctx, match):
         '''Parse hashtags.'''
 
         mat = match.group(0)
 
         # Fix problems with the regex capturing stuff infront of the #
-        tag = None
         for i in '#\uff03':
             pos = mat.rfind(i)
             if pos != -1:
-                tag = i
                 break
 
-        pre, text = mat[:pos], mat[pos + 1:]
-        if self._include_spans:
-            span = match.span(0)
-            # add an offset if pre is e.g. ' '
-            span = (span[0] + len(pre), span[1])
-            self._tags.append((text, span))
-        else:
-            self._tags.append(text)
+        # add an offset if pre is e.g. ' '
+        ctx.entities.extend((TAG_ENTITY, match.start(0) + pos, match.end(0)))
 
-        if self._html:
-            return '%s%s' % (pre, self.format_tag(tag, text))
-
-    def _parse_emojis(self, match):
+    def _parse_emojis(self, ctx, match):
         '''Parse emojis.'''
 
-        mat = match.group(0)
-
         # Ignore fitzpatrick 'emojis'
-        if mat not in FITZPATRICK_EMOJIS:
-            self._emojis.append(mat)
-
-        if self._html:
-            return mat
+        if match.group(0) not in FITZPATRICK_EMOJIS:
+            start, end = match.span(0)
+            ctx.entities.extend((EMOJI_ENTITY, start, end))
+
+    # The entity passes in record order: the kind, the pre-filter trigger,
+    # the matcher and the name of the method called with each match
+    _passes = (
+        (URL_ENTITY, _has_url_trigger, find_urls, '_parse_urls'),
+        (USER_ENTITY, _has_at_sign, USERNAME_REGEX.finditer, '_parse_users'),
+        (TAG_ENTITY, _has_hash_sign, HASHTAG_REGEX.finditer, '_parse_tags'),
+        (EMOJI_ENTITY, _has_non_ascii, EMOJI_REGEX.finditer, '_parse_emojis'))
+    # With `emoji_sequences`
+    _sequence_passes = _passes[:EMOJI_ENTITY] + (
+        (EMOJI_ENTITY, _has_non_ascii, EMOJI_SEQUENCE_REGEX.finditer, '_parse_emojis'),)
+
+    def _format_url_match(self, url):
+        '''Return formatted HTML for a matched url.'''
+        return self._renderer.format_url_match(self, url)
 
     def _shorten_url(self, text):
         '''Shorten a URL and make sure to not cut of html entities.'''
@@ -299,22 +977,281 @@ class Parser(object):
     # User defined formatters -------------------------------------------------
     def format_tag(self, tag, text):
         '''Return formatted HTML for a hashtag.'''
-        return '<a href="https://instagram.com/explore/tags/%s/">%s%s</a>' \
-            % (quote((text).encode('utf-8')), tag, text)
+        return self._renderer.format_tag(tag, text)
 
     def format_username(self, at_char, user):
         '''Return formatted HTML for a username.'''
-        return '<a href="https://instagram.com/%s">%s%s</a>' \
-               % (user, at_char, user)
+        return self._renderer.format_username(at_char, user)
 
     def format_url(self, url, text):
         '''Return formatted HTML for a url.'''
-        return '<a href="%s">%s</a>' % (escape(url), text)
+        return self._renderer.format_url(url, text)
 
 
 # Simple URL escaper
 def escape(text):
     '''Escape some HTML entities.'''
-    return ''.join({'&': '&amp;', '"': '&quot;',
-                    '\'': '&apos;', '>': '&gt;',
-                    '<': '&lt;'}.get(c, c) for c in text)
+    # Each replace() runs in C and returns quickly when there is nothing to
+    # replace, which beats str.translate() with a table. '&' goes first so
+    # the other entities are not escaped again.
+    return text.replace('&', '&amp;').replace('"', '&quot;').replace(
+        '\'', '&apos;').replace('>', '&gt;').replace('<', '&lt;')
+
+
+MARKDOWN_REGEX = re.compile(r'[\\`*_\[\]<>#]')
+
+
+def markdown_escape(text):
+    '''Escape the characters with a meaning in Markdown.'''
+    return MARKDOWN_REGEX.sub(r'\\\g<0>', text)
+
+
+# Renderers -------------------------------------------------------------------
+# -----------------------------------------------------------------------------
+def _overrides(cls):
+    '''Return the `format_*` methods a Parser subclass replaces, by name.'''
+    overrides = {}
+    for name, default in _PARSER_FORMATTERS.items():
+        method = getattr(cls, name)
+        if getattr(method, '__func__', method) is not default:
+            overrides[name] = method
+    return overrides
+
+
+class Template(object):
+
+    '''A link template, compiled once into a `%` format string.
+
+    Fields are written as `{name}`, e.g. `'<a href="{href}">{text}</a>'`,
+    and rendering is a single `%` operation on a dict of field values with
+    the compiled `pattern`.
+    '''
+
+    def __init__(self, source):
+        self.source = source
+        self.fields = []
+        parts = []
+        for literal, field, spec, conversion in Formatter().parse(source):
+            parts.append(literal.replace('%', '%%'))
+            if field is not None:
+                parts.append('%%(%s)s' % field)
+                self.fields.append(field)
+        self.pattern = ''.join(parts)
+
+    def __call__(self, fields):
+        return self.pattern % fields
+
+    def __repr__(self):
+        return 'Template(%r)' % self.source
+
+
+class Renderer(object):
+
+    '''Turns a text and its entity records into linked output.
+
+    The text is walked once, copying the text between links through
+    `escape_text()` and formatting each link with a template: `tag_template`
+    gets the fields `sign`, `tag` and `quoted` (the URL quoted tag),
+    `user_template` gets `sign`, `user` and `name` (the unescaped username)
+    and `url_template` gets `href` and `text`.
+
+    When the parser is a subclass overriding `format_tag`,
+    `format_username` or `format_url`, its method is used instead.
+    Formatted tags and usernames are memoized, up to `cache_size` of them.
+    '''
+
+    tag_template = None
+    user_template = None
+    url_template = None
+
+    def __init__(self, tag_template=None, user_template=None, url_template=None,
+                 cache_size=10000):
+        for name, source in (('tag_template', tag_template), ('user_template', user_template),
+                             ('url_template', url_template)):
+            source = source or getattr(self, name)
+            setattr(self, name, None if source is None else Template(source))
+        self.cache_size = cache_size
+        self._formatted = {}
+        self._overrides = {}
+
+    def __getstate__(self):
+        # Copies, e.g. the parser sent to the workers of itp.parallel, leave
+        # the memoized links behind and start empty
+        state = self.__dict__.copy()
+        del state['_formatted'], state['_overrides']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._formatted = {}
+        self._overrides = {}
+
+    def escape(self, text):
+        '''Escape the text of a link.'''
+        return text
+
+    # A function escaping the text between links, None to keep it as it is
+    escape_text = None
+
+    def href(self, url):
+        '''Escape a url as the target of a link.'''
+        return url
+
+    def key(self):
+        '''Return a hashable value that is equal for renderers with equal output.'''
+        return (self.__class__,) + tuple(
+            template and template.source
+            for template in (self.tag_template, self.user_template, self.url_template))
+
+    def render(self, parser, text, entities):
+        '''Return the output for a text parsed by `parser`.'''
+        escape_text = self.escape_text
+        links = parser._links(entities) if entities else None
+        if not links:
+            return text if escape_text is None else escape_text(text)
+
+        overrides = self._overrides.get(parser.__class__)
+        if overrides is None:
+            overrides = self._overrides[parser.__class__] = _overrides(parser.__class__)
+        format_url = format_username = format_tag = None
+        if overrides:
+            format_url = 'format_url' in overrides and parser.format_url
+            format_username = 'format_username' in overrides and parser.format_username
+            format_tag = 'format_tag' in overrides and parser.format_tag
+        format_username = format_username or self.format_username
+        format_tag = format_tag or self.format_tag
+
+        output = []
+        pos = 0
+        for start, end, kind in links:
+            if escape_text is None:
+                output.append(text[pos:start])
+            else:
+                output.append(escape_text(text[pos:start]))
+            if kind == URL_ENTITY:
+                output.append(self.format_url_match(parser, text[start:end], format_url or None))
+            elif kind == USER_ENTITY:
+                output.append(format_username(text[start], text[start + 1:end]))
+            else:
+                output.append(format_tag(text[start], text[start + 1:end]))
+            pos = end
+        output.append(text[pos:] if escape_text is None else escape_text(text[pos:]))
+        return ''.join(output)
+
+    def format_url_match(self, parser, url, format_url=None):
+        '''Return a link for a matched url, shortened for display.'''
+        # Force https:// on urls starting with www
+        if url[:4].lower() == 'www.':
+            full_url = 'https://%s' % url
+        else:
+            full_url = url
+        text = parser._shorten_url(self.escape(url))
+        if format_url is not None:
+            return format_url(full_url, text)
+        return self.url_template({'href': self.href(full_url), 'text': text})
+
+    def format_tag(self, tag, text):
+        '''Return a link for a hashtag, `tag` being the hash sign.'''
+        key = tag + text
+        link = self._formatted.get(key)
+        if link is None:
+            link = self._remember(key, self.tag_template({
+                'sign': tag, 'tag': self.escape(text), 'quoted': quote(text.encode('utf-8'))}))
+        return link
+
+    def format_username(self, at_char, user):
+        '''Return a link for a username.'''
+        key = at_char + user
+        link = self._formatted.get(key)
+        if link is None:
+            link = self._remember(key, self.user_template({
+                'sign': at_char, 'user': self.escape(user), 'name': user}))
+        return link
+
+    def _remember(self, key, link):
+        # Tags and usernames share the cache, told apart by their sign
+        if len(self._formatted) >= self.cache_size:
+            self._formatted.clear()
+        self._formatted[key] = link
+        return link
+
+    def format_url(self, url, text):
+        '''Return a link for a url with an already escaped `text`.'''
+        return self.url_template({'href': self.href(url), 'text': text})
+
+
+class HTMLRenderer(Renderer):
+
+    '''Renders HTML anchors, leaving the text between them as it is.'''
+
+    tag_template = '<a href="https://instagram.com/explore/tags/{quoted}/">{sign}{tag}</a>'
+    user_template = '<a href="https://instagram.com/{name}">{sign}{user}</a>'
+    url_template = '<a href="{href}">{text}</a>'
+
+    escape = staticmethod(escape)
+    href = staticmethod(escape)
+
+    def format_url_match(self, parser, url, format_url=None):
+        '''Return a link for a matched url, escaping it only once.'''
+        escaped = escape(url)
+        text = parser._shorten_url(escaped)
+        www = url[:4].lower() == 'www.'
+        if format_url is not None:
+            return format_url('https://%s' % url if www else url, text)
+        # The https:// prefix needs no escaping
+        href = 'https://%s' % escaped if www else escaped
+        return self.url_template.pattern % {'href': href, 'text': text}
+
+
+class MarkdownRenderer(Renderer):
+
+    '''Renders Markdown links, escaping Markdown syntax in the text.'''
+
+    tag_template = '[{sign}{tag}](https://instagram.com/explore/tags/{quoted}/)'
+    user_template = '[{sign}{user}](https://instagram.com/{name})'
+    url_template = '[{text}]({href})'
+
+    escape = escape_text = staticmethod(markdown_escape)
+
+    def href(self, url):
+        return url.replace('(', '%28').replace(')', '%29').replace(' ', '%20')
+
+
+class JSONRenderer(Renderer):
+
+    '''Renders the text and all its entities as a JSON object.
+
+    Entities are `{"type", "value", "start", "end"}` objects in text order,
+    with UTF-16 offsets if the parser counts spans in UTF-16. Keyword
+    arguments are passed on to `json.dumps()`. There are no links, so the
+    `format_*` methods are not used.
+    '''
+
+    TYPES = ('url', 'user', 'tag', 'emoji')
+
+    def __init__(self, **kwargs):
+        Renderer.__init__(self)
+        self.kwargs = kwargs
+
+    def key(self):
+        return (self.__class__, repr(sorted(self.kwargs.items())))
+
+    def render(self, parser, text, entities):
+        offsets = None
+        if parser._include_spans == UTF16 and entities:
+            offsets = utf16_offsets(text)
+
+        records = []
+        for i in range(0, len(entities), 3):
+            kind, start, end = entities[i], entities[i + 1], entities[i + 2]
+            value = text[start + 1:end] if kind in (USER_ENTITY, TAG_ENTITY) else text[start:end]
+            if offsets is not None:
+                start, end = offsets[start], offsets[end]
+            records.append({'type': self.TYPES[kind], 'value': value, 'start': start, 'end': end})
+        records.sort(key=lambda record: record['start'])
+        return json.dumps({'text': text, 'entities': records}, sort_keys=True, **self.kwargs)
+
+
+_PARSER_FORMATTERS = dict(
+    (name, getattr(getattr(Parser, name), '__func__', getattr(Parser, name)))
+    for name in ('format_tag', 'format_username', 'format_url'))
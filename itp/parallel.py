@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Parse large numbers of captions/comments on a pool of worker processes"""
+from __future__ import unicode_literals
+import itertools
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from .itp import Parser, ParseContext, ParseResult
+
+DEFAULT_CHUNKSIZE = 500
+
+
+def _parse_chunk(parser, texts):
+    """Scan a chunk of texts in a worker, return their entity records
+
+    Only the compact entity arrays are sent back, the parent process still
+    has the texts and turns them into ParseResults.
+    """
+    ctx = ParseContext()
+    return [parser._scan(ctx, text) for text in texts]
+
+
+def _chunks(texts, chunksize):
+    """Split an iterable into lists of at most chunksize items"""
+    texts = iter(texts)
+    while True:
+        chunk = list(itertools.islice(texts, chunksize))
+        if not chunk:
+            return
+        yield chunk
+
+
+def parse_many(texts, html=True, parser=None, chunksize=DEFAULT_CHUNKSIZE,
+               max_workers=None, executor=None):
+    """Parse an iterable of texts on a process pool, yield ParseResults
+
+    Texts are sent to the workers in chunks of `chunksize` and the results
+    are yielded in input order. Only a few chunks per worker are in flight
+    at any time, so inputs of any size can be streamed.
+
+    `parser` may be an instance of a Parser subclass. Workers only find the
+    entities, the HTML is built by `parser` in this process when a result's
+    `html` is accessed, so overridden `format_*` methods always apply. An existing `executor`
+    can be passed in, otherwise a ProcessPoolExecutor with `max_workers`
+    processes is created and shut down when the generator is exhausted.
+    """
+    if chunksize < 1:
+        raise ValueError('chunksize must be at least 1')
+
+    if parser is None:
+        parser = Parser()
+
+    own_executor = executor is None
+    if own_executor:
+        executor = ProcessPoolExecutor(max_workers=max_workers)
+
+    # Keep every worker busy while bounding the number of pending results
+    max_pending = 2 * (getattr(executor, '_max_workers', None) or 1)
+    pending = deque()
+    try:
+        for chunk in _chunks(texts, chunksize):
+            pending.append((chunk, executor.submit(_parse_chunk, parser, chunk)))
+            if len(pending) >= max_pending:
+                chunk, future = pending.popleft()
+                for text, entities in zip(chunk, future.result()):
+                    yield ParseResult.from_entities(parser, text, entities, html)
+
+        while pending:
+            chunk, future = pending.popleft()
+            for text, entities in zip(chunk, future.result()):
+                yield ParseResult.from_entities(parser, text, entities, html)
+    finally:
+        for chunk, future in pending:
+            future.cancel()
+        if own_executor:
+            executor.shutdown()
+
+
+def parse(texts, html=True, parser=None, chunksize=DEFAULT_CHUNKSIZE,
+          max_workers=None, executor=None):
+    """Parse a sequence of texts on a process pool, return a list of ParseResults"""
+    return list(parse_many(texts, html=html, parser=parser,
+                           chunksize=chunksize, max_workers=max_workers,
+                           executor=executor))
@@ -19,8 +19,53 @@
 # twp - Unittests -------------------------------------------------------------
 # -----------------------------------------------------------------------------
 from __future__ import unicode_literals
+import gzip
+import io
+import json
+import os
+import pickle
+import random
+import re
+import shutil
+import sys
+import tempfile
+import threading
+import time
 import unittest
-import itp
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer  # Python3
+    from socketserver import ThreadingMixIn
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+
+try:
+    import requests
+except ImportError:
+    requests = None
+
+try:
+    import asyncio
+except ImportError:
+    asyncio = None
+
+# Import the itp package rather than itp/itp.py when run as a script
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import itp  # noqa
+import itp.corpus  # noqa
+from itp import aggregate, benchmarks, cli, columnar, emoji, parallel, utf8
+from itp.benchmarks import corpus  # noqa
+
+try:
+    from itp import aio  # Python 3.6+
+except (ImportError, SyntaxError):
+    aio = None
+
+
+def result_values(result):
+    return result.urls, result.users, result.reply, result.tags, result.emojis, result.html
 
 
 class TWPTests(unittest.TestCase):
@@ -185,6 +230,19 @@ class TWPTests(unittest.TestCase):
         )
         self.assertEqual(result.urls, ['http://word-and-a-number-8-ftw.domain.tld/'])
 
+    def test_url_uppercase_protocol(self):
+        result = self.parser.parse('text HTTP://example.com')
+        self.assertEqual(result.html, 'text <a href="HTTP://example.com">HTTP://example.com</a>')
+        self.assertEqual(result.urls, ['HTTP://example.com'])
+
+        result = self.parser.parse('text WWW.example.com')
+        self.assertEqual(result.html, 'text <a href="https://WWW.example.com">WWW.example.com</a>')
+        self.assertEqual(result.urls, ['WWW.example.com'])
+
+    def test_url_with_http_in_path(self):
+        result = self.parser.parse('text www.example.com/http')
+        self.assertEqual(result.urls, ['www.example.com/http'])
+
     # URL not tests ------------------------------------------------------------
     def test_not_url_dotdotdot(self):
         result = self.parser.parse('Is www...foo a valid URL?')
@@ -490,6 +548,162 @@ class TWPTests(unittest.TestCase):
         self.assertEqual(result.html, 'text <a href="https://instagram.com/explore/tags/hash_tag/">#hash_tag</a>')
         self.assertEqual(result.tags, ['hash_tag'])
 
+    # Text only tests --------------------------------------------------------
+    # --------------------------------------------------------------------------
+    def test_text_only_skips_formatting(self):
+        class NoFormatParser(itp.Parser):
+            def format_tag(self, tag, text):
+                raise AssertionError('format_tag called')
+
+            def format_username(self, at_char, user):
+                raise AssertionError('format_username called')
+
+            def format_url(self, url, text):
+                raise AssertionError('format_url called')
+
+        result = NoFormatParser().parse('@user #tag http://example.com \u2764\ufe0f', html=False)
+        self.assertEqual(result.html, None)
+        self.assertEqual(result.urls, ['http://example.com'])
+        self.assertEqual(result.users, ['user'])
+        self.assertEqual(result.tags, ['tag'])
+        self.assertEqual(result.emojis, ['\u2764\ufe0f'])
+
+    def test_escape(self):
+        self.assertEqual(itp.escape('a&b"c\'d>e<f&amp;'), 'a&amp;b&quot;c&apos;d&gt;e&lt;f&amp;amp;')
+        self.assertEqual(itp.escape('nothing to escape'), 'nothing to escape')
+
+    def test_url_escaped_once(self):
+        result = self.parser.parse("www.example.com/it's?a=1&b=2")
+        self.assertEqual(result.html, '<a href="https://www.example.com/it&apos;s?a=1&amp;b=2">'
+                                      'www.example.com/it&apos;s?a...</a>')
+
+    def test_format_url_gets_raw_url(self):
+        class UrlParser(itp.Parser):
+            def format_url(self, url, text):
+                return '[%s|%s]' % (url, text)
+
+        result = UrlParser().parse("www.example.com/it's?a=1&b=2")
+        self.assertEqual(result.html, "[https://www.example.com/it's?a=1&b=2|www.example.com/it&apos;s?a...]")
+
+    def test_text_only_same_entities_as_html(self):
+        text = 'Hey @user.name, #itp http://example.com/#frag www.example.com/@who'
+        result = self.parser.parse(text)
+        text_result = self.parser.parse(text, html=False)
+        self.assertEqual(result.urls, text_result.urls)
+        self.assertEqual(result.users, text_result.users)
+        self.assertEqual(result.tags, text_result.tags)
+        self.assertEqual(result.tags, ['itp', 'frag'])
+
+    # Batch tests ------------------------------------------------------------
+    # --------------------------------------------------------------------------
+    def test_parse_many(self):
+        texts = ['@user #tag', 'text http://example.com', '', '#one #two']
+        for html in (True, False):
+            results = list(self.parser.parse_many(texts, html=html))
+            expected = [self.parser.parse(text, html=html) for text in texts]
+            self.assertEqual([result_values(r) for r in results], [result_values(r) for r in expected])
+
+    def test_parse_many_is_lazy(self):
+        def texts():
+            yield '#first'
+            raise AssertionError('consumed too far')
+
+        results = self.parser.parse_many(texts())
+        self.assertEqual(next(results).tags, ['first'])
+
+    # Result tests -----------------------------------------------------------
+    # --------------------------------------------------------------------------
+    def test_result_slots(self):
+        result = self.parser.parse('@user #tag')
+        self.assertFalse(hasattr(result, '__dict__'))
+
+    def test_result_entities(self):
+        result = self.parser.parse('@user #tag http://example.com \u2600')
+        self.assertEqual(result.entities, [
+            (itp.URL_ENTITY, 11, 29), (itp.USER_ENTITY, 0, 5), (itp.TAG_ENTITY, 6, 10), (itp.EMOJI_ENTITY, 30, 31),
+        ])
+        self.assertEqual(self.parser.parse('no entities').entities, [])
+
+    def test_result_lazy_html(self):
+        class CountingParser(itp.Parser):
+            calls = 0
+
+            def format_tag(self, tag, text):
+                CountingParser.calls += 1
+                return itp.Parser.format_tag(self, tag, text)
+
+        result = CountingParser().parse('#tag')
+        self.assertEqual(result.tags, ['tag'])
+        self.assertEqual(CountingParser.calls, 0)
+        self.assertEqual(result.html, '<a href="https://instagram.com/explore/tags/tag/">#tag</a>')
+        self.assertEqual(result.html, '<a href="https://instagram.com/explore/tags/tag/">#tag</a>')
+        self.assertEqual(CountingParser.calls, 1)
+
+    def test_result_constructor(self):
+        result = itp.ParseResult(['http://example.com'], None, 'user', ['tag'], None, 'html')
+        self.assertEqual(result_values(result), (['http://example.com'], [], 'user', ['tag'], [], 'html'))
+        self.assertEqual(result.entities, [])
+
+    def test_result_attributes_writable(self):
+        result = self.parser.parse('#tag')
+        result.tags.append('other')
+        self.assertEqual(result.tags, ['tag', 'other'])
+        result.html = 'replaced'
+        self.assertEqual(result.html, 'replaced')
+
+    # Pre-filter tests -------------------------------------------------------
+    # --------------------------------------------------------------------------
+    def test_prefilter_stats(self):
+        parser = itp.Parser()
+        parser.parse('plain text')
+        parser.parse('@user http://example.com')
+        parser.parse('\u2764\ufe0f ＃tag www.example.com')
+        self.assertEqual(parser.prefilter_stats(), {'texts': 3, 'urls': 1, 'users': 2, 'tags': 2, 'emojis': 2})
+
+        parser.reset_prefilter_stats()
+        self.assertEqual(parser.prefilter_stats(), {'texts': 0, 'urls': 0, 'users': 0, 'tags': 0, 'emojis': 0})
+
+    def test_prefilter_same_results(self):
+        parser = itp.Parser(prefilter=False)
+        for text in ['plain', '＠user ＃tag', 'HTTP://EXAMPLE.COM', 'WWW.example.com', '1\u20e3', '@a #b \U0001f525']:
+            self.assertEqual(result_values(self.parser.parse(text)), result_values(parser.parse(text)))
+        self.assertEqual(parser.prefilter_stats()['texts'], 0)
+
+    # Selective extraction tests ---------------------------------------------
+    # --------------------------------------------------------------------------
+    def test_selected_entities(self):
+        text = '@user #tag http://example.com/#frag \U0001f525'
+        for prefilter in (True, False):
+            parser = itp.Parser(entities=('tags', 'urls'), prefilter=prefilter)
+            result = parser.parse(text)
+            self.assertEqual(result.tags, ['tag', 'frag'])
+            self.assertEqual(result.urls, ['http://example.com/#frag'])
+            self.assertEqual((result.users, result.emojis, result.reply), ([], [], None))
+            self.assertEqual(result.html, '@user <a href="https://instagram.com/explore/tags/tag/">#tag</a> '
+                                          '<a href="http://example.com/#frag">http://example.com/#frag</a> \U0001f525')
+
+    def test_selected_entity_stats(self):
+        parser = itp.Parser(entities='emojis')
+        self.assertEqual(parser.parse('@user \U0001f525').emojis, ['\U0001f525'])
+        parser.parse('plain')
+        self.assertEqual(parser.prefilter_stats(), {'texts': 2, 'urls': 0, 'users': 0, 'tags': 0, 'emojis': 1})
+
+    def test_overridden_handler(self):
+        class NoUrlParser(itp.Parser):
+            def _parse_urls(self, ctx, match):
+                pass
+
+        result = NoUrlParser().parse('#tag http://example.com')
+        self.assertEqual((result.urls, result.tags), ([], ['tag']))
+
+    def test_selected_entities_cached(self):
+        cache = itp.ParseCache()
+        itp.Parser(cache=cache, entities=['tags']).parse('@user #tag')
+        self.assertEqual(itp.Parser(cache=cache).parse('@user #tag').users, ['user'])
+
+    def test_unknown_entities(self):
+        self.assertRaises(ValueError, itp.Parser, entities=('tags', 'hashtags'))
+
     # Emoji tests -----------------------------------------------------------
     # --------------------------------------------------------------------------
     def test_emoji_single(self):
@@ -522,6 +736,40 @@ class TWPTests(unittest.TestCase):
         self.assertEqual(result.html, u'See all those santas \U0001f385\U0001f3fb\U0001f385\U0001f3ff')
         self.assertEqual(result.emojis, [u'\U0001F385', u'\U0001f385'])
 
+    def test_emoji_flag(self):
+        result = self.parser.parse(u'Go \U0001f1ef\U0001f1f5 and \U0001f1f4\U0001f1f2!')
+        self.assertEqual(result.emojis, [u'\U0001f1ef\U0001f1f5', u'\U0001f1f4\U0001f1f2'])
+
+    def test_emoji_unknown_flag(self):
+        result = self.parser.parse(u'\U0001f1e6\U0001f1e6')
+        self.assertEqual(result.emojis, [])
+
+    def test_emoji_keycap(self):
+        result = self.parser.parse(u'Press 1\u20e3 or #\u20e3')
+        self.assertEqual(result.emojis, [u'1\u20e3', u'#\u20e3'])
+        self.assertEqual(result.tags, [])
+
+    def test_emoji_zwj(self):
+        result = self.parser.parse(u'\U0001f468\u200d\U0001f469')
+        self.assertEqual(result.emojis, [u'\U0001f468\u200d', u'\U0001f469'])
+
+    def test_emoji_sequences(self):
+        parser = itp.Parser(emoji_sequences=True)
+        result = parser.parse(u'\U0001f468\u200d\U0001f469\u200d\U0001f467 \U0001f385\U0001f3fb\u2764\ufe0f \U0001f3ff')
+        self.assertEqual(result.emojis, [u'\U0001f468\u200d\U0001f469\u200d\U0001f467',
+                                         u'\U0001f385\U0001f3fb', u'\u2764\ufe0f'])
+        self.assertEqual(parser.parse(u'Go \U0001f1ef\U0001f1f5 1\u20e3').emojis, [u'\U0001f1ef\U0001f1f5', u'1\u20e3'])
+
+    def test_emoji_sequences_cached(self):
+        cache = itp.ParseCache()
+        text = u'\U0001f385\U0001f3fb'
+        self.assertEqual(itp.Parser(cache=cache).parse(text).emojis, [u'\U0001f385'])
+        self.assertEqual(itp.Parser(cache=cache, emoji_sequences=True).parse(text).emojis, [text])
+
+    def test_emoji_table(self):
+        for sequence in emoji.emoji_sequences():
+            self.assertEqual(emoji.EMOJI_REGEX.match(sequence).group(0), sequence)
+
     # Username tests -----------------------------------------------------------
     # --------------------------------------------------------------------------
     def test_not_username_preceded_letter(self):
@@ -675,6 +923,1090 @@ class TWPTestsWithSpans(unittest.TestCase):
         result = self.parser.parse(' http://some.com ', html=False)
         self.assertEqual(result.urls, [('http://some.com', (1, 16))])
 
+    def test_spans_with_html(self):
+        """Spans are offsets into the original text, not into the HTML"""
+        text = 'http://example.com @user #tag \u2764\ufe0f'
+        result = self.parser.parse(text)
+        self.assertEqual(result.urls, [('http://example.com', (0, 18))])
+        self.assertEqual(result.users, [('user', (19, 24))])
+        self.assertEqual(result.tags, [('tag', (25, 29))])
+        self.assertEqual(result.emojis, [('\u2764\ufe0f', (30, 32))])
+
+        text_result = self.parser.parse(text, html=False)
+        self.assertEqual(result.urls, text_result.urls)
+        self.assertEqual(result.users, text_result.users)
+        self.assertEqual(result.tags, text_result.tags)
+        self.assertEqual(result.emojis, text_result.emojis)
+
+    def test_spans_username_cut_off(self):
+        result = self.parser.parse('@user..name @other.')
+        self.assertEqual(result.users, [('user', (0, 5)), ('other', (12, 18))])
+
+    def test_spans_utf16(self):
+        text = '\U0001f600 #tag @user'
+        self.assertEqual(self.parser.parse(text).tags, [('tag', (2, 6))])
+
+        result = itp.Parser(include_spans=itp.UTF16).parse(text)
+        self.assertEqual(result.tags, [('tag', (3, 7))])
+        self.assertEqual(result.users, [('user', (8, 13))])
+        self.assertEqual(result.emojis, [('\U0001f600', (0, 2))])
+        self.assertEqual(result.utf16_entities, [
+            (itp.USER_ENTITY, 8, 13), (itp.TAG_ENTITY, 3, 7), (itp.EMOJI_ENTITY, 0, 2)
+        ])
+
+        result = itp.Parser(include_spans=itp.UTF16).parse('#tag')
+        self.assertEqual(result.tags, [('tag', (0, 4))])
+
+    def test_spans_invalid_unit(self):
+        self.assertRaises(ValueError, itp.Parser, include_spans='bytes')
+
+
+# The URL regex before it was made linear, which backtracks exponentially on
+# e.g. `www.a-a-a-...`. Only used on short inputs to check find_urls().
+REFERENCE_URL_REGEX = re.compile(
+    '((%s)((https?://|www\\.)(%s)(/(%s*%s)?)?(\\?%s*%s)?))' % (
+        r'(?:[^/"\':!=]|^|\:)',
+        r'([\.-]|[^\s_\!\.\/])+\.[a-z]{2,}(?::[0-9]+)?',
+        r'(?:[\.,]?[%s!\*\'\(\);:=\+\$/%s#\[\]\-_,~@])' % (itp.itp.UTF_CHARS, '%'),
+        itp.itp.PATH_ENDING_CHARS, itp.itp.QUERY_CHARS, itp.itp.QUERY_ENDING_CHARS),
+    re.IGNORECASE)
+
+
+def url_matches(matches):
+    return [(m.span(1), m.span(3), m.group(5)) for m in matches]
+
+
+class TWPUrlFuzzTests(unittest.TestCase):
+
+    """Test that URLs are found in linear time, with the same results"""
+    pieces = ['a', 'Z', '.', '-', ',', '/', '?', '#', '=', '&', '!', ')', ':', '8', '_', ' ',
+              '~', '%', "'", '"', '\u00e9', '.com', '.co', '..', 'www.', 'http://', 'HTTPS://']
+
+    def test_same_as_reference(self):
+        rng = random.Random(0)
+        for i in range(3000):
+            text = ''.join(rng.choice(self.pieces) for _ in range(rng.randint(1, 12)))
+            if text.count('-') > 6:
+                continue
+            self.assertEqual(url_matches(itp.itp.find_urls(text)),
+                             url_matches(REFERENCE_URL_REGEX.finditer(text)), text)
+            self.assertEqual(url_matches(itp.itp.find_urls(text)),
+                             url_matches(itp.itp.URL_REGEX.finditer(text)), text)
+
+    def test_adversarial_inputs(self):
+        p = itp.Parser()
+        n = 20000
+        texts = [
+            'www.' + 'a-' * n + '.',
+            'www.1' * n,
+            'xhttp://a' * n,
+            'http://' + '.' * n,
+            'http://' + '-.' * n,
+            'http://example.com/' + ',' * n + ' ',
+            'http://example.com/' + 'a.' * n + '.',
+            'http://example.com/?' + '!' * n,
+            'http://a.com:' * n,
+            ''.join(random.Random(1).choice(self.pieces) for _ in range(n)),
+        ]
+        for text in texts:
+            started = time.time()
+            p.parse(text).html
+            self.assertTrue(time.time() - started < 2, text[:20])
+
+    def test_max_text_length(self):
+        p = itp.Parser(max_text_length=25)
+        text = '#one http://example.com/path #two'
+        result = p.parse(text)
+        self.assertEqual(result.tags, ['one'])
+        self.assertEqual(result.urls, ['http://example.com/p'])
+        self.assertTrue(result.html.endswith('</a>ath #two'))
+        self.assertEqual(itp.Parser(max_text_length=100).parse(text).tags, ['one', 'two'])
+
+
+class TWPThreadSafetyTests(unittest.TestCase):
+
+    """Test that one Parser can be shared between threads"""
+    def setUp(self):
+        self.parser = itp.Parser(include_spans=True)
+
+    def test_shared_parser(self):
+        captions = [
+            '@user%d #tag%d http://example%d.com/ \u2764\ufe0f' % (i, i, i) for i in range(20)
+        ]
+        expected = [itp.Parser(include_spans=True).parse(caption) for caption in captions]
+        errors = []
+
+        def worker(offset):
+            for n in range(500):
+                index = (offset + n) % len(captions)
+                result = self.parser.parse(captions[index], html=bool(n % 2))
+                want = expected[index]
+                if (result.urls, result.users, result.tags, result.emojis) != \
+                        (want.urls, want.users, want.tags, want.emojis):
+                    errors.append(captions[index])
+
+        threads = [threading.Thread(target=worker, args=(i,)) for i in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+
+
+class UpperTagParser(itp.Parser):
+
+    def format_tag(self, tag, text):
+        return '%s%s' % (tag, text.upper())
+
+
+class TWPParallelTests(unittest.TestCase):
+
+    """Test parsing on a process pool"""
+    def test_parse_many_in_order(self):
+        texts = ['@user%d #tag%d http://example%d.com' % (i, i, i) for i in range(50)]
+        results = list(parallel.parse_many(texts, chunksize=7, max_workers=2))
+        expected = list(itp.Parser().parse_many(texts))
+        self.assertEqual([result_values(r) for r in results], [result_values(r) for r in expected])
+
+    def test_parse_subclass(self):
+        results = parallel.parse(['#one', '#two'], parser=UpperTagParser(), chunksize=1, max_workers=2)
+        self.assertEqual([r.html for r in results], ['#ONE', '#TWO'])
+        self.assertEqual([r.tags for r in results], [['one'], ['two']])
+
+    def test_parse_empty(self):
+        self.assertEqual(parallel.parse([], max_workers=1), [])
+
+    def test_bad_chunksize(self):
+        self.assertRaises(ValueError, parallel.parse, ['#tag'], chunksize=0)
+
+    def test_parse_with_cache(self):
+        parser = itp.Parser(cache=itp.ParseCache())
+        results = parallel.parse(['#one', '#one'], parser=parser, chunksize=1, max_workers=2)
+        self.assertEqual([r.tags for r in results], [['one'], ['one']])
+
+
+class TWPColumnarTests(unittest.TestCase):
+
+    """Test parsing batches into entity tables"""
+    def setUp(self):
+        self.texts = ['@user #tag http://example.com', 'nothing', '#caf\xe9 \U0001f600 #x', '']
+
+    def test_columns(self):
+        table = columnar.parse_table(self.texts)
+        self.assertEqual(table.captions, 4)
+        self.assertEqual(len(table), 6)
+        self.assertEqual(list(table.rows()), [
+            (0, itp.URL_ENTITY, 11, 29, 'http://example.com'),
+            (0, itp.USER_ENTITY, 0, 5, 'user'),
+            (0, itp.TAG_ENTITY, 6, 10, 'tag'),
+            (2, itp.TAG_ENTITY, 0, 5, 'caf\xe9'),
+            (2, itp.TAG_ENTITY, 8, 10, 'x'),
+            (2, itp.EMOJI_ENTITY, 6, 7, '\U0001f600'),
+        ])
+        self.assertEqual(list(table.value_offsets), [0, 18, 22, 25, 30, 31, 35])
+        self.assertEqual(len(table.values), 35)
+
+    def test_same_as_results(self):
+        texts = corpus.generate(size=50, seed=2)['emoji_dense']
+        parser = itp.Parser(include_spans=itp.UTF16)
+        expected = []
+        for index, result in enumerate(parser.parse_many(texts, html=False)):
+            for kind, values in enumerate((result.urls, result.users, result.tags, result.emojis)):
+                expected.extend((index, kind, start, end, value) for value, (start, end) in values)
+        self.assertEqual(list(columnar.parse_table(texts, parser).rows()), expected)
+
+    def test_empty(self):
+        table = columnar.parse_table(iter([]))
+        self.assertEqual((table.captions, len(table), list(table.value_offsets)), (0, 0, [0]))
+
+    @unittest.skipIf(columnar.numpy is None, 'NumPy is not installed')
+    def test_to_numpy(self):
+        table = columnar.parse_table(self.texts)
+        columns = table.to_numpy()
+        self.assertEqual(columns['start'].tolist(), list(table.start))
+        self.assertEqual(columns['kind'].tolist(), list(table.kind))
+        self.assertEqual(columns['values'].tobytes(), bytes(table.values))
+
+    @unittest.skipIf(columnar.pyarrow is None, 'pyarrow is not installed')
+    def test_to_arrow(self):
+        table = columnar.parse_table(self.texts)
+        arrow = table.to_arrow()
+        self.assertEqual(arrow.column('value').to_pylist(), [row[4] for row in table.rows()])
+        self.assertEqual(arrow.column('caption').to_pylist(), list(table.caption))
+
+
+class TWPAggregateTests(unittest.TestCase):
+
+    """Test counting entities over streams of captions"""
+    def test_exact_counts(self):
+        counter = aggregate.EntityCounter()
+        counter.update(['#Summer @Bob', '#summer #SUN', 'no entities'])
+        counter.add_result(itp.Parser().parse('@bob #sun'))
+        self.assertEqual(counter.captions, 4)
+        self.assertEqual(counter.tags.most_common(), [('summer', 2), ('sun', 2)])
+        self.assertEqual(counter.users.most_common(1), [('bob', 2)])
+        self.assertTrue(counter.tags.exact)
+
+    def test_heavy_hitters(self):
+        rng = random.Random(1)
+        keys = ['key%d' % int(rng.paretovariate(1.1)) for i in range(5000)]
+        counts = {}
+        for key in keys:
+            counts[key] = counts.get(key, 0) + 1
+        counter = aggregate.HeavyHitters(capacity=20)
+        counter.update(keys[:100])
+        for key in keys[100:]:
+            counter.add(key)
+        self.assertFalse(counter.exact)
+        self.assertEqual(len(counter), 20)
+        self.assertEqual(counter.total, 5000)
+        for key, count in counter.most_common():
+            self.assertTrue(counts[key] <= count <= counts[key] + counter.error(key))
+        for key, count in counts.items():
+            if count > 5000 / 20:
+                self.assertTrue(key in counter)
+
+    def test_merge(self):
+        counters = []
+        for texts in (['#a #b', '#a'], ['#a #c #d', '#c']):
+            counter = aggregate.EntityCounter(capacity=3)
+            counter.update(texts)
+            counters.append(counter)
+        counters[0].merge(counters[1])
+        tags = counters[0].tags
+        self.assertEqual(counters[0].captions, 4)
+        self.assertEqual(tags.total, 7)
+        self.assertEqual(tags.most_common(1), [('a', 3)])
+        self.assertEqual((tags.count('c'), tags.error('c')), (2, 0))
+        self.assertTrue(len(tags) <= 3 and not tags.exact)
+
+    def test_bad_capacity(self):
+        self.assertRaises(ValueError, aggregate.HeavyHitters, 0)
+
+
+class TWPRendererTests(unittest.TestCase):
+
+    """Test the output renderers"""
+    text = "@user_1 loves #caf\u00e9_ and www.example.com/a_(b) *x*"
+
+    def test_pickle_leaves_memo_behind(self):
+        parser = itp.Parser(renderer=itp.MarkdownRenderer())
+        size = len(pickle.dumps(parser))
+        for i in range(500):
+            parser.parse('#tag%d @user%d' % (i, i)).html
+        copy = pickle.loads(pickle.dumps(parser))
+        self.assertTrue(len(pickle.dumps(parser)) < size + 100)
+        self.assertEqual(copy.parse(self.text).html, parser.parse(self.text).html)
+
+    def test_template(self):
+        template = itp.Template('{a}%s{{literal}}{b}')
+        self.assertEqual(template.fields, ['a', 'b'])
+        self.assertEqual(template({'a': 1, 'b': 2}), '1%s{literal}2')
+
+    def test_html_templates(self):
+        renderer = itp.HTMLRenderer(tag_template='<tag q="{quoted}">{sign}{tag}</tag>',
+                                    url_template='<url>{text}</url>')
+        result = itp.Parser(renderer=renderer).parse(self.text)
+        self.assertEqual(result.html, '<a href="https://instagram.com/user_1">@user_1</a> loves '
+                                      '<tag q="caf%C3%A9_">#caf\u00e9_</tag> and '
+                                      '<url>www.example.com/a_(b)</url> *x*')
+
+    def test_markdown(self):
+        result = itp.Parser(renderer=itp.MarkdownRenderer()).parse(self.text)
+        self.assertEqual(result.html, '[@user\\_1](https://instagram.com/user_1) loves '
+                                      '[#caf\u00e9\\_](https://instagram.com/explore/tags/caf%C3%A9_/) and '
+                                      '[www.example.com/a\\_(b)](https://www.example.com/a_%28b%29) \\*x\\*')
+        self.assertEqual(itp.Parser().parse(self.text).render(itp.MarkdownRenderer()), result.html)
+
+    def test_json(self):
+        parser = itp.Parser(include_spans='utf16', renderer=itp.JSONRenderer())
+        output = json.loads(parser.parse('\U0001f600 #tag @user').html)
+        self.assertEqual(output, {'text': '\U0001f600 #tag @user', 'entities': [
+            {'type': 'emoji', 'value': '\U0001f600', 'start': 0, 'end': 2},
+            {'type': 'tag', 'value': 'tag', 'start': 3, 'end': 7},
+            {'type': 'user', 'value': 'user', 'start': 8, 'end': 13},
+        ]})
+
+    def test_render_default(self):
+        result = itp.Parser().parse(self.text, html=False)
+        self.assertEqual(result.html, None)
+        self.assertEqual(result.render(), itp.Parser().parse(self.text).html)
+        self.assertRaises(ValueError, itp.ParseResult([], [], None, [], [], None).render)
+
+    def test_subclass_with_renderer(self):
+        result = UpperTagParser(renderer=itp.MarkdownRenderer()).parse('#tag @user')
+        self.assertEqual(result.html, '#TAG [@user](https://instagram.com/user)')
+        self.assertEqual(UpperTagParser().format_username('@', 'user'),
+                         '<a href="https://instagram.com/user">@user</a>')
+
+    def test_tag_memo(self):
+        renderer = itp.HTMLRenderer(cache_size=2)
+        parser = itp.Parser(renderer=renderer)
+        for text in ('#a #b', '#a', '#c', '@d'):
+            parser.parse(text).html
+            self.assertTrue(len(renderer._formatted) <= 2)
+        self.assertEqual(parser.parse('#a #b #c').html, itp.Parser().parse('#a #b #c').html)
+
+    def test_cache_per_renderer(self):
+        cache = itp.ParseCache()
+        html = itp.Parser(cache=cache).parse('#tag').html
+        markdown = itp.Parser(cache=cache, renderer=itp.MarkdownRenderer()).parse('#tag').html
+        self.assertNotEqual(html, markdown)
+        self.assertEqual(itp.Parser(cache=cache).parse('#tag').html, html)
+        self.assertEqual(cache.stats()['hits'], 1)
+
+    def test_cache_per_offset_unit(self):
+        cache = itp.ParseCache()
+        text = '\U0001f600 #tag'
+        utf16 = itp.Parser(include_spans='utf16', renderer=itp.JSONRenderer(), cache=cache)
+        codepoints = itp.Parser(include_spans=True, renderer=itp.JSONRenderer(), cache=cache)
+        self.assertEqual(json.loads(utf16.parse(text).html)['entities'][1]['start'], 3)
+        self.assertEqual(json.loads(codepoints.parse(text).html)['entities'][1]['start'], 2)
+
+
+class TWPCacheTests(unittest.TestCase):
+
+    """Test the parse result cache"""
+    def setUp(self):
+        self.cache = itp.ParseCache()
+        self.parser = itp.Parser(cache=self.cache)
+        self.text = '@user #tag http://example.com/a_long_path_to_shorten_in_html'
+
+    def test_same_results(self):
+        expected = itp.Parser().parse(self.text)
+        for i in range(2):
+            self.assertEqual(result_values(self.parser.parse(self.text)), result_values(expected))
+        self.assertEqual(self.cache.stats()['hits'], 1)
+        self.assertEqual(self.cache.stats()['misses'], 1)
+
+    def test_html_flag(self):
+        self.assertEqual(self.parser.parse(self.text, html=False).html, None)
+        self.assertTrue(self.parser.parse(self.text).html)
+        self.assertEqual(self.parser.parse(self.text, html=False).html, None)
+        self.assertEqual(self.cache.stats()['hits'], 1)
+
+    def test_results_not_shared(self):
+        self.parser.parse(self.text).tags.append('other')
+        self.assertEqual(self.parser.parse(self.text).tags, ['tag'])
+
+    def test_entities_not_shared(self):
+        first = self.parser.parse(self.text)
+        second = self.parser.parse(self.text)
+        self.assertFalse(first._entities is second._entities)
+        del first._entities[:]
+        self.assertEqual(self.parser.parse(self.text).users, ['user'])
+
+    def test_parse_many(self):
+        results = list(self.parser.parse_many([self.text, 'plain', self.text]))
+        self.assertEqual([r.users for r in results], [['user'], [], ['user']])
+        self.assertEqual(self.cache.stats()['hit_rate'], 1.0 / 3)
+
+    def test_spans(self):
+        parser = itp.Parser(include_spans=True, cache=self.cache)
+        self.assertEqual(self.parser.parse('#tag').tags, ['tag'])
+        self.assertEqual(parser.parse('#tag').tags, [('tag', (0, 4))])
+
+    def test_subclass(self):
+        parser = UpperTagParser(cache=self.cache)
+        self.assertEqual(self.parser.parse('#tag').html, itp.Parser().parse('#tag').html)
+        self.assertEqual(parser.parse('#tag').html, '#TAG')
+        short = itp.Parser(max_url_length=5, cache=self.cache)
+        self.assertNotEqual(short.parse(self.text).html, self.parser.parse(self.text).html)
+
+    def test_maxsize(self):
+        cache = itp.ParseCache(maxsize=2)
+        parser = itp.Parser(cache=cache)
+        for text in ('#a', '#b', '#a', '#c', '#a', '#b'):
+            parser.parse(text)
+        self.assertEqual(cache.stats(), {'hits': 2, 'misses': 4, 'hit_rate': 2.0 / 6,
+                                         'evictions': 2, 'entries': 2, 'bytes': cache.stats()['bytes']})
+        cache.reset_stats()
+        cache.clear()
+        self.assertEqual(cache.stats(), {'hits': 0, 'misses': 0, 'hit_rate': 0.0,
+                                         'evictions': 0, 'entries': 0, 'bytes': 0})
+
+    def test_maxbytes(self):
+        cache = itp.ParseCache(maxbytes=2000)
+        parser = itp.Parser(cache=cache)
+        for i in range(100):
+            parser.parse('#tag%d' % i)
+        self.assertTrue(0 < cache.stats()['bytes'] <= 2000)
+        self.assertTrue(0 < len(cache) < 100)
+
+
+class TWPInstrumentationTests(unittest.TestCase):
+
+    """Test recording where parsing spends its time"""
+    def setUp(self):
+        self.instrumentation = itp.Instrumentation(slowest=2)
+        self.parser = itp.Parser(instrumentation=self.instrumentation)
+
+    def test_same_results(self):
+        for texts in corpus.generate(10).values():
+            for text in texts:
+                self.assertEqual(result_values(self.parser.parse(text)),
+                                 result_values(itp.Parser().parse(text)))
+
+    def test_counts(self):
+        self.parser.parse('@user @user/list @.dot http://a.com http://x.com \U0001f600 \U0001f3fd')
+        self.parser.parse('no entities at all')
+        snapshot = self.instrumentation.snapshot()
+        self.assertEqual(snapshot['texts'], 2)
+        passes = snapshot['passes']
+        self.assertEqual([passes[name]['runs'] for name in itp.ENTITY_NAMES], [1, 1, 0, 1])
+        self.assertEqual(passes['urls']['matches'], 2)
+        self.assertEqual(passes['urls']['rejected'], 1)
+        self.assertEqual(passes['users']['matches'], 3)
+        self.assertEqual(passes['users']['rejected'], 2)
+        self.assertEqual(passes['emojis']['rejected'], 1)
+        self.assertTrue(snapshot['seconds'] >= passes['urls']['seconds'] > 0)
+        self.assertEqual(self.parser.prefilter_stats()['tags'], 2)
+
+    def test_slowest(self):
+        for text in ('#a', '#' + 'a' * 20000, 'short', '@' + 'b' * 20000):
+            self.parser.parse(text, html=False)
+        slowest = self.instrumentation.snapshot()['slowest']
+        self.assertEqual(len(slowest), 2)
+        self.assertTrue(slowest[0][0] >= slowest[1][0])
+        self.assertEqual(sorted(len(text) for seconds, text in slowest), [20001, 20001])
+
+    def test_reset(self):
+        self.parser.parse('#tag')
+        self.instrumentation.reset()
+        snapshot = self.instrumentation.snapshot()
+        self.assertEqual((snapshot['texts'], snapshot['slowest'], snapshot['passes']['tags']['runs']),
+                         (0, [], 0))
+
+    def test_bytes(self):
+        text = '#tag @user \U0001f600'
+        self.assertEqual(self.parser.parse_bytes(text.encode('utf-8')).tags, ['tag'])
+        snapshot = self.instrumentation.snapshot()
+        self.assertEqual(snapshot['texts'], 1)
+        self.assertEqual([snapshot['passes'][name]['runs'] for name in itp.ENTITY_NAMES], [0, 1, 1, 1])
+
+    def test_copies_start_empty(self):
+        self.parser.parse('#tag')
+        copy = pickle.loads(pickle.dumps(self.parser))
+        copy.parse('#tag')
+        self.assertEqual(copy._instrumentation.snapshot()['texts'], 1)
+        self.assertEqual(self.instrumentation.snapshot()['texts'], 1)
+
+
+class TWPReparseTests(unittest.TestCase):
+
+    """Test re-parsing edited texts"""
+    def setUp(self):
+        self.parser = itp.Parser(include_spans=True)
+        self.text = '@user loves #summer and #sun http://example.com/a \U0001f600 #beach'
+
+    def assertReparsed(self, result, offset, deleted, inserted):
+        edited = self.parser.reparse(result, offset, deleted, inserted)
+        expected = self.parser.parse(edited._text)
+        self.assertEqual(edited.entities, expected.entities)
+        self.assertEqual(result_values(edited), result_values(expected))
+        return edited
+
+    def test_insert(self):
+        result = self.parser.parse(self.text)
+        edited = self.assertReparsed(result, 13, 0, 'hot')
+        self.assertEqual(edited.tags[0], ('hotsummer', (12, 22)))
+        self.assertEqual(edited.tags[-1], ('beach', (55, 61)))
+
+    def test_delete(self):
+        result = self.parser.parse(self.text)
+        edited = self.assertReparsed(result, 0, 6, '')
+        self.assertEqual(edited.users, [])
+        self.assertEqual(edited.reply, None)
+
+    def test_join_and_split(self):
+        result = self.parser.parse(self.text)
+        joined = self.assertReparsed(result, 23, 1, '')
+        self.assertEqual(joined.tags[1], ('sun', (23, 27)))
+        split = self.assertReparsed(joined, 20, 0, '#')
+        self.assertEqual([tag for tag, span in split.tags], ['summer', 'and', 'sun', 'beach'])
+
+    def test_url(self):
+        result = self.parser.parse(self.text)
+        edited = self.assertReparsed(result, 33, 0, 's')
+        self.assertEqual(edited.urls, [('https://example.com/a', (29, 50))])
+        self.assertReparsed(edited, 42, 8, '.')
+
+    def test_keystrokes(self):
+        result = self.parser.parse('')
+        for i, char in enumerate('hi @you, see www.example.com #a #b \u2764\ufe0f'):
+            result = self.assertReparsed(result, i, 0, char)
+        while result.entities:
+            result = self.assertReparsed(result, 0, 1, '')
+
+    def test_max_text_length(self):
+        parser = itp.Parser(max_text_length=10)
+        edited = parser.reparse(parser.parse('#a #b #c #d'), 0, 3, '')
+        self.assertEqual(edited.tags, ['b', 'c', 'd'])
+
+    def test_out_of_range(self):
+        result = self.parser.parse(self.text)
+        self.assertRaises(ValueError, self.parser.reparse, result, len(self.text), 1, '')
+        self.assertRaises(ValueError, self.parser.reparse, result, -1, 0, '')
+
+
+class TWPBytesTests(unittest.TestCase):
+
+    """Test parsing UTF-8 encoded bytes"""
+    pieces = ['@', '＠', '#', '＃', 'http://', 'www.', '.com', 'x.com', 'é.com',
+              'é', 'ſ', 'K', 'İ', '가', ' ', '　', '/', '?', '=',
+              '.', 'a', 'Z', '9', '_', '-', ':', '"', '\U0001f600', '\U0001f3fd', '️',
+              '‍', '\U0001f1f3\U0001f1f1', '1⃣', '\n']
+
+    def assertSameAsText(self, parser, text):
+        data = text.encode('utf-8')
+        offsets = [len(text[:i].encode('utf-8')) for i in range(len(text) + 1)]
+        expected = parser.parse(text)
+        result = parser.parse_bytes(data)
+        self.assertEqual(result.entities, [(kind, offsets[start], offsets[end])
+                                           for kind, start, end in expected.entities], text)
+        for name in itp.ENTITY_NAMES:
+            self.assertEqual(getattr(result, name), [
+                (value, (offsets[start], offsets[end]))
+                for value, (start, end) in getattr(expected, name)], text)
+        self.assertEqual(result.reply, expected.reply, text)
+
+    def test_same_as_text(self):
+        rng = random.Random(0)
+        for parser in (itp.Parser(include_spans=True), itp.Parser(include_spans=True, prefilter=False),
+                       itp.Parser(include_spans=True, emoji_sequences=True)):
+            for i in range(1500):
+                text = ''.join(rng.choice(self.pieces) for _ in range(rng.randint(0, 16)))
+                self.assertSameAsText(parser, text)
+
+    def test_corpus(self):
+        parser = itp.Parser(include_spans=True)
+        for texts in corpus.generate(20).values():
+            for text in texts:
+                self.assertSameAsText(parser, text)
+
+    def test_character_classes(self):
+        for char_class, flags in ((r'[^\s_\!\/]', re.IGNORECASE), ('[%s]' % itp.itp.UTF_CHARS, re.IGNORECASE),
+                                  (itp.itp.SPACES, 0), ('[a-z]', re.IGNORECASE)):
+            text_regex = re.compile(char_class, flags)
+            bytes_regex = re.compile(('(?:%s)$' % utf8.utf8_class(char_class, flags)).encode('latin-1'))
+            boundaries = set([0x7f, 0x80, 0x7ff, 0x800, 0xffff, 0x10000, 0x10ffff])
+            for first, last in utf8.code_point_ranges(char_class, flags):
+                boundaries.update((first - 1, first, last, last + 1))
+            for value in sorted(boundaries):
+                if 0 <= value <= sys.maxunicode and not 0xd800 <= value <= 0xdfff:
+                    char = emoji.code_point(value)
+                    self.assertEqual(text_regex.match(char) is not None,
+                                     bytes_regex.match(char.encode('utf-8')) is not None, hex(value))
+
+    @unittest.skipIf(sys.version_info < (3, 0), 'the classes are generated with Python 3')
+    def test_generated_classes(self):
+        self.assertEqual(utf8.byte_classes(), utf8.byte_classes(generated=False))
+
+    def test_input_types(self):
+        data = '@user #café \U0001f600 http://example.com'.encode('utf-8')
+        expected = self.parser_result(data)
+        self.assertEqual(self.parser_result(bytearray(data)), expected)
+        self.assertEqual(self.parser_result(memoryview(data)), expected)
+        self.assertEqual(expected, ([('http://example.com', (18, 36))], [('user', (0, 5))],
+                                    'user', [('café', (6, 12))], [('\U0001f600', (13, 17))]))
+
+    def parser_result(self, data):
+        result = itp.Parser(include_spans=True).parse_bytes(data)
+        return result.urls, result.users, result.reply, result.tags, result.emojis
+
+    def test_max_text_length(self):
+        data = '#aé #bcé'.encode('utf-8')
+        self.assertEqual(itp.Parser(max_text_length=9).parse_bytes(data).tags, ['aé', 'bc'])
+        self.assertEqual(itp.Parser(max_text_length=10).parse_bytes(data).tags, ['aé', 'bcé'])
+
+    def test_entities(self):
+        result = itp.Parser(entities=('tags',)).parse_bytes(b'@user #tag')
+        self.assertEqual((result.users, result.tags, result.reply), ([], ['tag'], None))
+
+    def test_no_html(self):
+        result = itp.Parser().parse_bytes(b'#tag')
+        self.assertEqual(result.html, None)
+        self.assertRaises(ValueError, result.render)
+        self.assertRaises(ValueError, lambda: result.utf16_entities)
+
+
+class TWPCorpusTests(unittest.TestCase):
+
+    """Test scanning memory mapped caption files"""
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'captions.txt')
+        self.data = '@one #café\r\n\nno entities\n\U0001f600 http://example.com\n#last'.encode('utf-8')
+        with io.open(self.path, 'wb') as f:
+            f.write(self.data)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def expected(self):
+        parser = itp.Parser()
+        lines = []
+        offset = 0
+        for line in self.data.split(b'\n'):
+            if line.rstrip(b'\r'):
+                result = parser.parse_bytes(line.rstrip(b'\r'))
+                lines.append((offset, [value for entity in result.entities for value in entity]))
+            offset += len(line) + 1
+        return lines
+
+    def scanned(self, *args, **kwargs):
+        return [(offset, list(records)) for offset, records in itp.corpus.scan(self.path, *args, **kwargs)]
+
+    def test_split(self):
+        self.assertEqual(itp.corpus.split(b'a\nbb\nccc\n', 1), [(0, 2), (2, 5), (5, 9)])
+        self.assertEqual(itp.corpus.split(b'a\nbb\nccc', 3), [(0, 5), (5, 8)])
+        self.assertEqual(itp.corpus.split(b'', 3), [])
+        self.assertRaises(ValueError, itp.corpus.split, b'a', 0)
+
+    def test_scan(self):
+        expected = self.expected()
+        self.assertEqual([offset for offset, records in expected], [0, 14, 26, 50])
+        self.assertEqual(expected[1], (14, []))
+        self.assertEqual(self.scanned(), expected)
+        for size in (1, 7, 30):
+            self.assertEqual(self.scanned(range_size=size), expected)
+
+    def test_workers(self):
+        self.assertEqual(self.scanned(itp.Parser(entities=('tags',)), range_size=10, workers=2),
+                         [(0, [2, 5, 11]), (14, []), (26, []), (50, [2, 0, 5])])
+
+    def test_empty_file(self):
+        with io.open(self.path, 'wb'):
+            pass
+        self.assertEqual(self.scanned(), [])
+
+
+class TWPBenchmarkTests(unittest.TestCase):
+
+    """Test the benchmark corpus and regression gates"""
+    def test_corpus(self):
+        generated = corpus.generate(size=20, seed=1)
+        self.assertEqual(sorted(generated), sorted(corpus.CATEGORIES))
+        self.assertEqual(len(generated['comments']), 20)
+        self.assertEqual(len(generated['pathological']), 2)
+        self.assertEqual(generated, corpus.generate(size=20, seed=1))
+        self.assertNotEqual(generated, corpus.generate(size=20, seed=2))
+
+    def test_run(self):
+        report = benchmarks.run(corpus.generate(size=5, categories=['comments']), rounds=1)
+        self.assertEqual(sorted(report['results']), ['comments/html', 'comments/text'])
+        metrics = report['results']['comments/html']
+        self.assertEqual(metrics['captions'], 5)
+        self.assertTrue(metrics['captions_per_sec'] > 0)
+        self.assertTrue(metrics['p50_us'] <= metrics['p99_us'])
+        if benchmarks.tracemalloc is not None:
+            self.assertTrue(metrics['peak_bytes_per_call'] > 0)
+
+    def test_compare(self):
+        baseline = {'results': {
+            'a/html': {'captions_per_sec': 1000.0, 'peak_bytes_per_call': 10.0},
+            'b/html': {'captions_per_sec': 1000.0, 'peak_bytes_per_call': None},
+            'c/html': {'captions_per_sec': 1000.0, 'peak_bytes_per_call': 10.0},
+        }}
+        report = {'results': {
+            'a/html': {'captions_per_sec': 850.0, 'peak_bytes_per_call': 11.0},
+            'b/html': {'captions_per_sec': 700.0, 'peak_bytes_per_call': 5.0},
+            'c/html': {'captions_per_sec': 2000.0, 'peak_bytes_per_call': 13.0},
+            'd/html': {'captions_per_sec': 1.0, 'peak_bytes_per_call': 100.0},
+        }}
+        self.assertEqual(benchmarks.compare(baseline, report), [
+            'b/html: captions_per_sec 700.0, baseline 1000.0',
+            'c/html: peak_bytes_per_call 13.0, baseline 10.0',
+        ])
+        self.assertEqual(benchmarks.compare(baseline, report, threshold=0.5), [])
+
+
+class TWPCommandLineTests(unittest.TestCase):
+
+    """Test the itp command"""
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write(self, name, text, compress=False):
+        path = os.path.join(self.directory, name)
+        stream = gzip.open(path, 'wb') if compress else io.open(path, 'wb')
+        with stream:
+            stream.write(text.encode('utf-8'))
+        return path
+
+    def run_itp(self, *args):
+        output = os.path.join(self.directory, 'output.ndjson')
+        self.assertEqual(cli.main(list(args) + ['--output', output]), 0)
+        with io.open(output, encoding='utf-8') as f:
+            return [json.loads(line) for line in f]
+
+    def test_lines(self):
+        path = self.write('captions.txt', '@bob hi #tag http://x.com/a\r\nline\u2028break #two \U0001f600\n')
+        self.assertEqual(self.run_itp(path), [
+            {'line': 1, 'urls': ['http://x.com/a'], 'users': ['bob'], 'tags': ['tag'],
+             'emojis': [], 'reply': 'bob'},
+            {'line': 2, 'urls': [], 'users': [], 'tags': ['two'], 'emojis': ['\U0001f600'],
+             'reply': None},
+        ])
+
+    def test_ndjson(self):
+        path = self.write('captions.ndjson.gz', '{"id": "a", "caption": "#one"}\n\n'
+                                                '{"id": "b", "caption": "#two"}\n', compress=True)
+        records = self.run_itp('--format', 'ndjson', '--field', 'caption', '--id-field', 'id',
+                               '--spans', 'codepoints', path)
+        self.assertEqual([(r['id'], r['tags']) for r in records],
+                         [('a', [['one', [0, 4]]]), ('b', [['two', [0, 4]]])])
+
+    def test_csv(self):
+        path = self.write('captions.csv', 'id,text\n1,"two\nlines #tag"\n2,@user\n')
+        records = self.run_itp('-f', 'csv', '--html', path, path)
+        self.assertEqual([(r['file'], r['row'], r['tags'], r['users']) for r in records],
+                         [(path, 1, ['tag'], []), (path, 2, [], ['user'])] * 2)
+        self.assertTrue(records[0]['html'].startswith('two\nlines <a href='))
+
+    def test_workers(self):
+        path = self.write('captions.txt', ''.join('#tag%d\n' % i for i in range(100)))
+        records = self.run_itp('--workers', '2', '--chunksize', '7', path)
+        self.assertEqual([r['tags'] for r in records], [['tag%d' % i] for i in range(100)])
+        self.assertEqual([r['line'] for r in records], list(range(1, 101)))
+
+    def test_gzip_output(self):
+        path = self.write('captions.txt', '#tag\n')
+        output = os.path.join(self.directory, 'output.ndjson.gz')
+        self.assertEqual(cli.main([path, '-o', output]), 0)
+        with gzip.open(output) as f:
+            self.assertEqual(json.loads(f.read().decode('utf-8'))['tags'], ['tag'])
+
+    def test_entities(self):
+        path = self.write('captions.txt', '@bob #tag http://x.com/a\n')
+        self.assertEqual(self.run_itp('--entities', 'tags,urls', path),
+                         [{'line': 1, 'tags': ['tag'], 'urls': ['http://x.com/a']}])
+        self.assertRaises(SystemExit, cli.main, ['--entities', 'hashtags', path])
+
+    def test_emoji_sequences(self):
+        path = self.write('captions.txt', '\U0001f385\U0001f3fb\n')
+        self.assertEqual(self.run_itp('--entities', 'emojis', '--emoji-sequences', path),
+                         [{'line': 1, 'emojis': ['\U0001f385\U0001f3fb']}])
+
+    def test_missing_field(self):
+        path = self.write('captions.ndjson', '{"text": "#a"}\n{"caption": "#b"}\n')
+        output = os.path.join(self.directory, 'output.ndjson')
+        self.assertEqual(cli.main(['-f', 'ndjson', path, '-o', output]), 1)
+
+    def test_field_not_string(self):
+        path = self.write('captions.ndjson', '{"text": 5}\n')
+        output = os.path.join(self.directory, 'output.ndjson')
+        self.assertEqual(cli.main(['-f', 'ndjson', path, '-o', output]), 1)
+        self.assertRaises(cli.InputError, list, cli.read_captions([path], 'ndjson'))
+
+    def test_invalid_utf8(self):
+        path = os.path.join(self.directory, 'captions.txt')
+        with io.open(path, 'wb') as f:
+            f.write(b'#ok\n\xff\xfe #bad\n')
+        output = os.path.join(self.directory, 'output.ndjson')
+        self.assertEqual(cli.main([path, '-o', output]), 1)
+        try:
+            list(cli.read_captions([path]))
+        except cli.InputError as error:
+            self.assertTrue('line 2' in str(error))
+        else:
+            self.fail('InputError not raised')
+
+
+class StubHandler(BaseHTTPRequestHandler):
+
+    # path: (status, location, allow HEAD)
+    routes = {
+        '/short': (301, '/middle', True),
+        '/middle': (302, 'http://%(host)s/final', True),
+        '/final': (200, None, True),
+        '/nohead': (301, '/final', False),
+        '/loop': (302, '/loop', True),
+    }
+
+    def do_HEAD(self):
+        self.respond(head=True)
+
+    def do_GET(self):
+        self.respond(head=False)
+
+    def respond(self, head):
+        self.server.requests.append((self.command, self.path))
+        path = self.path.split('?')[0]
+        if path == '/slow':
+            time.sleep(1)
+        status, location, allow_head = self.routes.get(path, (404, None, True))
+        if head and not allow_head:
+            status, location = 405, None
+        self.send_response(status)
+        if location:
+            self.send_header('Location', location % {'host': '%s:%s' % self.server.server_address})
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+class StubServer(ThreadingMixIn, HTTPServer):
+
+    daemon_threads = True
+
+
+@unittest.skipIf(requests is None, 'requests is not installed')
+class TWPShortlinkTests(unittest.TestCase):
+
+    """Test the shortlink follower against a local HTTP server"""
+    def setUp(self):
+        self.server = StubServer(('127.0.0.1', 0), StubHandler)
+        self.server.requests = []
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        self.base = 'http://%s:%s' % self.server.server_address
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_follow_shortlinks(self):
+        from itp import utils
+        links = [self.base + '/short', self.base + '/final', self.base + '/short']
+        self.assertEqual(utils.follow_shortlinks(links), {
+            self.base + '/short': [self.base + '/short', self.base + '/middle', self.base + '/final'],
+            self.base + '/final': [self.base + '/final'],
+        })
+        self.assertEqual(set(method for method, path in self.server.requests), set(['HEAD']))
+
+    def test_head_not_allowed(self):
+        from itp import utils
+        result = utils.follow_shortlinks([self.base + '/nohead'])
+        self.assertEqual(result, {self.base + '/nohead': [self.base + '/nohead', self.base + '/final']})
+        self.assertIn(('GET', '/nohead'), self.server.requests)
+
+    def test_max_redirects(self):
+        from itp import utils
+        short = [self.base + '/short', self.base + '/middle', self.base + '/final']
+        self.assertEqual(utils.follow_shortlinks([self.base + '/short'], max_redirects=2),
+                         {self.base + '/short': short})
+        self.assertEqual(utils.follow_shortlinks([self.base + '/short'], max_redirects=1),
+                         {self.base + '/short': []})
+        self.assertEqual(utils.follow_shortlinks([self.base + '/nohead'], max_redirects=1),
+                         {self.base + '/nohead': [self.base + '/nohead', self.base + '/final']})
+        self.assertEqual(utils.follow_shortlinks([self.base + '/final'], max_redirects=0),
+                         {self.base + '/final': [self.base + '/final']})
+
+    def test_bad_links(self):
+        from itp import utils
+        links = [self.base + '/loop', self.base + '/slow', 'http://127.0.0.1:1/closed']
+        result = utils.follow_shortlinks(links, timeout=0.2, max_redirects=5)
+        self.assertEqual(result, dict((link, []) for link in links))
+
+    def test_concurrent(self):
+        from itp import utils
+        links = [self.base + '/slow?%d' % i for i in range(4)]
+        started = time.time()
+        resolver = utils.ShortlinkResolver(max_workers=4, max_per_host=4, timeout=5)
+        self.assertEqual(resolver.resolve(links), dict((link, [link]) for link in links))
+        resolver.close()
+        self.assertTrue(time.time() - started < 3)
+
+    def test_cache(self):
+        from itp import utils
+        cache = utils.ShortlinkCache()
+        links = [self.base + '/short', self.base + '/closed']
+        first = utils.follow_shortlinks(links, cache=cache)
+        count = len(self.server.requests)
+        self.assertEqual(utils.follow_shortlinks(links, cache=cache), first)
+        self.assertEqual(len(self.server.requests), count)
+        self.assertEqual(cache.stats(), {'hits': 2, 'disk_hits': 0, 'misses': 2})
+
+
+@unittest.skipIf(requests is None, 'requests is not installed')
+class TWPShortlinkCacheTests(unittest.TestCase):
+
+    """Test the shortlink cache tiers"""
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'shortlinks.db')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_lru(self):
+        from itp import utils
+        cache = utils.ShortlinkCache(maxsize=2)
+        cache.set('a', ['a', 'x'])
+        cache.set('b', ['b', 'x'])
+        self.assertEqual(cache.get('a'), ['a', 'x'])
+        cache.set('c', ['c', 'x'])
+        self.assertEqual(cache.get('b'), None)
+        self.assertEqual(cache.get('a'), ['a', 'x'])
+        self.assertEqual(cache.get('c'), ['c', 'x'])
+        self.assertEqual(cache.stats(), {'hits': 3, 'disk_hits': 0, 'misses': 1})
+        cache.reset_stats()
+        self.assertEqual(cache.stats(), {'hits': 0, 'disk_hits': 0, 'misses': 0})
+
+    def test_ttl(self):
+        from itp import utils
+        cache = utils.ShortlinkCache(ttl=None, negative_ttl=0)
+        cache.set('dead', [])
+        cache.set('alive', ['alive', 'x'])
+        self.assertEqual(cache.get('dead'), None)
+        self.assertEqual(cache.get('alive'), ['alive', 'x'])
+
+    def test_negative(self):
+        from itp import utils
+        cache = utils.ShortlinkCache()
+        cache.set('dead', [])
+        self.assertEqual(cache.get('dead'), [])
+
+    def test_disk(self):
+        from itp import utils
+        cache = utils.ShortlinkCache(path=self.path)
+        cache.set('a', ['a', 'x'])
+        cache.set('dead', [])
+        cache.close()
+
+        cache = utils.ShortlinkCache(maxsize=1, path=self.path)
+        self.assertEqual(cache.get('a'), ['a', 'x'])
+        self.assertEqual(cache.get('dead'), [])
+        self.assertEqual(cache.get('a'), ['a', 'x'])
+        self.assertEqual(cache.get('missing'), None)
+        self.assertEqual(cache.stats(), {'hits': 0, 'disk_hits': 3, 'misses': 1})
+        cache.clear()
+        self.assertEqual(cache.get('a'), None)
+        cache.close()
+
+
+class AsyncTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+
+    def tearDown(self):
+        self.loop.close()
+
+    def run_async(self, coroutine):
+        return self.loop.run_until_complete(coroutine)
+
+    def collect(self, iterator, limit=None):
+        """Return the items of an asynchronous iterator, at most `limit`"""
+        items = []
+        while limit is None or len(items) < limit:
+            try:
+                items.append(self.run_async(iterator.__anext__()))
+            except StopAsyncIteration:
+                break
+        return items
+
+
+@unittest.skipIf(aio is None, 'itp.aio needs Python 3.6+')
+class TWPAsyncParseTests(AsyncTestCase):
+
+    """Test parsing from asyncio"""
+    def test_parse(self):
+        result = self.run_async(aio.parse('@user #tag'))
+        self.assertEqual((result.users, result.tags), (['user'], ['tag']))
+        long_text = '#tag ' * 1000
+        result = self.run_async(aio.parse(long_text, html=False))
+        self.assertEqual(len(result.tags), 1000)
+        self.assertEqual(result.html, None)
+
+    def test_parse_many_in_order(self):
+        texts = ['@user%d #tag%d' % (i, i) for i in range(500)] + ['#x ' * 1000] * 3
+        results = self.collect(aio.parse_many(texts, chunksize=50, max_pending=2))
+        expected = list(itp.Parser().parse_many(texts))
+        self.assertEqual([result_values(r) for r in results], [result_values(r) for r in expected])
+
+    def test_backpressure(self):
+        consumed = []
+
+        def texts():
+            for i in range(100):
+                consumed.append(i)
+                yield '#tag ' * 500
+
+        results = aio.parse_many(texts(), chunksize=1, max_pending=2)
+        self.assertEqual(len(self.collect(results, limit=3)), 3)
+        self.assertEqual(len(consumed), 4)
+        self.run_async(results.aclose())
+
+    def test_bad_chunksize(self):
+        self.assertRaises(ValueError, self.collect, aio.parse_many(['#tag'], chunksize=0))
+
+
+@unittest.skipIf(aio is None or requests is None, 'itp.aio needs Python 3.6+ and requests')
+class TWPAsyncShortlinkTests(AsyncTestCase):
+
+    """Test the asynchronous shortlink follower against a local HTTP server"""
+    def setUp(self):
+        AsyncTestCase.setUp(self)
+        self.server = StubServer(('127.0.0.1', 0), StubHandler)
+        self.server.requests = []
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        self.base = 'http://%s:%s' % self.server.server_address
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        AsyncTestCase.tearDown(self)
+
+    def test_follow_shortlinks(self):
+        links = [self.base + '/short', self.base + '/nohead', self.base + '/short', self.base + '/loop']
+        result = self.run_async(aio.follow_shortlinks(links, max_redirects=3))
+        self.assertEqual(result, {
+            self.base + '/short': [self.base + '/short', self.base + '/middle', self.base + '/final'],
+            self.base + '/nohead': [self.base + '/nohead', self.base + '/final'],
+            self.base + '/loop': [],
+        })
+
+    def test_stream_async_iterable(self):
+        from itp import utils
+        resolver = aio.ShortlinkResolver(cache=utils.ShortlinkCache())
+        links = aio._iterate([self.base + '/final', self.base + '/short', self.base + '/final'])
+        pairs = self.collect(resolver.stream(links))
+        self.assertEqual(sorted(link for link, urls in pairs), [self.base + '/final', self.base + '/short'])
+        self.run_async(resolver.follow(self.base + '/short'))
+        self.assertEqual(resolver.cache.stats()['hits'], 1)
+        resolver.close()
+
+    def test_per_host_limit(self):
+        links = [self.base + '/slow?%d' % i for i in range(2)]
+        started = time.time()
+        self.run_async(aio.follow_shortlinks(links, max_per_host=1))
+        self.assertTrue(time.time() - started >= 2)
+
+    def test_cancel(self):
+        resolver = aio.ShortlinkResolver(max_workers=4)
+        consumed = []
+
+        def links():
+            for i in range(20):
+                consumed.append(i)
+                yield self.base + '/slow?%d' % i
+
+        stream = resolver.stream(links(), max_pending=2)
+        started = time.time()
+        self.assertEqual(len(self.collect(stream, limit=1)), 1)
+        self.run_async(stream.aclose())
+        self.assertTrue(len(consumed) <= 3)
+        self.assertTrue(time.time() - started < 3)
+        resolver.close()
+
+    def test_close_waits_for_threads(self):
+        resolver = aio.ShortlinkResolver(max_workers=1)
+        task = self.loop.create_task(resolver.follow(self.base + '/slow'))
+        self.run_async(asyncio.sleep(0.2))
+        task.cancel()
+        self.run_async(resolver.__aexit__(None, None, None))
+        self.assertFalse(any(thread.is_alive() for thread in resolver._executor._threads))
+
 
 # Test it!
 if __name__ == '__main__':
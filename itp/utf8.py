@@ -0,0 +1,404 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Find entities in UTF-8 encoded bytes without decoding them
+
+Used by `Parser.parse_bytes()`. The entity regexes of `itp.itp` are rebuilt
+here as bytes regexes: the code points every character class matches are
+turned into alternatives of UTF-8 byte sequences. A bytes regex thus
+matches the same characters as its text version, and reports spans as
+byte offsets. Input must be valid UTF-8.
+
+Finding the code points of a class takes a good part of a second, so the
+converted classes are generated ahead of time into `itp.utf8_classes` by
+running `python -m itp.utf8`. A class whose text version changed since is
+converted again when this module is imported, as are all classes on
+Python 2, whose case-insensitive classes match fewer characters.
+"""
+from __future__ import unicode_literals
+import io
+import os
+import re
+import sys
+from array import array
+
+from . import itp
+from .emoji import (EMOJI_SUFFIX, FITZPATRICK_MODIFIERS, VARIATION_SELECTORS, ZWJ, build_trie,
+                    code_point, emoji_sequences, trie_expression)
+from .itp import (URL_ENTITY, USER_ENTITY, TAG_ENTITY, EMOJI_ENTITY, IANA_ONE_LETTER_DOMAINS,
+                  ParseResult, find_urls, _lazy_attribute)
+
+try:
+    unichr
+except NameError:
+    unichr = chr  # Python3
+
+# The first code point of each UTF-8 sequence length, and the surrogates,
+# which cannot be encoded
+_ENCODED_RANGES = ((0, 0x7f), (0x80, 0x7ff), (0x800, 0xd7ff), (0xe000, 0xffff),
+                   (0x10000, 0x10ffff))
+
+# The character classes of the bytes regexes, as `(name, text class, flags,
+# run)`, see `utf8_class()`
+CHAR_CLASSES = (
+    ('at_sign', itp.AT_SIGNS, 0, False),
+    ('username', '[a-z0-9_.]', itp.username_flags, False),
+    ('list_start', '[a-z]', itp.username_flags, False),
+    ('list', r'[a-z0-9\x80-\xFF-]', itp.username_flags, False),
+    ('space', itp.SPACES, 0, False),
+    ('reply', '[a-z0-9_]', re.IGNORECASE, False),
+    ('hash_sign', '[#\uff03]', 0, False),
+    ('tag', '[%s]' % itp.UTF_CHARS, re.IGNORECASE, False),
+    ('domain', r'[^\s_\!\/]', re.IGNORECASE, False),
+    ('domain_run', r'[^\s_\!\/]', re.IGNORECASE, True),
+    ('tld', '[a-z]', re.IGNORECASE, False),
+    ('port', '[0-9]', re.IGNORECASE, False),
+    ('path', itp.PATH_CHAR, re.IGNORECASE, False),
+    ('path_ending', itp.PATH_ENDING_CHARS, re.IGNORECASE, False),
+    ('query', itp.QUERY_CHARS, re.IGNORECASE, False),
+    ('query_ending', itp.QUERY_ENDING_CHARS, re.IGNORECASE, False),
+    ('emoji_suffix', EMOJI_SUFFIX[:-1], 0, False),
+)
+
+
+def all_code_points():
+    """Return a string of every code point, to find the code points of a class in"""
+    try:
+        if array('I').itemsize != 4:
+            raise LookupError('no 32 bit array type')
+        return array('I', range(sys.maxunicode + 1)).tobytes().decode(
+            'utf-32-le' if sys.byteorder == 'little' else 'utf-32-be', 'surrogatepass')
+    except (AttributeError, LookupError, UnicodeDecodeError):  # Python 2
+        return ''.join(unichr(value) for value in range(sys.maxunicode + 1))
+
+
+def code_point_ranges(char_class, flags=0, code_points=None):
+    """Return the `(first, last)` ranges of code points a character class
+    matches, `code_points` being the result of `all_code_points()`"""
+    if code_points is None:
+        code_points = all_code_points()
+    runs = re.finditer('(?:%s)+' % char_class, code_points, flags)
+    return [(run.start(), run.end() - 1) for run in runs]
+
+
+def _encode(value):
+    return bytearray(code_point(value).encode('utf-8'))
+
+
+def utf8_sequences(first, last):
+    """Return lists of `(low, high)` byte ranges, one per byte, that match
+    the UTF-8 encodings of the code points first to last"""
+    sequences = []
+    for low, high in _ENCODED_RANGES:
+        if first <= high and last >= low:
+            sequences.extend(_split(max(first, low), min(last, high)))
+    return sequences
+
+
+def _split(first, last):
+    """Split a range of code points with encodings of the same length until
+    every byte of the encodings ranges independently"""
+    length = len(_encode(first))
+    for i in range(1, length):
+        mask = (1 << (6 * i)) - 1
+        if first & ~mask != last & ~mask:
+            if first & mask:
+                return _split(first, first | mask) + _split((first | mask) + 1, last)
+            if last & mask != mask:
+                return _split(first, (last & ~mask) - 1) + _split(last & ~mask, last)
+    return [list(zip(_encode(first), _encode(last)))]
+
+
+def _byte_range(low, high):
+    if low == high:
+        return '\\x%02x' % low
+    return '\\x%02x-\\x%02x' % (low, high)
+
+
+def utf8_class(char_class, flags=0, run=False, code_points=None):
+    """Return a bytes regex, as text, matching one UTF-8 encoded character of
+    a text character class compiled with `flags`
+
+    With `run` ASCII characters are matched a run at a time, which is only
+    safe in a regex that repeats the class and never backtracks into it.
+    """
+    single = []
+    alternatives = []
+    for first, last in code_point_ranges(char_class, flags, code_points):
+        for sequence in utf8_sequences(first, last):
+            if len(sequence) == 1:
+                single.append(_byte_range(*sequence[0]))
+            else:
+                alternatives.append(''.join(
+                    '\\x%02x' % low if low == high else '[%s]' % _byte_range(low, high)
+                    for low, high in sequence))
+    if run and single:
+        alternatives.insert(0, '[%s]+' % ''.join(single))
+    elif len(single) == 1 and '-' not in single[0]:
+        # A literal, so the regex engine can skip to its possible first bytes
+        alternatives.insert(0, single[0])
+    elif single:
+        alternatives.insert(0, '[%s]' % ''.join(single))
+    if len(alternatives) == 1 and single:
+        return alternatives[0]
+    return '(?:%s)' % '|'.join(alternatives)
+
+
+def byte_classes(generated=True):
+    """Return the bytes regex of every class of CHAR_CLASSES by name
+
+    Classes are taken from `itp.utf8_classes` where that is up to date,
+    on Python 3, which they were generated with.
+    """
+    tables = {}
+    if generated and sys.version_info >= (3, 0):
+        try:
+            from .utf8_classes import BYTE_CLASSES as tables
+        except ImportError:
+            pass
+    classes = {}
+    code_points = None
+    for name, char_class, flags, run in CHAR_CLASSES:
+        entry = tables.get(name)
+        if entry is not None and entry[:3] == (char_class, int(flags), run):
+            classes[name] = entry[3]
+            continue
+        if code_points is None:
+            code_points = all_code_points()
+        classes[name] = utf8_class(char_class, flags, run, code_points)
+    return classes
+
+
+def write_byte_classes(path=None):
+    """Convert every class of CHAR_CLASSES and write them to `itp.utf8_classes`"""
+    if path is None:
+        path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'utf8_classes.py')
+    classes = byte_classes(generated=False)
+    with io.open(path, 'w', encoding='utf-8') as f:
+        f.write('# -*- coding: utf-8 -*-\n'
+                '# Generated by `python -m itp.utf8` from the classes of itp.utf8, do not edit\n'
+                'from __future__ import unicode_literals\n\n'
+                '# Name: (text class, flags, run, bytes regex)\n'
+                'BYTE_CLASSES = {\n')
+        for name, char_class, flags, run in CHAR_CLASSES:
+            f.write('    %r: (\n        %s, %d, %r,\n        %s),\n'
+                    % (name, _literal(char_class), flags, run, _literal(classes[name])))
+        f.write('}\n')
+
+
+def _literal(value, width=100):
+    """Return a string literal of value, split into lines of at most width"""
+    pieces = ['']
+    for char in value:
+        if pieces[-1] and len(repr(pieces[-1] + char)) > width:
+            pieces.append('')
+        pieces[-1] += char
+    return '\n        '.join(repr(piece) for piece in pieces)
+
+
+def _compile(expression, flags=0):
+    return re.compile(expression.encode('latin-1'), flags)
+
+
+_CLASSES = byte_classes()
+
+# Users
+_AT_SIGN = _CLASSES['at_sign']
+USERNAME_REGEX = _compile(r'\B%s(%s{1,30})(/%s%s{0,79})?' % (
+    _AT_SIGN, _CLASSES['username'], _CLASSES['list_start'], _CLASSES['list']))
+REPLY_REGEX = _compile('^%s*%s(%s{1,20})' % (_CLASSES['space'], _AT_SIGN, _CLASSES['reply']))
+
+# Hashtags
+HASHTAG_REGEX = _compile('%s(%s+)' % (_CLASSES['hash_sign'], _CLASSES['tag']))
+
+# URLs, with the same groups as `itp.URL_REGEX`. The character in front of
+# a URL is matched as a single byte: `find_urls()` tries a match from the
+# byte before the protocol, which may be the last byte of a character.
+URL_REGEX = _compile(r'((%s)((https?://|www\.)(%s)(/(%s*%s)?)?(\?%s*%s)?))' % (
+    r'(?:[^/"\':!=]|^|\:)',
+    r'%s+\.%s{2,}(?::%s+)?' % (_CLASSES['domain'], _CLASSES['tld'], _CLASSES['port']),
+    r'(?:%s|\.%s)' % (_CLASSES['path'], _CLASSES['path']),
+    _CLASSES['path_ending'], _CLASSES['query'], _CLASSES['query_ending']), re.IGNORECASE)
+URL_SYNTAX = (URL_REGEX, _compile(r'https?://|www\.', re.IGNORECASE),
+              _compile('%s*' % _CLASSES['domain_run']), _compile('%s{2}' % _CLASSES['tld']),
+              itp.PRE_EXCLUDED_CHARS.encode('ascii'), b'.')
+URL_TRIGGER_REGEX = _compile(r'://|www\.', re.IGNORECASE)
+IANA_DOMAINS = frozenset(domain.encode('ascii') for domain in IANA_ONE_LETTER_DOMAINS)
+
+
+def _latin1(text):
+    """Return the UTF-8 encoding of text with every byte as a character"""
+    return text.encode('utf-8').decode('latin-1')
+
+
+# Emojis, from a trie of their UTF-8 bytes. Every alternative starts with a
+# literal byte, so the regex engine skips ahead to possible first bytes.
+_EMOJI_TRIE = build_trie(_latin1(sequence) for sequence in emoji_sequences())
+EMOJI_REGEX = _compile('((?:%s)%s?)' % (
+    trie_expression(_EMOJI_TRIE), _CLASSES['emoji_suffix']))
+# Modified emojis and ZWJ sequences as one emoji, see `itp.emoji`
+_SEQUENCE_EMOJI = '(?:%s)(?:%s)?(?:%s)?' % (
+    trie_expression(_EMOJI_TRIE),
+    trie_expression(build_trie(_latin1(code_point(value)) for value in FITZPATRICK_MODIFIERS)),
+    trie_expression(build_trie(_latin1(unichr(value)) for value in VARIATION_SELECTORS)))
+EMOJI_SEQUENCE_REGEX = _compile('(%s(?:%s%s)*(?:%s)?)' % (
+    _SEQUENCE_EMOJI, _latin1(ZWJ), _SEQUENCE_EMOJI, _latin1(ZWJ)))
+FITZPATRICK_EMOJIS = frozenset(code_point(value).encode('utf-8') for value in FITZPATRICK_MODIFIERS)
+
+
+try:
+    b''.isascii  # Python 3.7+
+
+    def _is_ascii(data):
+        return data.isascii()
+
+except AttributeError:
+    _NON_ASCII_REGEX = re.compile(b'[\x80-\xff]')
+
+    def _is_ascii(data):
+        return _NON_ASCII_REGEX.search(data) is None
+
+
+_CONTINUATION_REGEX = re.compile(b'[\x80-\xbf]')
+
+
+def _length(data):
+    """Return the number of characters in UTF-8 data"""
+    return len(data) - len(_CONTINUATION_REGEX.findall(data))
+
+
+def _has_url_trigger(data):
+    return URL_TRIGGER_REGEX.search(data) is not None
+
+
+def _has_at_sign(data):
+    return b'@' in data or b'\xef\xbc\xa0' in data
+
+
+def _has_hash_sign(data):
+    return b'#' in data or b'\xef\xbc\x83' in data
+
+
+def _has_non_ascii(data):
+    return not _is_ascii(data)
+
+
+def _find_urls(data):
+    return find_urls(data, URL_SYNTAX)
+
+
+class _Handlers(object):
+
+    """The handlers of the bytes passes, for one parser"""
+    __slots__ = ('parser',)
+
+    def __init__(self, parser):
+        self.parser = parser
+
+    def _parse_urls(self, ctx, match):
+        domain = match.group(5)
+        if domain[:1] in (b'.', b'-'):
+            return
+        if domain[-4:].lower() in (b'.com', b'.org', b'.net') and _length(domain) == 5 \
+           and bytes(domain.lower()) not in IANA_DOMAINS:
+            return
+        start, end = match.span(3)
+        ctx.entities.extend((URL_ENTITY, start, end))
+
+    def _parse_users(self, ctx, match):
+        if match.group(2) is not None:
+            return
+        username, extra = self.parser._parse_username(match.group(1).decode('ascii'))
+        if username:
+            ctx.entities.extend((USER_ENTITY, match.start(0), match.start(1) + len(username)))
+
+    def _parse_tags(self, ctx, match):
+        start, end = match.span(0)
+        ctx.entities.extend((TAG_ENTITY, start, end))
+
+    def _parse_emojis(self, ctx, match):
+        start, end = match.span(0)
+        if end - start != 4 or bytes(match.group(0)) not in FITZPATRICK_EMOJIS:
+            ctx.entities.extend((EMOJI_ENTITY, start, end))
+
+
+# The bytes version of `Parser._passes`, with the handlers of `_Handlers`
+_PASSES = (
+    (URL_ENTITY, _has_url_trigger, _find_urls, '_parse_urls'),
+    (USER_ENTITY, _has_at_sign, USERNAME_REGEX.finditer, '_parse_users'),
+    (TAG_ENTITY, _has_hash_sign, HASHTAG_REGEX.finditer, '_parse_tags'),
+    (EMOJI_ENTITY, _has_non_ascii, EMOJI_REGEX.finditer, '_parse_emojis'))
+_SEQUENCE_PASSES = _PASSES[:EMOJI_ENTITY] + (
+    (EMOJI_ENTITY, _has_non_ascii, EMOJI_SEQUENCE_REGEX.finditer, '_parse_emojis'),)
+
+
+def scan(parser, ctx, data):
+    """Run the bytes entity matchers of a Parser over UTF-8 data
+
+    Like `Parser._scan()`, with offsets in bytes. The parser's entity
+    selection, pre-filter, instrumentation and `max_text_length`, as a
+    number of bytes, are used, its `_parse_*` methods are not.
+    """
+    max_length = parser._max_text_length
+    if max_length is not None and len(data) > max_length:
+        # Do not cut a character in two
+        while max_length > 0 and _CONTINUATION_REGEX.match(data, max_length):
+            max_length -= 1
+        data = data[:max_length]
+    passes = _SEQUENCE_PASSES if parser._emoji_sequences else _PASSES
+    return parser._run_passes(ctx, data, passes, _Handlers(parser))
+
+
+def entity_values(data, entities, kind, include_spans=False):
+    """Return the decoded values of one kind of entity records over data"""
+    # Records are grouped by kind, take the columns of this kind at once
+    kinds = entities[0::3]
+    if kind not in kinds:
+        return []
+    first = kinds.index(kind)
+    last = first + kinds.count(kind)
+    starts = entities[3 * first + 1:3 * last:3]
+    ends = entities[3 * first + 2:3 * last:3]
+    if kind == USER_ENTITY or kind == TAG_ENTITY:
+        # Leave out the sign, `#` or `@` or their 3 byte full width forms
+        value_starts = [start + (1 if data[start:start + 1] < b'\x80' else 3) for start in starts]
+    else:
+        value_starts = starts
+    values = [data[start:end].decode('utf-8') for start, end in zip(value_starts, ends)]
+    if include_spans:
+        return list(zip(values, zip(starts, ends)))
+    return values
+
+
+def reply(data):
+    """Return the username UTF-8 data is a reply to"""
+    match = REPLY_REGEX.match(data)
+    return bytes(match.group(1)).decode('utf-8') if match is not None else None
+
+
+class BytesParseResult(ParseResult):
+
+    """The result of `Parser.parse_bytes()`
+
+    Spans are byte offsets into the parsed data, values are decoded one by
+    one. There is no HTML.
+    """
+
+    __slots__ = ()
+
+    def _values(self, kind):
+        return entity_values(self._text, self._entities, kind, self._parser._include_spans)
+
+    reply = _lazy_attribute(
+        '_reply', lambda result: reply(result._text) if result._parser._extract[USER_ENTITY] else None,
+        'The username replied to, or None.')
+
+    @property
+    def utf16_entities(self):
+        raise ValueError('results of bytes have byte offsets, decode the input and parse it instead')
+
+    def render(self, renderer=None):
+        raise ValueError('results of bytes cannot be rendered, decode the input and parse it instead')
+
+
+if __name__ == '__main__':
+    write_byte_classes()
@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+# Generated by `python -m itp.utf8` from the classes of itp.utf8, do not edit
+from __future__ import unicode_literals
+
+# Name: (text class, flags, run, bytes regex)
+BYTE_CLASSES = {
+    'at_sign': (
+        '[@\\uff20]', 0, False,
+        '(?:\\x40|\\xef\\xbc\\xa0)'),
+    'username': (
+        '[a-z0-9_.]', 258, False,
+        '[\\x2e\\x30-\\x39\\x41-\\x5a\\x5f\\x61-\\x7a]'),
+    'list_start': (
+        '[a-z]', 258, False,
+        '[\\x41-\\x5a\\x61-\\x7a]'),
+    'list': (
+        '[a-z0-9\\x80-\\xFF-]', 258, False,
+        '(?:[\\x2d\\x30-\\x39\\x41-\\x5a\\x61-\\x7a]|[\\xc2-\\xc3][\\x80-\\xbf])'),
+    'space': (
+        '[\\u0020\\u00A0\\u1680\\u180E\\u2002-\\u202F\\u205F\\u2060\\u3000]', 0, False,
+        '(?:\\x20|\\xc2\\xa0|\\xe1\\x9a\\x80|\\xe1\\xa0\\x8e|\\xe2\\x80[\\x82-\\xaf]|\\xe2\\x81[\\x9f-\\xa0'
+        ']|\\xe3\\x80\\x80)'),
+    'reply': (
+        '[a-z0-9_]', 2, False,
+        '(?:[\\x30-\\x39\\x41-\\x5a\\x5f\\x61-\\x7a]|\\xc4[\\xb0-\\xb1]|\\xc5\\xbf|\\xe2\\x84\\xaa)'),
+    'hash_sign': (
+        '[#＃]', 0, False,
+        '(?:\\x23|\\xef\\xbc\\x83)'),
+    'tag': (
+        '[a-z0-9_\\u00c0-\\u00d6\\u00d8-\\u00f6\\u00f8-\\u00ff\\uac00-\\ud7a3]', 2, False,
+        '(?:[\\x30-\\x39\\x41-\\x5a\\x5f\\x61-\\x7a]|\\xc3[\\x80-\\x96]|\\xc3[\\x98-\\xb6]|\\xc3[\\xb8-\\xb'
+        'f]|\\xc4[\\xb0-\\xb1]|\\xc5\\xb8|\\xc5\\xbf|\\xe1\\xba\\x9e|\\xe2\\x84[\\xaa-\\xab]|\\xea[\\xb0-\\'
+        'xbf][\\x80-\\xbf]|[\\xeb-\\xec][\\x80-\\xbf][\\x80-\\xbf]|\\xed[\\x80-\\x9d][\\x80-\\xbf]|\\xed\\x'
+        '9e[\\x80-\\xa3])'),
+    'domain': (
+        '[^\\s_\\!\\/]', 2, False,
+        '(?:[\\x00-\\x08\\x0e-\\x1b\\x22-\\x2e\\x30-\\x5e\\x60-\\x7f]|\\xc2[\\x80-\\x84]|\\xc2[\\x86-\\x9f]'
+        '|\\xc2[\\xa1-\\xbf]|[\\xc3-\\xdf][\\x80-\\xbf]|\\xe0[\\xa0-\\xbf][\\x80-\\xbf]|\\xe1[\\x80-\\x99]['
+        '\\x80-\\xbf]|\\xe1\\x9a[\\x81-\\xbf]|\\xe1[\\x9b-\\xbf][\\x80-\\xbf]|\\xe2\\x80[\\x8b-\\xa7]|\\xe2'
+        '\\x80[\\xaa-\\xae]|\\xe2\\x80[\\xb0-\\xbf]|\\xe2\\x81[\\x80-\\x9e]|\\xe2\\x81[\\xa0-\\xbf]|\\xe2['
+        '\\x82-\\xbf][\\x80-\\xbf]|\\xe3\\x80[\\x81-\\xbf]|\\xe3[\\x81-\\xbf][\\x80-\\xbf]|[\\xe4-\\xec][\\'
+        'x80-\\xbf][\\x80-\\xbf]|\\xed[\\x80-\\x9f][\\x80-\\xbf]|[\\xee-\\xef][\\x80-\\xbf][\\x80-\\xbf]|\\'
+        'xf0[\\x90-\\xbf][\\x80-\\xbf][\\x80-\\xbf]|[\\xf1-\\xf3][\\x80-\\xbf][\\x80-\\xbf][\\x80-\\xbf]|\\'
+        'xf4[\\x80-\\x8f][\\x80-\\xbf][\\x80-\\xbf])'),
+    'domain_run': (
+        '[^\\s_\\!\\/]', 2, True,
+        '(?:[\\x00-\\x08\\x0e-\\x1b\\x22-\\x2e\\x30-\\x5e\\x60-\\x7f]+|\\xc2[\\x80-\\x84]|\\xc2[\\x86-\\x9f'
+        ']|\\xc2[\\xa1-\\xbf]|[\\xc3-\\xdf][\\x80-\\xbf]|\\xe0[\\xa0-\\xbf][\\x80-\\xbf]|\\xe1[\\x80-\\x99]'
+        '[\\x80-\\xbf]|\\xe1\\x9a[\\x81-\\xbf]|\\xe1[\\x9b-\\xbf][\\x80-\\xbf]|\\xe2\\x80[\\x8b-\\xa7]|\\xe'
+        '2\\x80[\\xaa-\\xae]|\\xe2\\x80[\\xb0-\\xbf]|\\xe2\\x81[\\x80-\\x9e]|\\xe2\\x81[\\xa0-\\xbf]|\\xe2['
+        '\\x82-\\xbf][\\x80-\\xbf]|\\xe3\\x80[\\x81-\\xbf]|\\xe3[\\x81-\\xbf][\\x80-\\xbf]|[\\xe4-\\xec][\\'
+        'x80-\\xbf][\\x80-\\xbf]|\\xed[\\x80-\\x9f][\\x80-\\xbf]|[\\xee-\\xef][\\x80-\\xbf][\\x80-\\xbf]|\\'
+        'xf0[\\x90-\\xbf][\\x80-\\xbf][\\x80-\\xbf]|[\\xf1-\\xf3][\\x80-\\xbf][\\x80-\\xbf][\\x80-\\xbf]|\\'
+        'xf4[\\x80-\\x8f][\\x80-\\xbf][\\x80-\\xbf])'),
+    'tld': (
+        '[a-z]', 2, False,
+        '(?:[\\x41-\\x5a\\x61-\\x7a]|\\xc4[\\xb0-\\xb1]|\\xc5\\xbf|\\xe2\\x84\\xaa)'),
+    'port': (
+        '[0-9]', 2, False,
+        '[\\x30-\\x39]'),
+    'path': (
+        "[a-z0-9_\\u00c0-\\u00d6\\u00d8-\\u00f6\\u00f8-\\u00ff\\uac00-\\ud7a3!\\*\\'\\(\\);:=\\+\\$/%#\\[\\"
+        ']\\-_,~@]', 2, False,
+        '(?:[\\x21\\x23-\\x25\\x27-\\x2d\\x2f-\\x3b\\x3d\\x40-\\x5b\\x5d\\x5f\\x61-\\x7a\\x7e]|\\xc3[\\x80-'
+        '\\x96]|\\xc3[\\x98-\\xb6]|\\xc3[\\xb8-\\xbf]|\\xc4[\\xb0-\\xb1]|\\xc5\\xb8|\\xc5\\xbf|\\xe1\\xba\\'
+        'x9e|\\xe2\\x84[\\xaa-\\xab]|\\xea[\\xb0-\\xbf][\\x80-\\xbf]|[\\xeb-\\xec][\\x80-\\xbf][\\x80-\\xbf'
+        ']|\\xed[\\x80-\\x9d][\\x80-\\xbf]|\\xed\\x9e[\\x80-\\xa3])'),
+    'path_ending': (
+        '[a-z0-9_\\u00c0-\\u00d6\\u00d8-\\u00f6\\u00f8-\\u00ff\\uac00-\\ud7a3\\)=#/]', 2, False,
+        '(?:[\\x23\\x29\\x2f-\\x39\\x3d\\x41-\\x5a\\x5f\\x61-\\x7a]|\\xc3[\\x80-\\x96]|\\xc3[\\x98-\\xb6]|'
+        '\\xc3[\\xb8-\\xbf]|\\xc4[\\xb0-\\xb1]|\\xc5\\xb8|\\xc5\\xbf|\\xe1\\xba\\x9e|\\xe2\\x84[\\xaa-\\xab'
+        ']|\\xea[\\xb0-\\xbf][\\x80-\\xbf]|[\\xeb-\\xec][\\x80-\\xbf][\\x80-\\xbf]|\\xed[\\x80-\\x9d][\\x80'
+        '-\\xbf]|\\xed\\x9e[\\x80-\\xa3])'),
+    'query': (
+        "[a-z0-9!\\*\\'\\(\\);:&=\\+\\$/%#\\[\\]\\-_\\.,~]", 2, False,
+        '(?:[\\x21\\x23-\\x3b\\x3d\\x41-\\x5b\\x5d\\x5f\\x61-\\x7a\\x7e]|\\xc4[\\xb0-\\xb1]|\\xc5\\xbf|\\xe'
+        '2\\x84\\xaa)'),
+    'query_ending': (
+        '[a-z0-9_&=#]', 2, False,
+        '(?:[\\x23\\x26\\x30-\\x39\\x3d\\x41-\\x5a\\x5f\\x61-\\x7a]|\\xc4[\\xb0-\\xb1]|\\xc5\\xbf|\\xe2\\x8'
+        '4\\xaa)'),
+    'emoji_suffix': (
+        '[︀-️\u200d]', 0, False,
+        '(?:\\xe2\\x80\\x8d|\\xef\\xb8[\\x80-\\x8f])'),
+}
@@ -2,26 +2,229 @@
 # -*- coding: utf-8 -*-
 """Unwind short-links e.g. bit.ly, t.co etc to their canonical links"""
 from __future__ import unicode_literals, print_function
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
 import requests
+from requests.adapters import HTTPAdapter
+
+try:
+    from urllib.parse import urljoin, urlsplit  # Python3
+except ImportError:
+    from urlparse import urljoin, urlsplit
+
+REDIRECT_CODES = (301, 302, 303, 307, 308)
+
+DAY = 24 * 60 * 60
+
+
+class ShortlinkCache(object):
+    """Remember resolved shortlinks in memory and, optionally, on disk
+
+    The in-process tier keeps the `maxsize` most recently used links. If a
+    `path` is given, links are also stored in an sqlite database there so
+    they survive between runs. Resolved links expire after `ttl` seconds,
+    dead links (an empty list) after `negative_ttl` seconds; a ttl of None
+    never expires.
+
+    Any object with the same `get(shortlink)` and `set(shortlink, urls)`
+    methods can be passed to a ShortlinkResolver instead.
+    """
+
+    def __init__(self, maxsize=10000, path=None, ttl=30 * DAY, negative_ttl=DAY):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+        if path is not None:
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute('CREATE TABLE IF NOT EXISTS shortlinks '
+                             '(shortlink TEXT PRIMARY KEY, urls TEXT, expires REAL)')
+            self._db.commit()
+        self.reset_stats()
+
+    def get(self, shortlink):
+        """Return the cached list of URLs for a shortlink, or None"""
+        now = time.time()
+        with self._lock:
+            entry = self._memory.pop(shortlink, None)
+            if entry is not None and (entry[1] is None or entry[1] > now):
+                self._memory[shortlink] = entry
+                self._hits += 1
+                return list(entry[0])
+
+            if self._db is not None:
+                row = self._db.execute('SELECT urls, expires FROM shortlinks WHERE shortlink = ?',
+                                       (shortlink,)).fetchone()
+                if row is not None and (row[1] is None or row[1] > now):
+                    urls = json.loads(row[0])
+                    self._remember(shortlink, (urls, row[1]))
+                    self._disk_hits += 1
+                    return list(urls)
+
+            self._misses += 1
+            return None
+
+    def set(self, shortlink, urls):
+        """Cache the list of URLs a shortlink resolved to"""
+        ttl = self.ttl if urls else self.negative_ttl
+        expires = None if ttl is None else time.time() + ttl
+        urls = list(urls)
+        with self._lock:
+            self._memory.pop(shortlink, None)
+            self._remember(shortlink, (urls, expires))
+            if self._db is not None:
+                self._db.execute('INSERT OR REPLACE INTO shortlinks VALUES (?, ?, ?)',
+                                 (shortlink, json.dumps(urls), expires))
+                self._db.commit()
+
+    def _remember(self, shortlink, entry):
+        self._memory[shortlink] = entry
+        while len(self._memory) > self.maxsize:
+            self._memory.popitem(last=False)
+
+    def clear(self):
+        """Forget every cached link, on disk too"""
+        with self._lock:
+            self._memory.clear()
+            if self._db is not None:
+                self._db.execute('DELETE FROM shortlinks')
+                self._db.commit()
+
+    def close(self):
+        """Close the on-disk database"""
+        if self._db is not None:
+            self._db.close()
+            self._db = None
 
+    def stats(self):
+        """Return the number of memory hits, disk hits and misses"""
+        return {'hits': self._hits, 'disk_hits': self._disk_hits, 'misses': self._misses}
 
-def follow_shortlinks(shortlinks):
-    """Follow redirects in list of shortlinks, return dict of resulting URLs"""
-    links_followed = {}
-    for shortlink in shortlinks:
+    def reset_stats(self):
+        self._hits = 0
+        self._disk_hits = 0
+        self._misses = 0
+
+
+class ShortlinkResolver(object):
+    """Follow the redirects of many shortlinks concurrently
+
+    Links are resolved on a pool of `max_workers` threads sharing one
+    keep-alive session, with at most `max_per_host` requests to the same
+    host at a time. Every hop is asked for with HEAD first, falling back to
+    GET for servers that do not allow HEAD. `timeout` is passed on to
+    requests, so it may be a `(connect, read)` tuple. A link redirected more
+    than `max_redirects` times, like with requests, resolves to an empty list.
+
+    Pass a ShortlinkCache as `cache` to only resolve links not seen before.
+    """
+
+    def __init__(self, max_workers=10, max_per_host=2, timeout=5,
+                 max_redirects=10, session=None, cache=None):
+        self.max_workers = max_workers
+        self.max_per_host = max_per_host
+        self.timeout = timeout
+        self.max_redirects = max_redirects
+        self.cache = cache
+        self._own_session = session is None
+        self.session = self._session() if session is None else session
+        self._host_locks = {}
+        self._host_locks_lock = threading.Lock()
+
+    def _session(self):
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=self.max_workers,
+                              pool_maxsize=self.max_workers)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        return session
+
+    def close(self):
+        """Close the session, unless it was passed in"""
+        if self._own_session:
+            self.session.close()
+
+    def resolve(self, shortlinks):
+        """Follow redirects in list of shortlinks, return dict of resulting URLs
+
+        Every shortlink maps to the list of URLs visited, starting with the
+        shortlink itself, or to an empty list if it could not be resolved.
+        """
+        shortlinks = list(dict.fromkeys(shortlinks))
+        resolved = {}
+        if self.cache is not None:
+            for shortlink in shortlinks:
+                urls = self.cache.get(shortlink)
+                if urls is not None:
+                    resolved[shortlink] = urls
+            shortlinks = [shortlink for shortlink in shortlinks if shortlink not in resolved]
+        if not shortlinks:
+            return resolved
+
+        workers = min(self.max_workers, len(shortlinks))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for shortlink, urls in zip(shortlinks, executor.map(self.follow, shortlinks)):
+                resolved[shortlink] = urls
+                if self.cache is not None:
+                    self.cache.set(shortlink, urls)
+        return resolved
+
+    def follow(self, shortlink):
+        """Return the list of URLs a single shortlink redirects through"""
+        all_urls = [shortlink]
         url = shortlink
-        request_result = requests.get(url)
-        redirect_history = request_result.history
-        # history might look like:
-        # (<Response [301]>, <Response [301]>)
-        # where each response object has a URL
-        all_urls = []
-        for redirect in redirect_history:
-            all_urls.append(redirect.url)
-        # append the final URL that we finish with
-        all_urls.append(request_result.url)
-        links_followed[shortlink] = all_urls
-    return links_followed
+        try:
+            # One request per redirect, plus the one that is not redirected
+            for _ in range(self.max_redirects + 1):
+                response = self._request(url)
+                location = response.headers.get('location')
+                if response.status_code not in REDIRECT_CODES or not location:
+                    return all_urls
+                url = urljoin(url, location)
+                all_urls.append(url)
+        except requests.RequestException:
+            return []
+        # Too many redirects
+        return []
+
+    def _request(self, url):
+        """Ask for a URL without following redirects, HEAD first"""
+        with self._host_lock(url):
+            response = self.session.head(url, allow_redirects=False,
+                                         timeout=self.timeout)
+            response.close()
+            if response.status_code in (405, 501):
+                response = self.session.get(url, allow_redirects=False,
+                                            timeout=self.timeout, stream=True)
+                response.close()
+        return response
+
+    def _host_lock(self, url):
+        host = urlsplit(url).netloc.lower()
+        with self._host_locks_lock:
+            lock = self._host_locks.get(host)
+            if lock is None:
+                lock = self._host_locks[host] = threading.BoundedSemaphore(self.max_per_host)
+        return lock
+
+
+def follow_shortlinks(shortlinks, **kwargs):
+    """Follow redirects in list of shortlinks, return dict of resulting URLs
+
+    Keyword arguments are passed on to ShortlinkResolver.
+    """
+    resolver = ShortlinkResolver(**kwargs)
+    try:
+        return resolver.resolve(shortlinks)
+    finally:
+        resolver.close()
 
 
 if __name__ == "__main__":
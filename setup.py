@@ -9,10 +9,13 @@ setup(
     author_email='itp@takumihq.com',
     url='https://github.com/takumihq/instagram-text-python',
     license='MIT',
-    packages=['itp'],
+    packages=['itp', 'itp.benchmarks'],
     include_package_data=True,
     zip_safe=False,
     install_requires=[],
+    entry_points={
+        'console_scripts': ['itp = itp.cli:main'],
+    },
     classifiers=[
         'Environment :: Console',
         'Intended Audience :: Developers',